@@ -13,6 +13,12 @@ import './modules/likes/likeHandler.js';
 // Import follow handler for event delegation (must be loaded immediately)
 import './follow.js';
 
+// Apply per-viewer like/follow state to cached post cards
+import './modules/viewerState.js';
+
+// Load further pages of cursor-paginated grids on scroll
+import './modules/infiniteScroll.js';
+
 // Export utilities for potential use in other modules
 export { getCsrfToken } from './utils/csrf.js';
 export { ajaxGet, ajaxPost, ajaxWithLoading } from './utils/ajax.js';
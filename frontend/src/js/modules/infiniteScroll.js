@@ -0,0 +1,69 @@
+/**
+ * Infinite scroll for cursor-paginated grids
+ * A link with data-infinite-scroll="<container id>" points to the next page.
+ * When it scrolls into view, the next page is fetched and its items are
+ * appended to the container; the link then moves on to the following page.
+ * Without JavaScript the link still works as plain pagination.
+ */
+
+/**
+ * Fetch the next page and append its items
+ * @param {HTMLAnchorElement} link - Next page link
+ * @returns {Promise<boolean>} Whether there are more pages
+ */
+export async function loadNextPage(link) {
+  const containerId = link.dataset.infiniteScroll;
+  const container = document.getElementById(containerId);
+  if (!container) return false;
+
+  const response = await fetch(link.href, { credentials: 'same-origin' });
+  if (!response.ok) {
+    throw new Error(`Failed to load ${link.href}: ${response.status}`);
+  }
+
+  const page = new DOMParser().parseFromString(await response.text(), 'text/html');
+  const items = page.getElementById(containerId);
+  if (items) {
+    container.append(...items.children);
+  }
+
+  const next = page.querySelector(`[data-infinite-scroll="${containerId}"]`);
+  if (!next) {
+    link.remove();
+    return false;
+  }
+  link.href = next.href;
+  return true;
+}
+
+/**
+ * Follow next page links as they scroll into view
+ * @param {Document|HTMLElement} root - Element to search in
+ */
+export function initInfiniteScroll(root = document) {
+  if (!('IntersectionObserver' in window)) return;
+
+  root.querySelectorAll('a[data-infinite-scroll]').forEach((link) => {
+    let loading = false;
+    const observer = new IntersectionObserver(async (entries) => {
+      if (loading || !entries.some((entry) => entry.isIntersecting)) return;
+      loading = true;
+      try {
+        if (!(await loadNextPage(link))) observer.disconnect();
+      } catch (error) {
+        // Leave the link in place so the user can follow it manually
+        console.error(error);
+        observer.disconnect();
+      } finally {
+        loading = false;
+      }
+    }, { rootMargin: '400px' });
+    observer.observe(link);
+  });
+}
+
+if (document.readyState === 'loading') {
+  document.addEventListener('DOMContentLoaded', () => initInfiniteScroll());
+} else {
+  initInfiniteScroll();
+}
@@ -0,0 +1,89 @@
+/**
+ * Per-viewer overlay for cached post cards
+ * Post card fragments are shared by all users, so like and follow state
+ * of the current viewer is applied here from the #viewer-state JSON
+ */
+
+import { updateLikeUI } from './likes/likeHandler.js';
+
+const FOLLOWING_CLASSES = [
+  'bg-gray-200',
+  'dark:bg-gray-700',
+  'text-gray-700',
+  'dark:text-gray-300',
+  'hover:bg-gray-300',
+  'dark:hover:bg-gray-600',
+];
+const NOT_FOLLOWING_CLASSES = ['bg-primary', 'text-white', 'hover:bg-opacity-90'];
+
+/**
+ * Read viewer state rendered by the json_script template filter
+ * @param {Document|HTMLElement} root - Element to search in
+ * @returns {Object|null} Viewer state or null when absent
+ */
+export function readViewerState(root = document) {
+  const element = root.querySelector('#viewer-state');
+  if (!element) return null;
+
+  try {
+    return JSON.parse(element.textContent);
+  } catch (error) {
+    console.error('Invalid viewer state:', error);
+    return null;
+  }
+}
+
+/**
+ * Set follow button text and classes
+ * @param {HTMLElement} button - Follow button element
+ * @param {boolean} following - Whether the viewer follows the author
+ */
+export function setFollowState(button, following) {
+  const text = following ? 'Unfollow' : 'Follow';
+  button.dataset.following = following ? 'true' : 'false';
+  button.dataset.originalText = text;
+  button.textContent = text;
+  button.classList.remove(...(following ? NOT_FOLLOWING_CLASSES : FOLLOWING_CLASSES));
+  button.classList.add(...(following ? FOLLOWING_CLASSES : NOT_FOLLOWING_CLASSES));
+}
+
+/**
+ * Apply viewer state to like and follow buttons of cached cards
+ * @param {Object} state - {user_id, liked_post_ids, following_ids}
+ * @param {Document|HTMLElement} root - Element to search in
+ */
+export function applyViewerState(state, root = document) {
+  if (!state) return;
+
+  const liked = new Set(state.liked_post_ids || []);
+  const following = new Set(state.following_ids || []);
+
+  root.querySelectorAll('.like-btn[data-post-id]').forEach((button) => {
+    const postId = Number(button.dataset.postId);
+    updateLikeUI(button, null, { liked: liked.has(postId) });
+  });
+
+  root.querySelectorAll('.follow-btn[data-author-id]').forEach((button) => {
+    const authorId = Number(button.dataset.authorId);
+    // Users never see a follow button on their own posts
+    if (authorId === state.user_id) {
+      button.remove();
+      return;
+    }
+    setFollowState(button, following.has(authorId));
+    button.classList.remove('hidden');
+  });
+}
+
+/**
+ * Apply viewer state found on the page
+ */
+export function initViewerState() {
+  applyViewerState(readViewerState());
+}
+
+if (document.readyState === 'loading') {
+  document.addEventListener('DOMContentLoaded', initViewerState);
+} else {
+  initViewerState();
+}
@@ -1,6 +1,7 @@
 // Post form functionality - Image upload, drag & drop, reordering
 import { getCsrfToken } from './utils/csrf.js';
 import { ajaxPost } from './utils/ajax.js';
+import { CONFIG } from './constants/config.js';
 
 // Export initialization function for dynamic import
 export function initPostForm() {
@@ -42,6 +43,115 @@ export function initPostForm() {
         });
     }
 
+    // =========================================================================
+    // HASHTAG SUGGESTIONS
+    // =========================================================================
+    const tagAutocompleteUrl = captionInput ? captionInput.dataset.tagAutocompleteUrl : null;
+    if (tagAutocompleteUrl) {
+        // Typeahead waits less than other debounced inputs
+        const SUGGEST_DELAY = 100;
+        const suggestionList = document.createElement('ul');
+        suggestionList.className = 'hidden absolute z-10 mt-1 w-64 bg-white border border-gray-200 rounded-lg shadow-lg text-sm';
+        captionInput.parentElement.classList.add('relative');
+        captionInput.insertAdjacentElement('afterend', suggestionList);
+        const suggestionCache = new Map();
+        let suggestTimer = null;
+        let activeSuggestion = -1;
+
+        // Hashtag being typed before the cursor, without "#"
+        const currentHashtag = function() {
+            const before = captionInput.value.slice(0, captionInput.selectionStart);
+            const match = before.match(/#(\w*)$/);
+            return match ? match[1] : null;
+        };
+
+        const hideSuggestions = function() {
+            suggestionList.classList.add('hidden');
+            suggestionList.replaceChildren();
+            activeSuggestion = -1;
+        };
+
+        const chooseSuggestion = function(name) {
+            const cursor = captionInput.selectionStart;
+            const before = captionInput.value.slice(0, cursor).replace(/#\w*$/, '#' + name + ' ');
+            captionInput.value = before + captionInput.value.slice(cursor);
+            captionInput.selectionStart = captionInput.selectionEnd = before.length;
+            captionInput.dispatchEvent(new Event('input'));
+            hideSuggestions();
+        };
+
+        const renderSuggestions = function(tags) {
+            hideSuggestions();
+            tags.forEach(function(tag) {
+                const item = document.createElement('li');
+                item.className = 'flex justify-between px-3 py-2 cursor-pointer hover:bg-gray-100';
+                item.dataset.name = tag.name;
+                const name = document.createElement('span');
+                name.textContent = '#' + tag.name;
+                const count = document.createElement('span');
+                count.className = 'text-gray-400';
+                count.textContent = tag.count;
+                item.append(name, count);
+                // mousedown fires before the textarea loses focus
+                item.addEventListener('mousedown', function(e) {
+                    e.preventDefault();
+                    chooseSuggestion(tag.name);
+                });
+                suggestionList.appendChild(item);
+            });
+            suggestionList.classList.toggle('hidden', tags.length === 0);
+        };
+
+        const suggest = async function(prefix) {
+            if (!suggestionCache.has(prefix)) {
+                const response = await fetch(tagAutocompleteUrl + '?q=' + encodeURIComponent(prefix));
+                if (!response.ok) {
+                    return;
+                }
+                suggestionCache.set(prefix, (await response.json()).results);
+            }
+            // Ignore answers to prefixes typed over meanwhile
+            if (currentHashtag() === prefix) {
+                renderSuggestions(suggestionCache.get(prefix));
+            }
+        };
+
+        captionInput.addEventListener('input', function() {
+            clearTimeout(suggestTimer);
+            const prefix = currentHashtag();
+            if (!prefix) {
+                hideSuggestions();
+                return;
+            }
+            suggestTimer = setTimeout(function() {
+                suggest(prefix).catch(hideSuggestions);
+            }, SUGGEST_DELAY);
+        });
+
+        captionInput.addEventListener('keydown', function(e) {
+            const items = suggestionList.children;
+            if (!items.length) {
+                return;
+            }
+            if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+                e.preventDefault();
+                if (activeSuggestion >= 0) {
+                    items[activeSuggestion].classList.remove('bg-gray-100');
+                }
+                const step = e.key === 'ArrowDown' ? 1 : items.length - 1;
+                activeSuggestion = (activeSuggestion + step) % items.length;
+                items[activeSuggestion].classList.add('bg-gray-100');
+            } else if ((e.key === 'Enter' || e.key === 'Tab') && activeSuggestion >= 0) {
+                e.preventDefault();
+                chooseSuggestion(items[activeSuggestion].dataset.name);
+            } else if (e.key === 'Escape') {
+                hideSuggestions();
+            }
+        });
+
+        captionInput.addEventListener('blur', hideSuggestions);
+    }
+
     // =========================================================================
     // DRAG & DROP REORDER FOR EXISTING IMAGES
     // =========================================================================
@@ -262,6 +372,131 @@ export function initPostForm() {
     // =========================================================================
     // FORM SUBMIT
     // =========================================================================
+    // New posts upload their images straight to storage with tickets
+    // from the server, and submit only the results
+    var uploadTicketsUrl = form.dataset.uploadTicketsUrl;
+    var directUploadFailed = false;
+
+    function uploadFile(file, slot) {
+        var request;
+        if (slot.backend === 'cloudinary') {
+            var body = new FormData();
+            Object.keys(slot.fields).forEach(function(name) {
+                body.append(name, slot.fields[name]);
+            });
+            body.append('file', file);
+            request = fetch(slot.url, { method: 'POST', body: body });
+        } else if (slot.resumable_url) {
+            return uploadResumable(file, slot).then(function(receipt) {
+                return JSON.stringify({ receipt: receipt });
+            });
+        } else {
+            request = fetch(slot.url, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': file.type,
+                    'X-CSRFToken': getCsrfToken(),
+                    'X-Upload-Ticket': slot.ticket
+                },
+                body: file
+            });
+        }
+        return request.then(function(response) {
+            if (!response.ok) {
+                throw new Error('Upload failed with status ' + response.status);
+            }
+            return response.json();
+        }).then(function(result) {
+            if (slot.backend === 'cloudinary') {
+                result.ticket = slot.ticket;
+                return JSON.stringify(result);
+            }
+            return JSON.stringify({ receipt: result.receipt });
+        });
+    }
+
+    // Resumable uploads send the file in chunks; after a failed chunk the
+    // server is asked how much arrived and the upload continues there
+    var CHUNK_SIZE = 1024 * 1024;
+
+    function uploadResumable(file, slot) {
+        var headers = { 'X-CSRFToken': getCsrfToken() };
+        var failures = 0;
+
+        function sendFrom(url, offset) {
+            return fetch(url, {
+                method: 'PATCH',
+                headers: Object.assign({
+                    'Content-Type': 'application/offset+octet-stream',
+                    'Upload-Offset': String(offset)
+                }, headers),
+                body: file.slice(offset, offset + CHUNK_SIZE)
+            }).then(function(response) {
+                if (!response.ok && response.status !== 409) {
+                    throw new Error('Chunk failed with status ' + response.status);
+                }
+                return response.json();
+            }).then(function(result) {
+                failures = 0;
+                if (result.receipt) {
+                    return result.receipt;
+                }
+                return sendFrom(url, result.offset);
+            }, function(error) {
+                failures += 1;
+                if (failures > CONFIG.RETRY_ATTEMPTS) {
+                    throw error;
+                }
+                return new Promise(function(resolve) {
+                    setTimeout(resolve, CONFIG.RETRY_DELAY * failures);
+                }).then(function() {
+                    return fetch(url, { method: 'HEAD', headers: headers });
+                }).then(function(response) {
+                    if (!response.ok) {
+                        throw error;
+                    }
+                    return sendFrom(url, parseInt(response.headers.get('Upload-Offset'), 10));
+                });
+            });
+        }
+
+        return fetch(slot.resumable_url, {
+            method: 'POST',
+            headers: Object.assign({
+                'Upload-Length': String(file.size),
+                'Upload-Metadata': 'filetype ' + btoa(file.type),
+                'X-Upload-Ticket': slot.ticket
+            }, headers)
+        }).then(function(response) {
+            if (!response.ok) {
+                throw new Error('Upload failed with status ' + response.status);
+            }
+            return sendFrom(response.headers.get('Location'), 0);
+        });
+    }
+
+    function uploadDirectly() {
+        return ajaxPost(uploadTicketsUrl, { count: newFiles.length }, {
+            errorMessage: 'Could not prepare the upload.'
+        }).then(function(data) {
+            return Promise.all(newFiles.map(function(file, index) {
+                return uploadFile(file, data.uploads[index]);
+            }));
+        }).then(function(results) {
+            formsetContainer.querySelectorAll('.new-image-input').forEach(function(inp) {
+                inp.remove();
+            });
+            results.forEach(function(result) {
+                var input = document.createElement('input');
+                input.type = 'hidden';
+                input.name = 'uploads';
+                input.value = result;
+                form.appendChild(input);
+            });
+            form.submit();
+        });
+    }
+
     form.addEventListener('submit', function(e) {
         // Don't prevent default if there are no new files - let form submit normally
         if (newFiles.length === 0) {
@@ -269,6 +504,17 @@ export function initPostForm() {
         }
 
         e.preventDefault();
+
+        if (uploadTicketsUrl && !directUploadFailed) {
+            uploadDirectly().catch(function(error) {
+                // Fall back to sending the files with the form
+                console.error('Direct upload failed:', error);
+                directUploadFailed = true;
+                form.requestSubmit();
+            });
+            return false;
+        }
+
         var existingCount = formsetContainer.querySelectorAll('.existing-delete-cb').length;
 
         // Ensure we have enough form fields for all new files
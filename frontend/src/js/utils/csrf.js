@@ -7,7 +7,22 @@ export function getCsrfToken() {
   const token =
     document.querySelector('[name=csrfmiddlewaretoken]')?.value ||
     document.querySelector('meta[name=csrf-token]')?.content ||
-    document.querySelector('[name=csrf-token]')?.content;
+    document.querySelector('[name=csrf-token]')?.content ||
+    getCookie('csrftoken');
   return token || null;
 }
 
+
+/**
+ * Get a cookie value by name
+ * @param {string} name - Cookie name
+ * @returns {string|null} Cookie value or null if not set
+ */
+function getCookie(name) {
+  const prefix = `${name}=`;
+  const cookie = document.cookie
+    .split(';')
+    .map((part) => part.trim())
+    .find((part) => part.startsWith(prefix));
+  return cookie ? decodeURIComponent(cookie.slice(prefix.length)) : null;
+}
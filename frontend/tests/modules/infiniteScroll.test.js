@@ -0,0 +1,57 @@
+/**
+ * Unit tests for infiniteScroll.js
+ */
+
+import { loadNextPage } from '../../src/js/modules/infiniteScroll.js';
+
+function renderPage(items, nextCursor) {
+  const link = nextCursor
+    ? `<a href="/profile/u/?cursor=${nextCursor}" data-infinite-scroll="grid">Load more</a>`
+    : '';
+  return `<div id="grid">${items.map((id) => `<a data-id="${id}"></a>`).join('')}</div>${link}`;
+}
+
+describe('infiniteScroll.js', () => {
+  beforeEach(() => {
+    document.body.innerHTML = renderPage([1, 2], 'a');
+  });
+
+  afterEach(() => {
+    delete global.fetch;
+  });
+
+  function mockFetch(html, ok = true) {
+    global.fetch = jest.fn().mockResolvedValue({
+      ok,
+      status: ok ? 200 : 500,
+      text: () => Promise.resolve(html),
+    });
+  }
+
+  it('should append items and move the link to the next cursor', async () => {
+    mockFetch(renderPage([3, 4], 'b'));
+    const link = document.querySelector('[data-infinite-scroll]');
+
+    await expect(loadNextPage(link)).resolves.toBe(true);
+
+    const ids = [...document.querySelectorAll('#grid a')].map((a) => a.dataset.id);
+    expect(ids).toEqual(['1', '2', '3', '4']);
+    expect(link.getAttribute('href')).toContain('cursor=b');
+  });
+
+  it('should remove the link on the last page', async () => {
+    mockFetch(renderPage([3], null));
+    const link = document.querySelector('[data-infinite-scroll]');
+
+    await expect(loadNextPage(link)).resolves.toBe(false);
+    expect(document.querySelector('[data-infinite-scroll]')).toBeNull();
+  });
+
+  it('should reject on HTTP errors', async () => {
+    mockFetch('', false);
+    const link = document.querySelector('[data-infinite-scroll]');
+
+    await expect(loadNextPage(link)).rejects.toThrow('500');
+    expect(document.querySelectorAll('#grid a')).toHaveLength(2);
+  });
+});
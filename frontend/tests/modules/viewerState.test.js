@@ -0,0 +1,79 @@
+/**
+ * Unit tests for viewerState.js
+ */
+
+import {
+  applyViewerState,
+  readViewerState,
+  setFollowState,
+} from '../../src/js/modules/viewerState.js';
+
+jest.mock('../../src/js/utils/ajax.js', () => ({
+  ajaxPost: jest.fn(),
+}));
+
+function renderCard(postId, authorId) {
+  return `
+    <article>
+      <button class="follow-btn hidden bg-primary text-white" data-author-id="${authorId}" data-username="u${authorId}">Follow</button>
+      <button class="like-btn" data-post-id="${postId}"><svg fill="none"></svg></button>
+    </article>`;
+}
+
+describe('viewerState.js', () => {
+  beforeEach(() => {
+    document.body.innerHTML = '';
+  });
+
+  describe('readViewerState', () => {
+    it('should parse json_script payload', () => {
+      document.body.innerHTML =
+        '<script id="viewer-state" type="application/json">{"user_id": 1}</script>';
+      expect(readViewerState()).toEqual({ user_id: 1 });
+    });
+
+    it('should return null without payload', () => {
+      expect(readViewerState()).toBeNull();
+    });
+  });
+
+  describe('setFollowState', () => {
+    it('should switch button to unfollow', () => {
+      const button = document.createElement('button');
+      button.className = 'bg-primary text-white';
+      setFollowState(button, true);
+      expect(button.textContent).toBe('Unfollow');
+      expect(button.dataset.following).toBe('true');
+      expect(button.classList.contains('bg-primary')).toBe(false);
+      expect(button.classList.contains('bg-gray-200')).toBe(true);
+    });
+  });
+
+  describe('applyViewerState', () => {
+    it('should mark liked posts and followed authors', () => {
+      document.body.innerHTML = renderCard(10, 2) + renderCard(11, 3);
+      applyViewerState({ user_id: 1, liked_post_ids: [10], following_ids: [3] });
+
+      const likes = document.querySelectorAll('.like-btn');
+      expect(likes[0].classList.contains('text-red-500')).toBe(true);
+      expect(likes[1].classList.contains('text-red-500')).toBe(false);
+
+      const follows = document.querySelectorAll('.follow-btn');
+      expect(follows[0].textContent).toBe('Follow');
+      expect(follows[1].textContent).toBe('Unfollow');
+      expect(follows[1].classList.contains('hidden')).toBe(false);
+    });
+
+    it('should remove follow button on own posts', () => {
+      document.body.innerHTML = renderCard(10, 1);
+      applyViewerState({ user_id: 1, liked_post_ids: [], following_ids: [] });
+      expect(document.querySelector('.follow-btn')).toBeNull();
+    });
+
+    it('should ignore missing state', () => {
+      document.body.innerHTML = renderCard(10, 2);
+      applyViewerState(null);
+      expect(document.querySelector('.follow-btn').classList.contains('hidden')).toBe(true);
+    });
+  });
+});
@@ -0,0 +1,475 @@
+"""Caching helpers for DJGramm."""
+
+import hashlib
+import logging
+import math
+import random
+import time
+from collections.abc import Callable
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# Key Builders
+# =============================================================================
+
+
+def build_key(namespace: str, *parts) -> str:
+    """
+    Build a namespaced cache key.
+
+    The namespace comes first so that metrics and the two-tier backend
+    can tell keys apart by prefix.
+
+    Args:
+        namespace: Key namespace, e.g. "post" or "graph"
+        *parts: Remaining key parts, joined with ":"
+
+    Returns:
+        Cache key, e.g. "post:42"
+    """
+    return ":".join([namespace, *(str(part) for part in parts)])
+
+
+def lock_key(key: str) -> str:
+    """Return key of the short lock guarding recomputation of key."""
+    return build_key("lock", key)
+
+
+# =============================================================================
+# Key Generations
+# =============================================================================
+
+
+def generation_key(scope: str) -> str:
+    """Return cache key holding the generation counter for a scope."""
+    return build_key("gen", scope)
+
+
+def get_generations(scopes: list[str]) -> tuple[int, ...]:
+    """
+    Return current generation counters for scopes.
+
+    Missing counters are seeded with the current time in nanoseconds
+    so that a counter evicted from the cache never goes back to a value
+    an old entry was stored with.
+
+    Args:
+        scopes: Scope names, e.g. ["feed", "tag:travel"]
+
+    Returns:
+        Tuple of generation counters in the order of scopes
+    """
+    keys = [generation_key(scope) for scope in scopes]
+    values = cache.get_many(keys)
+    generations = []
+    for key in keys:
+        if key not in values:
+            cache.add(key, time.time_ns(), timeout=None)
+            values[key] = cache.get(key, 0)
+        generations.append(values[key])
+    return tuple(generations)
+
+
+def bump_generation(*scopes: str) -> None:
+    """Invalidate everything cached under scopes."""
+    for scope in scopes:
+        key = generation_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Counter missing or evicted: reseed it
+            cache.set(key, time.time_ns(), timeout=None)
+
+
+def feed_scope() -> str:
+    """Scope covering the global feed."""
+    return build_key("feed")
+
+
+def tag_scope(slug: str) -> str:
+    """Scope covering pages of a tag."""
+    return build_key("tag", slug)
+
+
+def profile_scope(username: str) -> str:
+    """Scope covering pages of a user profile."""
+    return build_key("profile", username)
+
+
+def post_scope(post_id: int) -> str:
+    """Scope covering fragments rendering a single post."""
+    return build_key("post", post_id)
+
+
+def user_scope(user_id: int) -> str:
+    """Scope covering fragments rendering a user's name or avatar."""
+    return build_key("user", user_id)
+
+
+def graph_scope(user_id: int) -> str:
+    """Scope covering the set of users a user follows."""
+    return build_key("graph", user_id)
+
+
+def invalidate_post(post_id: int, tags: bool = True) -> None:
+    """
+    Invalidate pages and fragments showing a post.
+
+    Args:
+        post_id: Post primary key
+        tags: Also invalidate pages of the post's tags
+    """
+    from .models import Post, Tag
+
+    scopes = [feed_scope(), post_scope(post_id)]
+    username = (
+        Post.objects.filter(pk=post_id)
+        .values_list("author__username", flat=True)
+        .first()
+    )
+    if username:
+        scopes.append(profile_scope(username))
+    if tags:
+        slugs = Tag.objects.filter(posts__id=post_id).values_list(
+            "slug", flat=True
+        )
+        scopes.extend(tag_scope(slug) for slug in slugs)
+    bump_generation(*scopes)
+
+
+# =============================================================================
+# Stampede Protection
+# =============================================================================
+
+HIT = "HIT"
+MISS = "MISS"
+STALE = "STALE"
+
+
+def _namespace(key: str) -> str:
+    """Return the namespace part of a cache key."""
+    return key.split(":", 1)[0]
+
+
+def _is_fresh(entry, version, beta: float) -> bool:
+    """
+    Check an entry with XFetch probabilistic early expiration.
+
+    An entry is treated as expired a little before its deadline, with a
+    probability growing as the deadline approaches and with the time the
+    value took to compute. One request then recomputes it early while the
+    others keep getting hits, instead of all missing at the deadline.
+    """
+    if entry is None or entry["version"] != version:
+        return False
+    # -log(u) for u in (0, 1] is an exponential random variable
+    gap = -entry["delta"] * beta * math.log(1.0 - random.random())
+    return time.time() + gap < entry["expires_at"]
+
+
+def get_or_compute(
+    key: str,
+    compute: Callable[[], object],
+    timeout: int,
+    *,
+    version=None,
+    cache_if: Callable[[object], bool] | None = None,
+    beta: float | None = None,
+) -> tuple[object, str]:
+    """
+    Return a cached value, recomputing it in at most one worker at a time.
+
+    A fresh entry (see _is_fresh) is returned as a hit. Otherwise a short
+    lock is taken with cache.add(): the winner recomputes and stores the
+    value, the others serve the previous value while it is being
+    recomputed (stale-while-revalidate), provided it carries the current
+    version; an entry of an older version is never served. Entries are kept
+    CACHE_STALE_FACTOR times longer than timeout for that purpose.
+
+    Args:
+        key: Cache key
+        compute: Callable returning the value
+        timeout: Freshness lifetime in seconds
+        version: Value the entry must carry to be fresh, e.g. generations
+        cache_if: Predicate deciding whether a computed value is stored
+        beta: XFetch aggressiveness, defaults to CACHE_XFETCH_BETA
+
+    Returns:
+        Tuple of (value, status), status being HIT, STALE or MISS
+    """
+    if beta is None:
+        beta = settings.CACHE_XFETCH_BETA
+    namespace = _namespace(key)
+    entry = cache.get(key)
+    if _is_fresh(entry, version, beta):
+        return entry["value"], HIT
+
+    lock = lock_key(key)
+    if not cache.add(lock, 1, timeout=settings.CACHE_LOCK_TIMEOUT):
+        if entry is not None and entry["version"] == version:
+            # Another worker is recomputing: serve the previous value,
+            # unless its data has changed since
+            metrics.increment(
+                "cache_recomputations_total",
+                namespace=namespace,
+                result="collapsed",
+            )
+            return entry["value"], STALE
+        # Nothing current to serve, compute without storing
+        metrics.increment(
+            "cache_recomputations_total",
+            namespace=namespace,
+            result="contended",
+        )
+        return compute(), MISS
+
+    try:
+        started = time.time()
+        value = compute()
+        delta = time.time() - started
+        if cache_if is None or cache_if(value):
+            cache.set(
+                key,
+                {
+                    "value": value,
+                    "version": version,
+                    "delta": delta,
+                    "expires_at": time.time() + timeout,
+                },
+                timeout=timeout * settings.CACHE_STALE_FACTOR,
+            )
+        metrics.increment(
+            "cache_recomputations_total",
+            namespace=namespace,
+            result="computed",
+        )
+    finally:
+        cache.delete(lock)
+    return value, MISS
+
+
+# =============================================================================
+# Cached request.user
+# =============================================================================
+
+
+def user_snapshot_key(user_id) -> str:
+    """Return versioned cache key of a User+Profile snapshot."""
+    (generation,) = get_generations([user_scope(user_id)])
+    return build_key("snapshot", "user", user_id, generation)
+
+
+def get_cached_user(request):
+    """
+    Return the user of a request, loading it from the cache if possible.
+
+    Works like django.contrib.auth.get_user() but keeps a snapshot of the
+    User with its Profile under a key versioned by user_scope(). Profile
+    and user saves bump the version, so a hit is always current. The
+    session hash is still verified, so password changes log out other
+    sessions as before.
+    """
+    user_id = request.session.get(auth.SESSION_KEY)
+    backend_path = request.session.get(auth.BACKEND_SESSION_KEY)
+    if user_id is None or backend_path not in settings.AUTHENTICATION_BACKENDS:
+        return auth.get_user(request)
+
+    key = user_snapshot_key(user_id)
+    user = cache.get(key)
+    if user is not None:
+        session_hash = request.session.get(auth.HASH_SESSION_KEY)
+        if session_hash and constant_time_compare(
+            session_hash, user.get_session_auth_hash()
+        ):
+            return user
+
+    user = auth.get_user(request)
+    if user.is_authenticated:
+        # Load the profile so templates do not query it again
+        hasattr(user, "profile")
+        cache.set(key, user, timeout=settings.USER_CACHE_TIMEOUT)
+    return user
+
+
+# =============================================================================
+# Follow Graph
+# =============================================================================
+
+
+def get_following_ids(user) -> set[int]:
+    """
+    Return ids of users followed by user.
+
+    The set is cached under a key versioned by graph_scope(), which
+    follow and unfollow signals bump.
+    """
+    (generation,) = get_generations([graph_scope(user.pk)])
+    key = build_key("graph", user.pk, "following", generation)
+    following_ids = cache.get(key)
+    if following_ids is None:
+        following_ids = set(user.following.values_list("id", flat=True))
+        cache.set(key, following_ids, timeout=settings.GRAPH_CACHE_TIMEOUT)
+    return following_ids
+
+
+def get_profile_counts(user) -> dict[str, int]:
+    """
+    Return post, follower and following counts of a user.
+
+    Popular profiles are viewed by many users at once, so the counts
+    are shared and recomputed through get_or_compute() when the
+    profile's generation changes.
+    """
+
+    def compute():
+        return {
+            "posts_count": user.posts.count(),
+            "followers_count": user.get_followers_count(),
+            "following_count": user.get_following_count(),
+        }
+
+    counts, _ = get_or_compute(
+        build_key("profile", user.username, "counts"),
+        compute,
+        settings.PROFILE_COUNTS_TIMEOUT,
+        version=get_generations([profile_scope(user.username)]),
+    )
+    return counts
+
+
+# =============================================================================
+# Post Card Fragments
+# =============================================================================
+
+
+def attach_post_card_versions(posts) -> None:
+    """
+    Set cache_version on posts for the post card fragment cache.
+
+    The version combines the post's generation, bumped on edit, image
+    changes, likes and comments, with the author's generation, bumped on
+    profile edits. All generations are fetched in one round trip.
+
+    Args:
+        posts: Iterable of Post instances
+    """
+    posts = list(posts)
+    scopes = [post_scope(post.pk) for post in posts] + [
+        user_scope(post.author_id) for post in posts
+    ]
+    generations = get_generations(scopes)
+    count = len(posts)
+    for index, post in enumerate(posts):
+        post.cache_version = (
+            f"{generations[index]}.{generations[count + index]}"
+        )
+
+
+# =============================================================================
+# Anonymous Page Cache
+# =============================================================================
+
+
+def page_cache_key(request) -> str:
+    """
+    Build page cache key from request path and page number or cursor.
+
+    Other query parameters are ignored so they cannot be used to
+    bypass the cache.
+    """
+    path_hash = hashlib.md5(request.path.encode()).hexdigest()
+    page = request.GET.get("page", "1")
+    cursor = request.GET.get("cursor")
+    if cursor:
+        page = hashlib.md5(cursor.encode()).hexdigest()
+    return build_key("page", path_hash, page)
+
+
+def _cached_response(page, status: str) -> HttpResponse:
+    """Build a response from a cached page."""
+    response = HttpResponse(page["content"], content_type=page["content_type"])
+    response["X-Page-Cache"] = status
+    return response
+
+
+class AnonymousPageCacheMixin:
+    """
+    Serve whole pages to anonymous visitors from the cache.
+
+    Entries are keyed by path and page and tagged with the generations
+    of the scopes returned by get_page_cache_scopes(). Signals bump the
+    generations on writes, so stale entries are never reused once their
+    data changes.
+
+    Expired pages are regenerated through get_or_compute(), so only one
+    worker renders a page while the others keep serving the previous copy.
+    Pages that rendered a CSRF token are not stored, since the token
+    belongs to the visitor they were rendered for.
+    """
+
+    page_cache_timeout = None
+
+    def get_page_cache_scopes(self) -> list[str]:
+        """Return scopes whose changes invalidate this page."""
+        raise NotImplementedError
+
+    def get_page_cache_timeout(self) -> int:
+        """Return freshness lifetime of cached pages in seconds."""
+        if self.page_cache_timeout is not None:
+            return self.page_cache_timeout
+        return settings.PAGE_CACHE_TIMEOUT
+
+    def page_cache_allowed(self, request) -> bool:
+        """Check if this request may be answered from the cache."""
+        if request.method != "GET" or request.user.is_authenticated:
+            return False
+        # Pending flash messages are rendered into the page
+        return len(get_messages(request)) == 0
+
+    def dispatch(self, request, *args, **kwargs):
+        """Answer from the page cache when possible."""
+        if not self.page_cache_allowed(request):
+            return super().dispatch(request, *args, **kwargs)
+
+        rendered = {}
+
+        def render():
+            response = super(AnonymousPageCacheMixin, self).dispatch(
+                request, *args, **kwargs
+            )
+            if hasattr(response, "render"):
+                response.render()
+            rendered["response"] = response
+            return {
+                "status_code": response.status_code,
+                "content": response.content,
+                "content_type": response["Content-Type"],
+            }
+
+        page, status = get_or_compute(
+            page_cache_key(request),
+            render,
+            self.get_page_cache_timeout(),
+            version=get_generations(self.get_page_cache_scopes()),
+            cache_if=lambda page: (
+                page["status_code"] == 200
+                # A page that rendered a CSRF token is the visitor's own
+                and not request.META.get("CSRF_COOKIE_NEEDS_UPDATE")
+            ),
+        )
+        if status != MISS:
+            return _cached_response(page, status)
+
+        response = rendered["response"]
+        response["X-Page-Cache"] = MISS
+        return response
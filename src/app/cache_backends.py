@@ -0,0 +1,206 @@
+"""Cache backends for DJGramm."""
+
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from . import metrics
+
+_MISSING = object()
+
+
+class LocalLRU:
+    """
+    Thread-safe in-process LRU of pickled values with expiry.
+
+    Values are stored pickled so callers never share mutable objects
+    across requests.
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._data: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default=None):
+        """Return value of key, or default if missing or expired."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, payload = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+        return pickle.loads(payload)
+
+    def set(self, key: str, value, timeout: float) -> None:
+        """Store value for timeout seconds, evicting the oldest entries."""
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._data[key] = (time.monotonic() + timeout, payload)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        """Remove key if present."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TwoTierCache(BaseCache):
+    """
+    In-process LRU in front of a shared cache.
+
+    Reads are answered from the local LRU when possible and fall back to
+    the shared cache (Redis, or a file-based stand-in), filling the LRU.
+    Local copies live at most LOCAL_TIMEOUT seconds, so writes from other
+    processes become visible after that.
+
+    Keys starting with one of BYPASS_PREFIXES (generation counters,
+    locks) always go to the shared cache, since they must be consistent
+    across processes. Atomic operations (add, incr) are delegated to the
+    shared cache as well.
+
+    OPTIONS:
+        SHARED_ALIAS: Alias of the shared cache in CACHES
+        LOCAL_MAX_ENTRIES: Size of the local LRU
+        LOCAL_TIMEOUT: Maximum lifetime of local copies in seconds
+        BYPASS_PREFIXES: Key prefixes never stored locally
+    """
+
+    def __init__(self, location, params):
+        options = params.get("OPTIONS", {})
+        super().__init__(params)
+        self._shared_alias = options.get("SHARED_ALIAS", "shared")
+        self.local_timeout = options.get("LOCAL_TIMEOUT", 5)
+        self.bypass_prefixes = tuple(
+            options.get("BYPASS_PREFIXES", ("gen:", "lock:"))
+        )
+        self.local = LocalLRU(options.get("LOCAL_MAX_ENTRIES", 1000))
+
+    @property
+    def shared(self):
+        """Return the shared cache backend."""
+        return caches[self._shared_alias]
+
+    def _cacheable_locally(self, key: str) -> bool:
+        return not key.startswith(self.bypass_prefixes)
+
+    def _local_timeout(self, timeout) -> float:
+        """Return lifetime of a local copy for a shared timeout."""
+        if timeout is None:
+            return self.local_timeout
+        return min(timeout, self.local_timeout)
+
+    def _record(self, key: str, result: str) -> None:
+        """Count a lookup per key namespace and tier."""
+        namespace = re.split(r"[:.]", key, maxsplit=1)[0]
+        metrics.increment(
+            "cache_requests_total", namespace=namespace, result=result
+        )
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        if self._cacheable_locally(key):
+            value = self.local.get(local_key, _MISSING)
+            if value is not _MISSING:
+                self._record(key, "local_hit")
+                return value
+
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self._record(key, "miss")
+            return default
+
+        self._record(key, "shared_hit")
+        if self._cacheable_locally(key):
+            self.local.set(local_key, value, self.local_timeout)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        remaining = []
+        for key in keys:
+            local_key = self.make_and_validate_key(key, version=version)
+            value = (
+                self.local.get(local_key, _MISSING)
+                if self._cacheable_locally(key)
+                else _MISSING
+            )
+            if value is _MISSING:
+                remaining.append(key)
+            else:
+                self._record(key, "local_hit")
+                found[key] = value
+
+        if remaining:
+            shared_found = self.shared.get_many(remaining, version=version)
+            for key in remaining:
+                if key not in shared_found:
+                    self._record(key, "miss")
+                    continue
+                self._record(key, "shared_hit")
+                found[key] = shared_found[key]
+                if self._cacheable_locally(key):
+                    self.local.set(
+                        self.make_and_validate_key(key, version=version),
+                        shared_found[key],
+                        self.local_timeout,
+                    )
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        self.shared.set(key, value, timeout=timeout, version=version)
+        local_key = self.make_and_validate_key(key, version=version)
+        if self._cacheable_locally(key) and timeout != 0:
+            self.local.set(local_key, value, self._local_timeout(timeout))
+        else:
+            self.local.delete(local_key)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return self.shared.add(key, value, timeout=timeout, version=version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return self.shared.touch(key, timeout=timeout, version=version)
+
+    def delete(self, key, version=None):
+        self.local.delete(self.make_and_validate_key(key, version=version))
+        return self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self.local.delete(self.make_and_validate_key(key, version=version))
+        self.shared.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def incr(self, key, delta=1, version=None):
+        self.local.delete(self.make_and_validate_key(key, version=version))
+        return self.shared.incr(key, delta=delta, version=version)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
@@ -0,0 +1,412 @@
+"""
+Resumable chunked uploads for DJGramm.
+
+A large image sent in one request over a flaky mobile connection starts
+from zero after every failure. Local direct uploads can instead follow
+the core of the tus protocol (https://tus.io/protocols/resumable-upload):
+
+    POST  /uploads/resumable/        Upload-Length, X-Upload-Ticket
+    HEAD  /uploads/resumable/<id>/   -> Upload-Offset
+    PATCH /uploads/resumable/<id>/   Upload-Offset, chunk as body
+
+Each chunk is stored as its own part file named by its offset, so a
+chunk cut off mid-transfer keeps the bytes that arrived, chunks may
+arrive out of order, and the offset to resume from is the end of the
+contiguous run of parts from zero. Once that run covers Upload-Length
+the parts are concatenated inside the kernel with copy_file_range()
+(or sendfile()) and the file goes through the same validation and
+processing as any post image upload.
+"""
+
+import base64
+import binascii
+import errno
+import json
+import logging
+import mimetypes
+import os
+import re
+import secrets
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+
+from .direct_uploads import UploadRejected, process_direct_upload
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+INFO_NAME = "info.json"
+RECEIPT_NAME = "receipt"
+LOCK_NAME = ".assembling"
+ASSEMBLED_NAME = ".assembled"
+# Part files are named by their offset, zero-padded so names sort by it
+PART_DIGITS = 12
+# Bytes read from the request per write while storing a chunk
+READ_SIZE = 64 * 1024
+
+
+class UploadNotFound(Exception):
+    """Raised for unknown, expired or other users' uploads."""
+
+
+class UploadConflict(UploadRejected):
+    """
+    Raised when a chunk does not fit the parts already stored.
+
+    Args:
+        message: Error message
+        offset: Offset the client should resume from
+    """
+
+    def __init__(self, message: str, offset: int):
+        super().__init__(message)
+        self.offset = offset
+
+
+def parse_metadata(header: str) -> dict[str, str]:
+    """
+    Parse a tus Upload-Metadata header.
+
+    Example:
+        "filetype aW1hZ2UvanBlZw==" -> {"filetype": "image/jpeg"}
+    """
+    metadata = {}
+    for pair in header.split(","):
+        key, _, value = pair.strip().partition(" ")
+        if not key:
+            continue
+        try:
+            metadata[key] = base64.b64decode(value, validate=True).decode()
+        except (binascii.Error, UnicodeDecodeError):
+            continue
+    return metadata
+
+
+# =============================================================================
+# Zero-Copy Concatenation
+# =============================================================================
+
+
+def _read_write(src_fd: int, dst_fd: int, count: int) -> int:
+    data = os.read(src_fd, min(count, 1024 * 1024))
+    view = memoryview(data)
+    while view:
+        view = view[os.write(dst_fd, view) :]
+    return len(data)
+
+
+def _copy_methods():
+    """Yield ways to copy between descriptors, most efficient first."""
+    if hasattr(os, "copy_file_range"):
+        yield os.copy_file_range
+    if hasattr(os, "sendfile"):
+        yield lambda src_fd, dst_fd, count: os.sendfile(
+            dst_fd, src_fd, None, count
+        )
+    yield _read_write
+
+
+def copy_range(src_fd: int, dst_fd: int, count: int) -> None:
+    """
+    Copy count bytes from the position of src_fd to that of dst_fd.
+
+    copy_file_range() copies inside the kernel, sharing blocks on file
+    systems with reflinks; where it is unavailable (other OS, across
+    file systems) sendfile() and then read()/write() take over from the
+    bytes already copied. Both positions advance.
+
+    Raises:
+        EOFError: If the source ends before count bytes
+        OSError: If copying fails, or no method supports the descriptors
+    """
+    copied = 0
+    error = None
+    for method in _copy_methods():
+        try:
+            while copied < count:
+                written = method(src_fd, dst_fd, count - copied)
+                if written == 0:
+                    raise EOFError(f"Source ended after {copied} bytes")
+                copied += written
+            return
+        except OSError as e:
+            if e.errno not in (
+                errno.ENOSYS,
+                errno.EXDEV,
+                errno.EINVAL,
+                errno.EOPNOTSUPP,
+            ):
+                raise
+            error = e
+    raise OSError(f"Copied {copied} of {count} bytes") from error
+
+
+# =============================================================================
+# Uploads
+# =============================================================================
+
+
+def get_upload_root() -> str:
+    """Return the directory holding uploads in progress."""
+    return str(settings.CHUNKED_UPLOAD_DIR)
+
+
+class ChunkedUpload:
+    """
+    Upload in progress, a directory of part files and its description.
+
+    Args:
+        directory: Directory of the upload
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, INFO_NAME)) as f:
+            self.info = json.load(f)
+
+    @property
+    def upload_id(self) -> str:
+        return os.path.basename(self.directory)
+
+    @property
+    def length(self) -> int:
+        return self.info["length"]
+
+    @classmethod
+    def create(cls, user, length: int, content_type: str) -> "ChunkedUpload":
+        """
+        Start an upload of length bytes for user.
+
+        Args:
+            user: Uploading user
+            length: Size of the whole file in bytes
+            content_type: Content type of the file
+
+        Returns:
+            ChunkedUpload
+        """
+        directory = os.path.join(get_upload_root(), secrets.token_hex(16))
+        os.makedirs(directory)
+        info = {
+            "user": user.pk,
+            "length": length,
+            "content_type": content_type,
+            "created": time.time(),
+        }
+        with open(os.path.join(directory, INFO_NAME), "w") as f:
+            json.dump(info, f)
+        return cls(directory)
+
+    @classmethod
+    def open(cls, upload_id: str, user) -> "ChunkedUpload":
+        """
+        Return an upload of user.
+
+        Raises:
+            UploadNotFound: If there is no such upload of user
+        """
+        if not UPLOAD_ID_RE.match(upload_id):
+            raise UploadNotFound(upload_id)
+        try:
+            upload = cls(os.path.join(get_upload_root(), upload_id))
+        except (FileNotFoundError, ValueError) as e:
+            raise UploadNotFound(upload_id) from e
+        if upload.info["user"] != user.pk:
+            raise UploadNotFound(upload_id)
+        return upload
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def parts(self) -> list[tuple[int, int]]:
+        """Return (offset, size) of the stored parts by offset."""
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.name.isdigit():
+                found.append((int(entry.name), entry.stat().st_size))
+        found.sort()
+        return found
+
+    def receipt(self) -> str | None:
+        """Return the receipt of a completed upload, else None."""
+        try:
+            with open(self._path(RECEIPT_NAME)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def offset(self) -> int:
+        """Return the end of the parts stored contiguously from zero."""
+        if self.receipt() is not None:
+            return self.length
+        end = 0
+        for offset, size in self.parts():
+            if offset > end:
+                break
+            end = max(end, offset + size)
+        return end
+
+    def write(self, offset: int, stream) -> int:
+        """
+        Store the chunk read from stream as the part at offset.
+
+        Args:
+            offset: Upload-Offset of the chunk
+            stream: File-like object with the chunk, e.g. the request
+
+        Returns:
+            Offset to continue from
+
+        Raises:
+            UploadConflict: If offset is not free or the chunk would
+                overlap a stored part or run past the length
+        """
+        if self.receipt() is not None:
+            if offset == self.length:
+                return offset
+            raise UploadConflict("Upload is complete.", self.length)
+
+        parts = self.parts()
+        following = [start for start, _ in parts if start > offset]
+        limit = following[0] if following else self.length
+        stored = any(start <= offset < start + size for start, size in parts)
+        if stored or not 0 <= offset < self.length:
+            raise UploadConflict(
+                f"Offset {offset} is already stored or out of range.",
+                self.offset(),
+            )
+
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".")
+        try:
+            received = 0
+            with os.fdopen(fd, "wb") as f:
+                while True:
+                    data = stream.read(READ_SIZE)
+                    if not data:
+                        break
+                    received += len(data)
+                    if offset + received > limit:
+                        raise UploadConflict(
+                            "Chunk overlaps stored data or the length.",
+                            self.offset(),
+                        )
+                    f.write(data)
+            if received:
+                # Fails if another request stored this offset meanwhile
+                os.link(temp_path, self._path(f"{offset:0{PART_DIGITS}d}"))
+        except FileExistsError as e:
+            raise UploadConflict(
+                f"Offset {offset} is already stored.", self.offset()
+            ) from e
+        finally:
+            os.unlink(temp_path)
+        return self.offset()
+
+    def complete(self, user) -> str | None:
+        """
+        Assemble and process the upload once every byte has arrived.
+
+        Args:
+            user: Uploading user
+
+        Returns:
+            Receipt for claim_uploads(), or None while bytes are missing
+            or another request is assembling the upload
+
+        Raises:
+            UploadRejected: If the image is not accepted; the upload is
+                deleted
+        """
+        receipt = self.receipt()
+        if receipt is not None or self.offset() < self.length:
+            return receipt
+        try:
+            os.close(os.open(self._path(LOCK_NAME), os.O_CREAT | os.O_EXCL))
+        except FileExistsError:
+            return None
+
+        try:
+            path = self._assemble()
+            content_type = self.info["content_type"]
+            ext = mimetypes.guess_extension(content_type) or ""
+            with open(path, "rb") as f:
+                file = UploadedFile(
+                    f,
+                    name=f"upload{ext}",
+                    content_type=content_type,
+                    size=self.length,
+                )
+                receipt = process_direct_upload(user, file)
+        except UploadRejected:
+            self.delete()
+            raise
+        except BaseException:
+            # Let a retried last chunk assemble it again
+            os.unlink(self._path(LOCK_NAME))
+            raise
+
+        with open(self._path(f".{RECEIPT_NAME}"), "w") as f:
+            f.write(receipt)
+        os.replace(self._path(f".{RECEIPT_NAME}"), self._path(RECEIPT_NAME))
+        # The receipt is kept for clients retrying the last chunk
+        for offset, _ in self.parts():
+            os.unlink(self._path(f"{offset:0{PART_DIGITS}d}"))
+        os.unlink(path)
+        return receipt
+
+    def _assemble(self) -> str:
+        """Concatenate the parts in offset order into one file."""
+        path = self._path(ASSEMBLED_NAME)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            for offset, size in self.parts():
+                with open(self._path(f"{offset:0{PART_DIGITS}d}"), "rb") as f:
+                    copy_range(f.fileno(), fd, size)
+        finally:
+            os.close(fd)
+        return path
+
+    def delete(self) -> None:
+        """Remove the upload and its parts."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def purge_expired_uploads(max_age: float | None = None) -> int:
+    """
+    Remove uploads that received nothing for max_age seconds.
+
+    Storing a part changes the modification time of the upload's
+    directory, so that is when it was last active.
+
+    Args:
+        max_age: Seconds, by default CHUNKED_UPLOAD_EXPIRY
+
+    Returns:
+        Number of uploads removed
+    """
+    if max_age is None:
+        max_age = settings.CHUNKED_UPLOAD_EXPIRY
+    root = get_upload_root()
+    cutoff = time.time() - max_age
+    removed = 0
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if not UPLOAD_ID_RE.match(entry.name):
+            continue
+        try:
+            active = entry.stat().st_mtime
+        except FileNotFoundError:
+            continue
+        if active < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    if removed:
+        logger.info("Removed %d expired chunked uploads", removed)
+    return removed
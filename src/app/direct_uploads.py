@@ -0,0 +1,286 @@
+"""
+Direct uploads of post images for DJGramm.
+
+Posting images through the post form ties a worker to the request for
+as long as the browser takes to send them. Instead the browser asks for
+one signed ticket per image, uploads each image with its ticket, and
+submits the form with the results only:
+
+- With Cloudinary the ticket carries signed upload parameters with a
+  public ID chosen by the server, and the image goes from the browser
+  to the Cloudinary upload API. Cloudinary limits the size with an
+  incoming transformation and requests the eager renditions; its
+  signed response is what the form submits.
+- With local storage the image is sent to /uploads/, which nginx
+  buffers completely before passing it on, so a worker only sees it
+  once it has arrived, or in resumable chunks (app.chunked_uploads).
+  The worker processes it like a form upload and answers with a
+  signed receipt for the form to submit.
+
+claim_uploads() turns the submitted results into unsaved PostImage
+instances, rejecting results of other users, unknown public IDs and
+anything whose signature does not match.
+"""
+
+import json
+import logging
+import mimetypes
+import re
+import secrets
+
+import cloudinary
+import cloudinary.utils
+from django.conf import settings
+from django.core import signing
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+
+from . import metrics
+from .models import PostImage
+from .services import process_post_images, store_image_files, validate_image
+
+logger = logging.getLogger(__name__)
+
+TICKET_SALT = "app.direct_uploads.ticket"
+RECEIPT_SALT = "app.direct_uploads.receipt"
+
+# Formats Cloudinary accepts for direct uploads
+CLOUDINARY_FORMATS = ["jpg", "png", "webp"]
+FORMAT_RE = re.compile(r"^[0-9a-z]+$")
+
+
+class UploadRejected(Exception):
+    """Raised when a direct upload or its result is not accepted."""
+
+
+# =============================================================================
+# Tickets
+# =============================================================================
+
+
+def _upload_folder() -> str:
+    return PostImage._meta.get_field("image").options["folder"]
+
+
+def issue_ticket(user) -> dict:
+    """
+    Return what the browser needs to upload one post image.
+
+    Returns:
+        Dict with the signed "ticket", the "url" to send the image to,
+        and for Cloudinary the form "fields" to send with it
+    """
+    public_id = f"{_upload_folder()}/{secrets.token_hex(16)}"
+    ticket = signing.dumps({"u": user.pk, "id": public_id}, salt=TICKET_SALT)
+
+    if settings.MEDIA_BACKEND == "local":
+        return {
+            "backend": "local",
+            "ticket": ticket,
+            "url": reverse("direct_upload"),
+            "resumable_url": reverse("chunked_uploads"),
+        }
+
+    field = PostImage._meta.get_field("image")
+    max_dimension = settings.IMAGE_MAX_DIMENSION
+    params = cloudinary.utils.build_upload_params(
+        public_id=public_id,
+        eager=field._eager(None),
+        eager_async=True,
+        allowed_formats=CLOUDINARY_FORMATS,
+        # Incoming transformation, applied before the image is stored
+        width=max_dimension,
+        height=max_dimension,
+        crop="limit",
+    )
+    return {
+        "backend": "cloudinary",
+        "ticket": ticket,
+        "url": cloudinary.utils.cloudinary_api_url(
+            "upload", resource_type="image"
+        ),
+        "fields": cloudinary.utils.sign_request(params, {}),
+    }
+
+
+def read_ticket(user, ticket: str, max_age: int) -> str:
+    """
+    Check a ticket issued to user.
+
+    Args:
+        user: User presenting the ticket
+        ticket: Ticket from issue_ticket()
+        max_age: Seconds the ticket stays valid
+
+    Returns:
+        Public ID reserved by the ticket
+
+    Raises:
+        UploadRejected: If the ticket is invalid, expired or not user's
+    """
+    try:
+        data = signing.loads(ticket, salt=TICKET_SALT, max_age=max_age)
+    except signing.BadSignature as e:
+        raise UploadRejected("Upload ticket is invalid or expired.") from e
+    if data["u"] != user.pk:
+        raise UploadRejected("Upload ticket belongs to another user.")
+    return data["id"]
+
+
+# =============================================================================
+# Local Uploads
+# =============================================================================
+
+
+def store_direct_upload(user, ticket: str, data: bytes, content_type: str):
+    """
+    Validate, process and store an image sent to the local endpoint.
+
+    Args:
+        user: Uploading user
+        ticket: Ticket from issue_ticket()
+        data: Image bytes
+        content_type: Content type sent by the browser
+
+    Returns:
+        Signed receipt for claim_uploads()
+
+    Raises:
+        UploadRejected: If the ticket or the image is not accepted
+    """
+    read_ticket(user, ticket, settings.DIRECT_UPLOAD_TICKET_TTL)
+    content_type = content_type.split(";")[0].strip().lower()
+    ext = mimetypes.guess_extension(content_type) or ""
+    file = SimpleUploadedFile(f"upload{ext}", data, content_type)
+    return process_direct_upload(user, file)
+
+
+def process_direct_upload(user, file) -> str:
+    """
+    Validate, process and store an uploaded post image.
+
+    Args:
+        user: Uploading user
+        file: UploadedFile with the image
+
+    Returns:
+        Signed receipt for claim_uploads()
+
+    Raises:
+        UploadRejected: If the image is not accepted
+    """
+    is_valid, error = validate_image(file)
+    if not is_valid:
+        raise UploadRejected(error)
+
+    image = PostImage(image=file)
+    errors = process_post_images([image], user)
+    if errors:
+        raise UploadRejected(errors[0])
+    store_image_files([image])
+    metrics.increment("direct_uploads_total", backend="local")
+
+    return signing.dumps(
+        {
+            "u": user.pk,
+            "image": image.image,
+            "w": image.width,
+            "h": image.height,
+            "p": image.placeholder,
+            "ph": image.phash,
+        },
+        salt=RECEIPT_SALT,
+        compress=True,
+    )
+
+
+# =============================================================================
+# Claiming Results
+# =============================================================================
+
+
+def _claim_receipt(user, receipt: str) -> PostImage:
+    try:
+        data = signing.loads(
+            receipt,
+            salt=RECEIPT_SALT,
+            max_age=settings.DIRECT_UPLOAD_CLAIM_TTL,
+        )
+    except signing.BadSignature as e:
+        raise UploadRejected("Upload receipt is invalid or expired.") from e
+    if data["u"] != user.pk:
+        raise UploadRejected("Upload receipt belongs to another user.")
+    image = PostImage(
+        image=data["image"],
+        width=data["w"],
+        height=data["h"],
+        placeholder=data["p"],
+    )
+    if data["ph"] is not None:
+        image.set_phash(data["ph"] & (2**64 - 1))
+    return image
+
+
+def _claim_cloudinary(user, result: dict) -> PostImage:
+    public_id = read_ticket(
+        user, str(result.get("ticket", "")), settings.DIRECT_UPLOAD_CLAIM_TTL
+    )
+    version = result.get("version")
+    image_format = str(result.get("format", ""))
+    # The response signature covers the public ID and version only
+    if (
+        result.get("public_id") != public_id
+        or not FORMAT_RE.match(image_format)
+        or not cloudinary.utils.verify_api_response_signature(
+            public_id, version, result.get("signature", "")
+        )
+    ):
+        raise UploadRejected("Upload result does not match its ticket.")
+
+    def dimension(name):
+        value = result.get(name)
+        return value if isinstance(value, int) and value > 0 else None
+
+    return PostImage(
+        image=f"image/upload/v{version}/{public_id}.{image_format}",
+        width=dimension("width"),
+        height=dimension("height"),
+    )
+
+
+def _claim(user, value: str) -> PostImage:
+    try:
+        result = json.loads(value)
+    except ValueError:
+        result = None
+    if not isinstance(result, dict):
+        raise UploadRejected("Upload result is malformed.")
+    if "receipt" in result:
+        return _claim_receipt(user, str(result["receipt"]))
+    return _claim_cloudinary(user, result)
+
+
+def claim_uploads(user, values) -> tuple[list[PostImage], list[str]]:
+    """
+    Turn submitted direct upload results into unsaved post images.
+
+    Args:
+        user: User submitting the post form
+        values: JSON strings, each a {"receipt": ...} from the local
+            endpoint or the Cloudinary upload response plus "ticket"
+
+    Returns:
+        Tuple of (images in submitted order, error messages)
+    """
+    images = []
+    errors = []
+    for value in values:
+        try:
+            images.append(_claim(user, value))
+        except UploadRejected as e:
+            logger.warning("Rejected direct upload of user %s: %s", user.pk, e)
+            metrics.increment("direct_upload_claims_total", result="rejected")
+            errors.append(str(e))
+        else:
+            metrics.increment("direct_upload_claims_total", result="ok")
+    return images, errors
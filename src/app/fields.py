@@ -0,0 +1,142 @@
+"""Model fields for DJGramm."""
+
+import logging
+import re
+
+from cloudinary.models import CloudinaryField
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import NotSupportedError, models
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from . import metrics
+from .media_client import MediaClientError, get_media_client
+from .media_urls import eager_transformations
+from .storage import get_local_storage
+
+logger = logging.getLogger(__name__)
+
+
+class MediaField(CloudinaryField):
+    """
+    CloudinaryField that falls back to local content-addressed storage.
+
+    With MEDIA_BACKEND = "local" uploads are saved to default_storage
+    (ContentAddressedStorage) instead of Cloudinary. The value stored
+    in the database has the same form as a Cloudinary one, with the
+    content key as public_id and format, so reading code is shared.
+
+    Cloudinary uploads request the IMAGE_RENDITION_FORMATS conversions
+    and the IMAGE_TRANSFORMS named in transforms as eager, asynchronous
+    transformations. They go through the media client, so they time
+    out and retry; when Cloudinary is unavailable the upload is stored
+    locally instead, for migrate_to_cloudinary to move later.
+
+    Args:
+        transforms: Names of IMAGE_TRANSFORMS entries pages use
+    """
+
+    def __init__(self, *args, transforms=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.transforms = tuple(transforms)
+        # Callable options are evaluated per upload by CloudinaryField
+        self.options.setdefault("eager", self._eager)
+        self.options.setdefault("eager_async", True)
+        self.options.setdefault("timeout", self._timeout)
+
+    def _eager(self, model_instance) -> list[dict]:
+        return eager_transformations(self.transforms)
+
+    def _timeout(self, model_instance):
+        return get_media_client().timeout
+
+    def pre_save(self, model_instance, add):
+        value = getattr(model_instance, self.attname)
+        if not isinstance(value, UploadedFile):
+            return super().pre_save(model_instance, add)
+
+        if settings.MEDIA_BACKEND != "local":
+            try:
+                return get_media_client().call(
+                    "upload", super().pre_save, model_instance, add
+                )
+            except MediaClientError as e:
+                logger.warning("Storing %s locally: %s", value.name, e)
+                metrics.increment("media_uploads_deferred_total")
+
+        key = get_local_storage().save(value.name, value)
+        resource = self.parse_cloudinary_resource(key)
+        setattr(model_instance, self.attname, resource)
+        return self.get_prep_value(resource)
+
+
+# =============================================================================
+# Media Keys
+# =============================================================================
+
+# Resource type, delivery type and version before the public ID
+MEDIA_KEY_PREFIX = (
+    r"^((image|raw|video)/(upload|private|authenticated)/)?(v[0-9]+/)?"
+)
+# Format after it
+MEDIA_KEY_SUFFIX = r"\.[^./]+$"
+
+
+def media_join_key(value: str) -> str:
+    """
+    Return the public ID of a stored media value, without format.
+
+    Example:
+        "image/upload/v12/posts/abc.jpg" -> "posts/abc"
+
+    Args:
+        value: Database value of a MediaField, or a storage key
+
+    Returns:
+        Key comparable across the database and storage listings
+    """
+    return re.sub(MEDIA_KEY_SUFFIX, "", re.sub(MEDIA_KEY_PREFIX, "", value))
+
+
+class MediaKey(models.Func):
+    """
+    Database expression of media_join_key(), in bytewise order.
+
+    PostgreSQL computes it with regexp_replace() under the "C" collation;
+    SQLite calls media_join_key() registered as a function.
+    """
+
+    output_field = models.CharField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError(
+            f"MediaKey is not supported on {connection.vendor}"
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        template = (
+            "regexp_replace(regexp_replace(%(expressions)s, "
+            f"'{MEDIA_KEY_PREFIX}', ''), '{MEDIA_KEY_SUFFIX}', '') "
+            'COLLATE "C"'
+        )
+        return super().as_sql(
+            compiler, connection, template=template, **extra_context
+        )
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection, function="MEDIA_JOIN_KEY", **extra_context
+        )
+
+
+@receiver(connection_created)
+def _register_sqlite_functions(sender, connection, **kwargs):
+    """Make media_join_key() available to SQLite queries."""
+    if connection.vendor == "sqlite":
+        connection.connection.create_function(
+            "MEDIA_JOIN_KEY",
+            1,
+            lambda value: None if value is None else media_join_key(value),
+            deterministic=True,
+        )
@@ -0,0 +1,191 @@
+"""
+Process-pool image engine for DJGramm.
+
+Resizing and JPEG encoding are CPU bound, so the images of a post are
+processed in parallel in a pool of worker processes instead of one after
+another in the request thread.
+
+The number of tasks waiting for or running in the pool is bounded: when
+IMAGE_ENGINE_MAX_PENDING tasks are in flight, callers wait up to
+IMAGE_ENGINE_TASK_TIMEOUT for a slot and then get ImageEngineBusy. Each
+task must finish within IMAGE_ENGINE_TASK_TIMEOUT or ImageEngineTimeout
+is raised for it.
+"""
+
+import atexit
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ImageEngineError(Exception):
+    """Raised when the image engine cannot process a task."""
+
+
+class ImageEngineBusy(ImageEngineError):
+    """Raised when no slot frees up in the task queue in time."""
+
+
+class ImageEngineTimeout(ImageEngineError):
+    """Raised when a task runs longer than the task timeout."""
+
+
+class ImageEngine:
+    """
+    Bounded process pool running image functions.
+
+    With workers=0 tasks run inline in the calling thread, which is
+    what tests and the serial benchmark baseline use.
+
+    Args:
+        workers: Number of worker processes, 0 to run inline
+        max_pending: Maximum number of submitted, unfinished tasks
+        task_timeout: Seconds a task may take, also the wait for a slot
+        start_method: multiprocessing start method of the workers
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_pending: int = 32,
+        task_timeout: float = 30,
+        start_method: str = "forkserver",
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.task_timeout = task_timeout
+        self.start_method = start_method
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Return the pool, starting it on first use."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                )
+            return self._executor
+
+    def _reset_executor(self) -> None:
+        """Drop a broken pool so the next task starts a new one."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _submit(self, func, *args):
+        """Submit a task once a queue slot is free."""
+        if not self._slots.acquire(timeout=self.task_timeout):
+            metrics.increment("image_engine_tasks_total", result="busy")
+            raise ImageEngineBusy(
+                f"{self.max_pending} image tasks already pending"
+            )
+        try:
+            future = self._get_executor().submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _result(self, future):
+        """Wait for a task within the task timeout."""
+        try:
+            return future.result(timeout=self.task_timeout)
+        except FutureTimeoutError as e:
+            # A running task cannot be interrupted; its result is dropped
+            future.cancel()
+            metrics.increment("image_engine_tasks_total", result="timeout")
+            raise ImageEngineTimeout(
+                f"Image task exceeded {self.task_timeout}s"
+            ) from e
+        except BrokenProcessPool as e:
+            logger.error("Image engine pool broke, restarting it")
+            self._reset_executor()
+            metrics.increment("image_engine_tasks_total", result="broken")
+            raise ImageEngineError("Image worker died") from e
+
+    def map(self, func, payloads, *args, return_exceptions: bool = False):
+        """
+        Run func(payload, *args) for every payload concurrently.
+
+        Args:
+            func: Module-level function (it is pickled to the workers)
+            payloads: First argument of each call
+            *args: Further arguments shared by all calls
+            return_exceptions: Return exceptions in place of results
+                instead of raising the first one
+
+        Returns:
+            List of results in the order of payloads
+        """
+        if self.workers == 0:
+            return self._map_inline(func, payloads, args, return_exceptions)
+
+        futures = []
+        results = []
+        try:
+            for payload in payloads:
+                futures.append(self._submit(func, payload, *args))
+            for future in futures:
+                try:
+                    results.append(self._result(future))
+                    metrics.increment("image_engine_tasks_total", result="ok")
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    results.append(e)
+        finally:
+            for future in futures:
+                future.cancel()
+        return results
+
+    def _map_inline(self, func, payloads, args, return_exceptions):
+        """Run tasks one after another in the calling thread."""
+        results = []
+        for payload in payloads:
+            try:
+                results.append(func(payload, *args))
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    def shutdown(self) -> None:
+        """Stop the worker processes."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> ImageEngine:
+    """Return the engine configured by IMAGE_ENGINE_* settings."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = ImageEngine(
+                workers=settings.IMAGE_ENGINE_WORKERS,
+                max_pending=settings.IMAGE_ENGINE_MAX_PENDING,
+                task_timeout=settings.IMAGE_ENGINE_TASK_TIMEOUT,
+                start_method=settings.IMAGE_ENGINE_START_METHOD,
+            )
+            atexit.register(_engine.shutdown)
+        return _engine
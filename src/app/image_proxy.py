@@ -0,0 +1,330 @@
+"""
+On-demand image transforms for DJGramm.
+
+Deployments without Cloudinary have no URL-based transformations, so
+/img/<id>/<w>x<h>.<fmt> serves a post image scaled down to fit w x h and
+encoded as fmt. The transform runs on the first request and the result
+is kept in DiskLRUCache, a size-bounded directory read through mmap.
+
+URLs carry a signature over the image, the transform and the stored
+file, so clients cannot make the server render arbitrary sizes, and a
+URL never changes meaning: a replaced image gets new URLs. Responses are
+therefore cacheable forever, with the hash of the signed value as a
+strong ETag.
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.core.signing import Signer
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+
+from . import metrics
+from .image_engine import get_engine
+from .imaging import supported_formats, thumbnail_bytes
+from .storage import local_media_path, media_key
+
+logger = logging.getLogger(__name__)
+
+# URL extension to Pillow format
+PROXY_FORMATS = {"jpg": "JPEG", "webp": "WEBP", "avif": "AVIF"}
+SIGNATURE_SALT = "app.image_proxy"
+
+
+# =============================================================================
+# Signed URLs
+# =============================================================================
+
+
+def _signed_value(image, width: int, height: int, fmt: str) -> str:
+    """Return what identifies a transform, including the stored file."""
+    return f"{image.pk}/{width}x{height}.{fmt}/{media_key(image.image)}"
+
+
+def sign_transform(image, width: int, height: int, fmt: str) -> str:
+    """
+    Sign a transform of a post image.
+
+    Args:
+        image: PostImage
+        width: Maximum width
+        height: Maximum height
+        fmt: URL extension, a key of PROXY_FORMATS
+
+    Returns:
+        URL-safe signature
+    """
+    signer = Signer(salt=SIGNATURE_SALT)
+    return signer.signature(_signed_value(image, width, height, fmt))
+
+
+def verify_transform(
+    image, width: int, height: int, fmt: str, signature: str
+) -> bool:
+    """Check a signature made by sign_transform()."""
+    expected = sign_transform(image, width, height, fmt)
+    return constant_time_compare(signature, expected)
+
+
+def transform_name(image, width: int, height: int, fmt: str) -> str:
+    """Return the cache file name of a transform, also its ETag."""
+    value = _signed_value(image, width, height, fmt)
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def image_proxy_url(image, width: int, height: int, fmt: str = "webp") -> str:
+    """
+    Build the signed proxy URL of a post image.
+
+    Example:
+        image_proxy_url(image, 300, 300) -> "/img/42/300x300.webp?s=..."
+
+    Args:
+        image: PostImage
+        width: Maximum width
+        height: Maximum height
+        fmt: URL extension, a key of PROXY_FORMATS
+
+    Returns:
+        URL path with signature
+    """
+    path = reverse(
+        "image_proxy",
+        kwargs={"pk": image.pk, "width": width, "height": height, "fmt": fmt},
+    )
+    return f"{path}?s={sign_transform(image, width, height, fmt)}"
+
+
+def is_valid_transform(width: int, height: int, fmt: str) -> bool:
+    """Return whether the proxy can produce a transform at all."""
+    max_dimension = settings.IMAGE_MAX_DIMENSION
+    return (
+        0 < width <= max_dimension
+        and 0 < height <= max_dimension
+        and PROXY_FORMATS.get(fmt) in supported_formats()
+    )
+
+
+# =============================================================================
+# Disk Cache
+# =============================================================================
+
+
+class DiskLRUCache:
+    """
+    Directory of files bounded in total size, evicting least recently used.
+
+    Files are named by the caller and sharded by their first two
+    characters. Each process keeps an index of names and sizes in use
+    order, built from the modification times on first use; reads bump
+    the modification time so a rebuilt index keeps the order. With
+    several processes the bound is approximate, as each one only evicts
+    what it has seen.
+
+    Hits are returned as read-only mmaps, served from the page cache
+    without copying the file into the process. A mapping stays valid if
+    the file is evicted while it is being sent.
+
+    Args:
+        directory: Cache directory, created on first use
+        max_bytes: Total size of the files to keep
+    """
+
+    def __init__(self, directory, max_bytes: int):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self._entries = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name[:2], name)
+
+    def _index(self) -> OrderedDict:
+        """Return name -> size, least recently used first."""
+        if self._entries is None:
+            found = []
+            os.makedirs(self.directory, exist_ok=True)
+            for shard in os.scandir(self.directory):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    # Skip files still being written
+                    if entry.name.startswith("."):
+                        continue
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.name, stat.st_size))
+            found.sort()
+            self._entries = OrderedDict(
+                (name, size) for _, name, size in found
+            )
+            self._size = sum(self._entries.values())
+        return self._entries
+
+    def get(self, name: str) -> mmap.mmap | None:
+        """
+        Map a cached file.
+
+        Args:
+            name: File name
+
+        Returns:
+            Read-only mmap the caller must close, or None on a miss
+        """
+        path = self._path(name)
+        try:
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            os.utime(path)
+        except FileNotFoundError:
+            self._forget(name)
+            return None
+        except ValueError:
+            # An empty file cannot be mapped; drop it as a miss
+            self._forget(name)
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            return None
+
+        with self._lock:
+            entries = self._index()
+            if name in entries:
+                entries.move_to_end(name)
+            else:
+                # Written by another process
+                entries[name] = len(mapped)
+                self._size += len(mapped)
+        return mapped
+
+    def _forget(self, name: str) -> None:
+        """Drop name from the index, e.g. when its file is gone."""
+        with self._lock:
+            size = self._index().pop(name, None)
+            if size is not None:
+                self._size -= size
+
+    def set(self, name: str, data: bytes) -> None:
+        """
+        Store a file, then evict until the cache fits max_bytes.
+
+        Args:
+            name: File name
+            data: File content
+        """
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        with self._lock:
+            entries = self._index()
+            self._size += len(data) - entries.pop(name, 0)
+            entries[name] = len(data)
+            while self._size > self.max_bytes and entries:
+                evicted, size = entries.popitem(last=False)
+                self._size -= size
+                try:
+                    os.unlink(self._path(evicted))
+                except FileNotFoundError:
+                    pass
+                metrics.increment("image_proxy_evictions_total")
+
+    @property
+    def size(self) -> int:
+        """Total size of the indexed files."""
+        with self._lock:
+            self._index()
+            return self._size
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> DiskLRUCache:
+    """Return the cache configured by IMAGE_PROXY_* settings."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DiskLRUCache(
+                settings.IMAGE_PROXY_CACHE_DIR,
+                settings.IMAGE_PROXY_CACHE_MAX_BYTES,
+            )
+        return _cache
+
+
+# =============================================================================
+# Transforms
+# =============================================================================
+
+
+def read_source(image) -> bytes:
+    """
+    Read the stored file of a post image.
+
+    Args:
+        image: PostImage
+
+    Returns:
+        Image bytes
+
+    Raises:
+        OSError: If the file cannot be read
+    """
+    path = local_media_path(image.image)
+    if path is not None:
+        with open(path, "rb") as f:
+            return f.read()
+    with urlopen(
+        image.image.url, timeout=settings.IMAGE_PROXY_FETCH_TIMEOUT
+    ) as response:
+        return response.read()
+
+
+def get_transform(image, width: int, height: int, fmt: str):
+    """
+    Return a transform of a post image, rendering it on a cache miss.
+
+    Args:
+        image: PostImage
+        width: Maximum width
+        height: Maximum height
+        fmt: URL extension, a key of PROXY_FORMATS
+
+    Returns:
+        mmap of the cached file on a hit, bytes on a miss
+
+    Raises:
+        OSError: If the source cannot be read
+        ImageEngineError: If the transform fails
+    """
+    name = transform_name(image, width, height, fmt)
+    cache = get_cache()
+    cached = cache.get(name)
+    if cached is not None:
+        metrics.increment("image_proxy_requests_total", result="hit")
+        return cached
+
+    source = read_source(image)
+    [data] = get_engine().map(
+        thumbnail_bytes, [source], (width, height), PROXY_FORMATS[fmt]
+    )
+    cache.set(name, data)
+    metrics.increment("image_proxy_requests_total", result="miss")
+    return data
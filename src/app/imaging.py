@@ -0,0 +1,327 @@
+"""
+Image encoding for DJGramm.
+
+Pure Pillow functions with no Django imports, so worker processes of
+the image engine can import this module without setting up Django.
+"""
+
+import base64
+from dataclasses import dataclass
+from io import BytesIO
+
+from PIL import Image, features
+
+JPEG_QUALITY = 85
+# Encoder settings per output format; the WebP and AVIF qualities give
+# about the same visual quality as JPEG at JPEG_QUALITY
+ENCODE_OPTIONS = {
+    "JPEG": {"quality": JPEG_QUALITY, "optimize": True},
+    "WEBP": {"quality": 80, "method": 4},
+    "AVIF": {"quality": 60, "speed": 6},
+}
+# Longest side of inline placeholder previews
+PLACEHOLDER_SIZE = 16
+# Resize shrinks by whole factors with a box filter first while the
+# image stays at least this many times the target size; 3.0 is
+# indistinguishable from a plain LANCZOS resize
+REDUCING_GAP = 3.0
+
+
+def _to_rgb(img: Image.Image) -> Image.Image:
+    """Convert images with transparency or a palette to RGB."""
+    if img.mode in ("RGBA", "P"):
+        return img.convert("RGB")
+    return img
+
+
+def encode_image(img: Image.Image, image_format: str = "JPEG") -> bytes:
+    """
+    Encode an image with the settings in ENCODE_OPTIONS.
+
+    Args:
+        img: RGB image
+        image_format: "JPEG", "WEBP" or "AVIF"
+
+    Returns:
+        Encoded bytes
+    """
+    buffer = BytesIO()
+    img.save(buffer, format=image_format, **ENCODE_OPTIONS[image_format])
+    return buffer.getvalue()
+
+
+def supported_formats() -> list[str]:
+    """Return the formats of ENCODE_OPTIONS this Pillow build can write."""
+    return [
+        image_format
+        for image_format in ENCODE_OPTIONS
+        if image_format == "JPEG" or features.check(image_format.lower())
+    ]
+
+
+def fit_size(size: tuple[int, int], max_dimension: int) -> tuple[int, int]:
+    """Return size scaled down to fit max_dimension, or unchanged."""
+    if max(size) <= max_dimension:
+        return size
+    ratio = max_dimension / max(size)
+    return tuple(max(1, int(dim * ratio)) for dim in size)
+
+
+def open_resized(file, max_dimension: int) -> Image.Image:
+    """Open an image as RGB, scaled down to fit max_dimension."""
+    with Image.open(file) as img:
+        new_size = fit_size(img.size, max_dimension)
+        if new_size == img.size:
+            return _to_rgb(img).copy()
+
+        # No-op for formats other than JPEG
+        img.draft(None, new_size)
+        img = _to_rgb(img)
+        return img.resize(
+            new_size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP
+        )
+
+
+def resize_to_jpeg(file, max_dimension: int = 1080) -> bytes:
+    """
+    Resize an image to fit max_dimension and encode it as JPEG.
+
+    JPEGs are decoded at 1/2, 1/4 or 1/8 scale when that still leaves
+    at least the target size, so a 48 MP photo is never fully decoded.
+    The rest of the reduction is a reducing-gap LANCZOS resize.
+
+    Args:
+        file: Path or file-like object
+        max_dimension: Maximum width or height
+
+    Returns:
+        JPEG bytes
+    """
+    return encode_image(open_resized(file, max_dimension))
+
+
+def thumbnail_image(
+    file, max_size: tuple[int, int] = (300, 300), image_format: str = "JPEG"
+) -> bytes:
+    """
+    Create a thumbnail keeping the aspect ratio.
+
+    Args:
+        file: Path or file-like object
+        max_size: Maximum dimensions (width, height)
+        image_format: Output format, a key of ENCODE_OPTIONS
+
+    Returns:
+        Encoded bytes
+    """
+    with Image.open(file) as img:
+        # Draft before converting, which loads the image
+        img.draft(None, max_size)
+        img = _to_rgb(img)
+        img.thumbnail(
+            max_size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP
+        )
+        return encode_image(img, image_format)
+
+
+def thumbnail_jpeg(file, max_size: tuple[int, int] = (300, 300)) -> bytes:
+    """thumbnail_image() encoded as JPEG."""
+    return thumbnail_image(file, max_size)
+
+
+def thumbnail_bytes(
+    data: bytes, max_size: tuple[int, int], image_format: str
+) -> bytes:
+    """thumbnail_image() for raw bytes, as sent to engine workers."""
+    return thumbnail_image(BytesIO(data), max_size, image_format)
+
+
+def resize_bytes_to_jpeg(data: bytes, max_dimension: int = 1080) -> bytes:
+    """resize_to_jpeg() for raw bytes, as sent to engine workers."""
+    return resize_to_jpeg(BytesIO(data), max_dimension)
+
+
+# =============================================================================
+# Placeholders
+# =============================================================================
+
+
+@dataclass
+class ProcessedImage:
+    """Encoded image with what pages need before it loads."""
+
+    data: bytes
+    width: int
+    height: int
+    placeholder: str
+
+
+def placeholder_data_uri(img: Image.Image) -> str:
+    """
+    Encode a PLACEHOLDER_SIZE preview of an image as a data URI.
+
+    Browsers upscale it smoothly, which gives a blurred preview of a
+    few hundred bytes that can be inlined in the page.
+
+    Args:
+        img: RGB image
+
+    Returns:
+        data: URI, WebP if supported, otherwise JPEG
+    """
+    preview = img.copy()
+    preview.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    image_format = "WEBP" if "WEBP" in supported_formats() else "JPEG"
+    buffer = BytesIO()
+    preview.save(buffer, format=image_format, quality=40)
+    encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+    return f"data:image/{image_format.lower()};base64,{encoded}"
+
+
+def process_image_bytes(
+    data: bytes, max_dimension: int = 1080
+) -> ProcessedImage:
+    """
+    Resize and encode an image as JPEG and describe the result.
+
+    Args:
+        data: Uploaded image bytes
+        max_dimension: Maximum width or height
+
+    Returns:
+        ProcessedImage of the resized image
+    """
+    img = open_resized(BytesIO(data), max_dimension)
+    return ProcessedImage(
+        data=encode_image(img),
+        width=img.width,
+        height=img.height,
+        placeholder=placeholder_data_uri(img),
+    )
+
+
+def describe_image(file) -> tuple[int, int, str]:
+    """
+    Read the size of an image and make its placeholder.
+
+    Args:
+        file: Path or file-like object
+
+    Returns:
+        Tuple of (width, height, placeholder data URI)
+    """
+    with Image.open(file) as img:
+        width, height = img.size
+        img.draft(None, fit_size(img.size, PLACEHOLDER_SIZE))
+        return width, height, placeholder_data_uri(_to_rgb(img))
+
+
+# =============================================================================
+# Perceptual Hashing
+# =============================================================================
+
+
+def dhash(img: Image.Image) -> int:
+    """
+    Compute the 64-bit difference hash of an image.
+
+    Each bit tells whether a pixel of a 9x8 grayscale version is
+    brighter than its right neighbour, so re-encoded, resized or
+    slightly edited copies get hashes a few bits apart.
+
+    Args:
+        img: Image in any mode
+
+    Returns:
+        Unsigned 64-bit hash
+    """
+    small = img.convert("L").resize((9, 8), Image.Resampling.LANCZOS)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def dhash_bytes(data: bytes) -> int:
+    """dhash() of encoded image bytes, decoding JPEGs at 1/8 scale."""
+    with Image.open(BytesIO(data)) as img:
+        img.draft("L", (72, 64))
+        return dhash(img)
+
+
+# =============================================================================
+# Header Sniffing
+# =============================================================================
+
+# Leading bytes of the formats accepted for upload
+SIGNATURES = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+)
+
+
+def sniff_format(data: bytes) -> str | None:
+    """
+    Identify an image format from its first bytes.
+
+    Args:
+        data: Start of the file, at least 12 bytes
+
+    Returns:
+        "JPEG", "PNG" or "WEBP", or None for anything else
+    """
+    for magic, image_format in SIGNATURES:
+        if data.startswith(magic):
+            return image_format
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+def _webp_size(data: bytes) -> tuple[int, int] | None:
+    """Read WebP dimensions from the first chunk header."""
+    if len(data) < 30:
+        return None
+    chunk = data[12:16]
+    if chunk == b"VP8X":
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return width, height
+    if chunk == b"VP8 " and data[23:26] == b"\x9d\x01\x2a":
+        width = int.from_bytes(data[26:28], "little") & 0x3FFF
+        height = int.from_bytes(data[28:30], "little") & 0x3FFF
+        return width, height
+    if chunk == b"VP8L" and data[20] == 0x2F:
+        bits = int.from_bytes(data[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    raise ValueError("Unknown WebP chunk")
+
+
+def read_dimensions(data: bytes, image_format: str) -> tuple[int, int] | None:
+    """
+    Read image dimensions from the start of a file without decoding it.
+
+    Args:
+        data: Start of the file
+        image_format: Format returned by sniff_format()
+
+    Returns:
+        (width, height), or None when data ends before the header does
+
+    Raises:
+        ValueError: If a WebP header is invalid
+        Image.DecompressionBombError: If Pillow refuses the pixel count
+    """
+    if image_format == "WEBP":
+        # Pillow's WebP plugin needs the whole file
+        return _webp_size(data)
+    try:
+        with Image.open(BytesIO(data), formats=[image_format]) as img:
+            return img.size
+    except OSError:
+        # Also raised for truncated data; the caller reads more
+        return None
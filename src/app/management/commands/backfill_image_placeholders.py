@@ -0,0 +1,94 @@
+"""Management command to fill size and placeholder of existing images."""
+
+from io import BytesIO
+from urllib.request import urlopen
+
+from django.core.management.base import BaseCommand
+
+from app.imaging import describe_image
+from app.models import PostImage
+
+
+class Command(BaseCommand):
+    help = "Store width, height and placeholder of images missing them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of images updated per statement",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=10,
+            help="Seconds to wait for each image download",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Show how many images would be updated",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        missing = PostImage.objects.filter(width__isnull=True)
+
+        total = missing.count()
+        if total == 0:
+            self.stdout.write(self.style.WARNING("No images to backfill."))
+            return
+
+        if options["dry_run"]:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"DRY RUN - {total} images have no size or placeholder"
+                )
+            )
+            return
+
+        # Walk primary keys so images that fail are not fetched again
+        updated = 0
+        errors = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                missing.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .only("pk", "image")[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            described = []
+            for image in batch:
+                try:
+                    with urlopen(
+                        image.image.url, timeout=options["timeout"]
+                    ) as response:
+                        data = response.read()
+                    image.width, image.height, image.placeholder = (
+                        describe_image(BytesIO(data))
+                    )
+                except Exception as e:
+                    errors += 1
+                    self.stdout.write(
+                        self.style.ERROR(f"Image {image.pk}: {e}")
+                    )
+                    continue
+                described.append(image)
+
+            PostImage.objects.bulk_update(
+                described, ["width", "height", "placeholder"]
+            )
+            updated += len(described)
+            self.stdout.write(f"Processed {updated}/{total} images...")
+
+        # Cached pages pick the placeholders up as they expire
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"\nSuccessfully updated {updated} images ({errors} errors)"
+            )
+        )
@@ -0,0 +1,66 @@
+"""Management command to fill Post.cover_image for existing posts."""
+
+from django.core.management.base import BaseCommand
+
+from app.models import Post
+
+
+class Command(BaseCommand):
+    help = "Point cover_image of every post at its first image by order"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of posts updated per statement",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Show how many posts would be updated",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        dry_run = options["dry_run"]
+
+        total = Post.objects.count()
+        if total == 0:
+            self.stdout.write(self.style.WARNING("No posts found."))
+            return
+
+        if dry_run:
+            missing = Post.objects.filter(
+                cover_image__isnull=True, images__isnull=False
+            ).distinct()
+            self.stdout.write(
+                self.style.WARNING(
+                    f"DRY RUN - {missing.count()} of {total} posts "
+                    "have images but no cover"
+                )
+            )
+            return
+
+        # Walk primary keys in ranges so each UPDATE stays short
+        updated = 0
+        last_pk = 0
+        while True:
+            pks = list(
+                Post.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            updated += Post.objects.filter(
+                pk__gte=pks[0], pk__lte=pks[-1]
+            ).refresh_covers()
+            last_pk = pks[-1]
+            self.stdout.write(f"Processed {updated}/{total} posts...")
+
+        # Pages and cards already showed the first image, so cached
+        # copies stay valid and are not invalidated here
+        self.stdout.write(
+            self.style.SUCCESS(f"\nSuccessfully updated {updated} posts")
+        )
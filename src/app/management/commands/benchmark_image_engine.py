@@ -0,0 +1,103 @@
+"""Management command to compare serial and parallel image processing."""
+
+import os
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from app.image_engine import ImageEngine
+from app.imaging import resize_bytes_to_jpeg
+
+
+def make_test_jpeg(width: int, height: int) -> bytes:
+    """Return a noisy JPEG that does not compress to nothing."""
+    img = Image.frombytes(
+        "RGB", (width, height), os.urandom(width * height * 3)
+    )
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark resizing a post's images serially and in the image engine"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--images",
+            type=int,
+            default=10,
+            help="Number of images per post",
+        )
+        parser.add_argument(
+            "--size",
+            default="4000x3000",
+            help="Size of each image as WIDTHxHEIGHT",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Worker processes of the parallel run",
+        )
+        parser.add_argument(
+            "--rounds",
+            type=int,
+            default=3,
+            help="Posts processed per run; the best round is reported",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            width, height = (int(n) for n in options["size"].split("x"))
+        except ValueError as e:
+            raise CommandError("--size must look like 4000x3000") from e
+
+        count = options["images"]
+        self.stdout.write(f"Generating {count} images of {width}x{height}...")
+        payloads = [make_test_jpeg(width, height) for _ in range(count)]
+
+        serial = self._run(ImageEngine(workers=0), payloads, options["rounds"])
+        engine = ImageEngine(
+            workers=options["workers"],
+            max_pending=max(count, 1),
+            task_timeout=settings.IMAGE_ENGINE_TASK_TIMEOUT,
+            start_method=settings.IMAGE_ENGINE_START_METHOD,
+        )
+        try:
+            # Start the workers outside of the measured rounds
+            engine.map(resize_bytes_to_jpeg, payloads[:1])
+            parallel = self._run(engine, payloads, options["rounds"])
+        finally:
+            engine.shutdown()
+
+        self._report("serial", serial, count)
+        self._report(
+            f"parallel ({options['workers']} workers)", parallel, count
+        )
+        if parallel:
+            self.stdout.write(
+                self.style.SUCCESS(f"\nSpeedup: {serial / parallel:.2f}x")
+            )
+
+    def _run(self, engine, payloads, rounds) -> float:
+        """Return the best wall time of processing all payloads."""
+        best = float("inf")
+        for _ in range(max(rounds, 1)):
+            start = time.perf_counter()
+            engine.map(
+                resize_bytes_to_jpeg, payloads, settings.IMAGE_MAX_DIMENSION
+            )
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    def _report(self, label, seconds, count) -> None:
+        rate = count / seconds if seconds else float("inf")
+        self.stdout.write(
+            f"{label}: {seconds * 1000:.0f} ms, {rate:.1f} images/s"
+        )
@@ -0,0 +1,82 @@
+"""Management command to compare JPEG, WebP and AVIF encoding."""
+
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from app.imaging import encode_image, open_resized, supported_formats
+
+
+def make_test_photo(width: int, height: int) -> bytes:
+    """Return a JPEG with smooth gradients and grain, like a photo."""
+    gradient = Image.linear_gradient("L").resize((width, height))
+    radial = Image.radial_gradient("L").resize((width, height))
+    grain = Image.effect_noise((width, height), 24)
+    img = Image.merge("RGB", (gradient, radial, grain))
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = "Report encode time and output size of each image format"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths",
+            nargs="*",
+            help="Images to encode; a generated photo is used if omitted",
+        )
+        parser.add_argument(
+            "--size",
+            default="4000x3000",
+            help="Size of the generated photo as WIDTHxHEIGHT",
+        )
+        parser.add_argument(
+            "--max-dimension",
+            type=int,
+            default=settings.IMAGE_MAX_DIMENSION,
+            help="Size images are resized to before encoding",
+        )
+
+    def handle(self, *args, **options):
+        if options["paths"]:
+            sources = []
+            for path in options["paths"]:
+                with open(path, "rb") as f:
+                    sources.append(f.read())
+        else:
+            try:
+                width, height = (int(n) for n in options["size"].split("x"))
+            except ValueError as e:
+                raise CommandError("--size must look like 4000x3000") from e
+            sources = [make_test_photo(width, height)]
+
+        images = [
+            open_resized(BytesIO(data), options["max_dimension"])
+            for data in sources
+        ]
+        formats = supported_formats()
+        totals = {}
+        for image_format in formats:
+            seconds = 0.0
+            size = 0
+            for img in images:
+                start = time.perf_counter()
+                size += len(encode_image(img, image_format))
+                seconds += time.perf_counter() - start
+            totals[image_format] = (seconds, size)
+
+        jpeg_size = totals["JPEG"][1]
+        self.stdout.write(
+            f"{len(images)} image(s) at {options['max_dimension']} px:"
+        )
+        for image_format, (seconds, size) in totals.items():
+            self.stdout.write(
+                f"{image_format:5} {seconds * 1000 / len(images):7.0f} ms "
+                f"{size / len(images) / 1024:8.1f} KB "
+                f"{size / jpeg_size:6.0%} of JPEG"
+            )
@@ -0,0 +1,89 @@
+"""Management command to delete stored media no longer referenced."""
+
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.fields import media_join_key
+from app.media_gc import (
+    collect_orphans,
+    delete_cloudinary,
+    delete_local,
+    iter_cloudinary_media,
+    iter_local_media,
+    local_join_key,
+    media_folders,
+)
+from app.storage import get_local_storage
+
+
+class Command(BaseCommand):
+    help = "Delete stored images that no post image or avatar refers to"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backend",
+            choices=["local", "cloudinary"],
+            help="Storage to collect, by default MEDIA_BACKEND",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of files deleted per call (Cloudinary allows 100)",
+        )
+        parser.add_argument(
+            "--min-age-hours",
+            type=float,
+            default=24,
+            help="Keep files younger than this, as their rows may be pending",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report orphaned files without deleting them",
+        )
+
+    def handle(self, *args, **options):
+        backend = options["backend"] or settings.MEDIA_BACKEND
+        if backend == "local":
+            storage = get_local_storage()
+            listing = iter_local_media(storage)
+            delete = partial(delete_local, storage)
+            join_key = local_join_key
+        else:
+            listing = iter_cloudinary_media(media_folders())
+            delete = delete_cloudinary
+            join_key = media_join_key
+
+        report = collect_orphans(
+            listing,
+            delete,
+            batch_size=options["batch_size"],
+            min_age=timedelta(hours=options["min_age_hours"]),
+            dry_run=options["dry_run"],
+            join_key=join_key,
+        )
+
+        megabytes = report.orphan_bytes / (1024 * 1024)
+        self.stdout.write(f"Listed {report.listed} {backend} files.")
+        self.stdout.write(
+            f"Skipped {report.skipped_recent} recent and "
+            f"{report.skipped_referenced} newly referenced files."
+        )
+        if options["dry_run"]:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"DRY RUN - {report.orphans} orphaned files "
+                    f"({megabytes:.1f} MB) would be deleted"
+                )
+            )
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Deleted {report.deleted} of {report.orphans} orphaned "
+                    f"files ({megabytes:.1f} MB)."
+                )
+            )
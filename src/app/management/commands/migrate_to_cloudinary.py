@@ -2,11 +2,12 @@
 
 import os
 
-import cloudinary.uploader
 from django.conf import settings
 from django.core.management.base import BaseCommand
 
+from app.media_client import get_media_client
 from app.models import PostImage, Profile
+from app.storage import local_media_path
 
 
 class Command(BaseCommand):
@@ -90,8 +91,12 @@ class Command(BaseCommand):
                 # Try to find local file
                 file_path = None
                 try:
-                    # First, try to get path directly
-                    if hasattr(profile.avatar, "path"):
+                    # Content-addressed files map straight to a path
+                    content_path = local_media_path(profile.avatar)
+                    if content_path:
+                        file_path = content_path
+                    # Then try to get path directly
+                    elif hasattr(profile.avatar, "path"):
                         file_path = profile.avatar.path
                     else:
                         # Try to find file by value in media directory
@@ -169,7 +174,7 @@ class Command(BaseCommand):
                         )
                     else:
                         # Upload to Cloudinary
-                        result = cloudinary.uploader.upload(
+                        result = get_media_client().upload(
                             file_path,
                             folder="avatars",
                             resource_type="image",
@@ -250,8 +255,12 @@ class Command(BaseCommand):
                 # Try to find local file
                 file_path = None
                 try:
-                    # First, try to get path directly
-                    if hasattr(post_image.image, "path"):
+                    # Content-addressed files map straight to a path
+                    content_path = local_media_path(post_image.image)
+                    if content_path:
+                        file_path = content_path
+                    # Then try to get path directly
+                    elif hasattr(post_image.image, "path"):
                         file_path = post_image.image.path
                     else:
                         # Try to find file by value in media directory
@@ -327,7 +336,7 @@ class Command(BaseCommand):
                         )
                     else:
                         # Upload to Cloudinary
-                        result = cloudinary.uploader.upload(
+                        result = get_media_client().upload(
                             file_path,
                             folder="posts",
                             resource_type="image",
@@ -0,0 +1,25 @@
+"""Management command to retry Cloudinary deletions that failed."""
+
+from django.core.management.base import BaseCommand
+
+from app.services import retry_media_deletions
+
+
+class Command(BaseCommand):
+    help = "Retry deleting Cloudinary files queued while it was unavailable"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of queued deletions loaded per query",
+        )
+
+    def handle(self, *args, **options):
+        deleted, remaining = retry_media_deletions(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} files."))
+        if remaining:
+            self.stdout.write(
+                self.style.WARNING(f"{remaining} deletions still queued.")
+            )
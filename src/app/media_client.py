@@ -0,0 +1,349 @@
+"""
+Guarded Cloudinary client for DJGramm.
+
+Calls to the Cloudinary API block the worker making them, so an API that
+is slow or down would stall every worker uploading or deleting media.
+MediaClient puts connect and read timeouts on every call, retries
+transient failures a bounded number of times with jittered exponential
+backoff, and trips a circuit breaker when too many recent calls failed.
+While the circuit is open, calls fail at once with MediaUnavailable and
+callers defer the work: uploads go to local storage and deletions are
+queued as PendingMediaDeletion rows.
+
+Circuit state is exported as the media_circuit_state gauge (0 closed,
+1 half-open, 2 open), calls as media_client_calls_total.
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+import cloudinary.uploader
+from cloudinary.exceptions import Error as CloudinaryError
+from cloudinary.exceptions import GeneralError, RateLimited
+from django.conf import settings
+from urllib3 import Timeout
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MediaClientError(Exception):
+    """Raised when a media API call fails after all retries."""
+
+
+class MediaUnavailable(MediaClientError):
+    """Raised without calling the API while the circuit is open."""
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Return whether a failed call may succeed when retried.
+
+    The SDK raises plain Error for network failures, timeouts and
+    unparsable (e.g. proxy 502) responses, and subclasses per status
+    code; of those only rate limiting and server errors are transient.
+    """
+    if isinstance(error, RateLimited | GeneralError):
+        return True
+    return type(error) is CloudinaryError
+
+
+# =============================================================================
+# Circuit Breaker
+# =============================================================================
+
+
+class CircuitBreaker:
+    """
+    Failure-rate circuit breaker.
+
+    Closed, it lets calls through and remembers their outcomes for
+    window seconds. Once at least min_calls outcomes are remembered and
+    failure_rate of them are failures it opens and rejects calls. After
+    reset_timeout it lets a single trial call through (half-open): a
+    success closes it, a failure opens it again.
+
+    Args:
+        name: Label of the exported metrics
+        failure_rate: Share of failed calls that opens the circuit
+        min_calls: Calls needed in the window before it can open
+        window: Seconds outcomes are remembered
+        reset_timeout: Seconds to stay open before a trial call
+        clock: Monotonic time source, replaceable in tests
+    """
+
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    GAUGE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = 0.5,
+        min_calls: int = 10,
+        window: float = 30,
+        reset_timeout: float = 30,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._outcomes = deque()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+        self._set_state(self.CLOSED)
+
+    def _set_state(self, state: str) -> None:
+        self._state = state
+        metrics.set_gauge(
+            "media_circuit_state", self.GAUGE_VALUES[state], client=self.name
+        )
+
+    def _transition(self, state: str) -> None:
+        logger.warning(
+            "Media circuit %s: %s -> %s", self.name, self._state, state
+        )
+        metrics.increment(
+            "media_circuit_transitions_total", client=self.name, state=state
+        )
+        self._set_state(state)
+
+    @property
+    def state(self) -> str:
+        """Current state, moving from open to half-open when due."""
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if (
+            self._state == self.OPEN
+            and self.clock() - self._opened_at >= self.reset_timeout
+        ):
+            self._transition(self.HALF_OPEN)
+        return self._state
+
+    def allow(self) -> bool:
+        """Return whether a call may go ahead now."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record(self, success: bool) -> None:
+        """Record the outcome of a call allowed by allow()."""
+        with self._lock:
+            now = self.clock()
+            if self._state == self.HALF_OPEN:
+                self._trial_running = False
+                self._clear()
+                if success:
+                    self._transition(self.CLOSED)
+                else:
+                    self._open(now)
+                return
+
+            self._outcomes.append((now, success))
+            self._failures += not success
+            while self._outcomes and self._outcomes[0][0] <= now - self.window:
+                _, old_success = self._outcomes.popleft()
+                self._failures -= not old_success
+
+            calls = len(self._outcomes)
+            if (
+                self._state == self.CLOSED
+                and calls >= self.min_calls
+                and self._failures >= self.failure_rate * calls
+            ):
+                self._clear()
+                self._open(now)
+
+    def _open(self, now: float) -> None:
+        self._opened_at = now
+        self._transition(self.OPEN)
+
+    def _clear(self) -> None:
+        self._outcomes.clear()
+        self._failures = 0
+
+
+# =============================================================================
+# Client
+# =============================================================================
+
+
+class MediaClient:
+    """
+    Cloudinary API calls with timeouts, retries and a circuit breaker.
+
+    Args:
+        breaker: Circuit breaker shared by all calls
+        connect_timeout: Seconds to establish a connection
+        read_timeout: Seconds to wait for response data
+        retries: Extra attempts after a transient failure
+        backoff_base: Upper bound of the first backoff, in seconds
+        backoff_max: Upper bound of any backoff, in seconds
+        options: Options added to every SDK call, e.g. upload_prefix
+    """
+
+    def __init__(
+        self,
+        breaker: CircuitBreaker,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 20,
+        retries: int = 2,
+        backoff_base: float = 0.2,
+        backoff_max: float = 2.0,
+        options: dict | None = None,
+    ):
+        self.breaker = breaker
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.options = options or {}
+
+    @property
+    def timeout(self) -> Timeout:
+        """urllib3 timeout passed to the SDK as the timeout option."""
+        return Timeout(connect=self.connect_timeout, read=self.read_timeout)
+
+    def backoff(self, attempt: int) -> float:
+        """Return a full-jitter delay before retry number attempt."""
+        ceiling = min(self.backoff_max, self.backoff_base * 2**attempt)
+        return random.uniform(0, ceiling)
+
+    def call(self, operation: str, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs) under the breaker and retry policy.
+
+        Args:
+            operation: Label of the call in metrics and logs
+            func: Function making one API request
+
+        Returns:
+            Result of func
+
+        Raises:
+            MediaUnavailable: If the circuit is open
+            MediaClientError: If every attempt failed transiently
+            cloudinary.exceptions.Error: For non-transient API errors
+        """
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                metrics.increment(
+                    "media_client_calls_total", op=operation, result="rejected"
+                )
+                raise MediaUnavailable(
+                    f"Media API circuit is open, {operation} not attempted"
+                )
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_transient(e):
+                    # The API answered, so it is up
+                    self.breaker.record(success=True)
+                    metrics.increment(
+                        "media_client_calls_total",
+                        op=operation,
+                        result="error",
+                    )
+                    raise
+                self.breaker.record(success=False)
+                last_error = e
+                logger.warning(
+                    "Media %s attempt %d failed: %s", operation, attempt + 1, e
+                )
+                if attempt < self.retries:
+                    metrics.increment(
+                        "media_client_calls_total",
+                        op=operation,
+                        result="retry",
+                    )
+                    time.sleep(self.backoff(attempt))
+                continue
+
+            self.breaker.record(success=True)
+            metrics.increment(
+                "media_client_calls_total", op=operation, result="ok"
+            )
+            return result
+
+        metrics.increment(
+            "media_client_calls_total", op=operation, result="failed"
+        )
+        raise MediaClientError(
+            f"Media {operation} failed after {self.retries + 1} attempts"
+        ) from last_error
+
+    def sdk_options(self, **options) -> dict:
+        """Return options for an SDK call, with the client's timeout."""
+        return {"timeout": self.timeout, **self.options, **options}
+
+    def upload(self, file, **options) -> dict:
+        """
+        Upload a file, see cloudinary.uploader.upload().
+
+        Args:
+            file: Path or file-like object
+            **options: Upload options, e.g. folder
+
+        Returns:
+            Upload result
+        """
+
+        def attempt():
+            if hasattr(file, "seek"):
+                file.seek(0)
+            return cloudinary.uploader.upload(
+                file, **self.sdk_options(**options)
+            )
+
+        return self.call("upload", attempt)
+
+    def destroy(self, public_id: str, **options) -> dict:
+        """Delete a file, see cloudinary.uploader.destroy()."""
+        return self.call(
+            "destroy",
+            cloudinary.uploader.destroy,
+            public_id,
+            **self.sdk_options(**options),
+        )
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_media_client() -> MediaClient:
+    """Return the client configured by MEDIA_CLIENT_* settings."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = MediaClient(
+                breaker=CircuitBreaker(
+                    "cloudinary",
+                    failure_rate=settings.MEDIA_CLIENT_FAILURE_RATE,
+                    min_calls=settings.MEDIA_CLIENT_MIN_CALLS,
+                    window=settings.MEDIA_CLIENT_WINDOW,
+                    reset_timeout=settings.MEDIA_CLIENT_RESET_TIMEOUT,
+                ),
+                connect_timeout=settings.MEDIA_CLIENT_CONNECT_TIMEOUT,
+                read_timeout=settings.MEDIA_CLIENT_READ_TIMEOUT,
+                retries=settings.MEDIA_CLIENT_RETRIES,
+            )
+        return _client
@@ -0,0 +1,310 @@
+"""
+Orphaned media collection for DJGramm.
+
+Deleting posts, images or avatars removes database rows but leaves the
+stored files behind. collect_orphans() finds files no row refers to by
+merge-joining two streams sorted by media_join_key(): the storage
+listing, paged from Cloudinary's Search API or walked from the local
+content-addressed tree, and the media field values of the database,
+read in order with a server-side cursor. Neither side is ever held in
+memory, so the run uses constant memory however many files there are.
+
+Candidates are deleted in batches. Each batch is first checked again
+against the database, so files referenced since the join began are
+kept, and files younger than the grace period are skipped because
+their rows may not be committed yet.
+"""
+
+import heapq
+import logging
+import os
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+from itertools import islice
+
+import cloudinary.api
+import cloudinary.search
+from django.db.models import Q
+from django.utils import timezone
+
+from .fields import MediaField, MediaKey, media_join_key
+from .media_client import get_media_client
+from .models import PostImage, Profile
+from .storage import INCOMING_DIR, parse_content_key
+
+logger = logging.getLogger(__name__)
+
+# Models and fields holding media references
+REFERENCES = ((Profile, "avatar"), (PostImage, "image"))
+
+
+class MediaOrderError(Exception):
+    """Raised when a stream is not in the order the join relies on."""
+
+
+@dataclass
+class StoredMedia:
+    """File found in a storage listing."""
+
+    key: str
+    size: int
+    created_at: datetime
+
+
+@dataclass
+class CollectionReport:
+    """Outcome of a collection run."""
+
+    listed: int = 0
+    orphans: int = 0
+    orphan_bytes: int = 0
+    deleted: int = 0
+    skipped_recent: int = 0
+    skipped_referenced: int = 0
+
+
+# =============================================================================
+# Sorted Streams
+# =============================================================================
+
+
+def _ordered(pairs, name: str):
+    """Pass (key, item) pairs through, checking keys never decrease."""
+    previous = None
+    for pair in pairs:
+        if previous is not None and pair[0] < previous:
+            raise MediaOrderError(
+                f"{name} out of order: {pair[0]!r} after {previous!r}"
+            )
+        previous = pair[0]
+        yield pair
+
+
+def iter_references(chunk_size: int = 2000):
+    """
+    Yield the join keys of all media field values in ascending order.
+
+    Each model is read with a cursor ordered by MediaKey and the
+    streams are merged, so only one chunk per model is in memory.
+    """
+    streams = []
+    for model, field in REFERENCES:
+        values = (
+            model.objects.exclude(Q(**{field: ""}) | Q(**{field: None}))
+            .annotate(media_key=MediaKey(field))
+            .order_by("media_key")
+            .values_list("media_key", flat=True)
+            .iterator(chunk_size=chunk_size)
+        )
+        streams.append(values)
+    return heapq.merge(*streams)
+
+
+def referenced_keys(keys) -> set[str]:
+    """Return which of keys media fields currently refer to."""
+    found = set()
+    for model, field in REFERENCES:
+        found.update(
+            model.objects.annotate(media_key=MediaKey(field))
+            .filter(media_key__in=keys)
+            .values_list("media_key", flat=True)
+        )
+    return found
+
+
+def iter_local_media(storage):
+    """
+    Walk content-addressed storage in ascending key order.
+
+    Only files named by content keys ("shard/digest.ext") are listed,
+    joined on "shard/digest" like media field values; files still being
+    written in INCOMING_DIR and other names are skipped.
+
+    Yields:
+        (join key, StoredMedia) pairs
+    """
+    root = storage.location
+    if not os.path.isdir(root):
+        return
+    for first in sorted(os.listdir(root)):
+        if first == INCOMING_DIR:
+            continue
+        first_path = os.path.join(root, first)
+        if not os.path.isdir(first_path):
+            continue
+        for second in sorted(os.listdir(first_path)):
+            second_path = os.path.join(first_path, second)
+            if not os.path.isdir(second_path):
+                continue
+            for entry in sorted(os.scandir(second_path), key=_entry_name):
+                key = f"{first}/{second}/{entry.name}"
+                match = parse_content_key(key)
+                if match is None:
+                    continue
+                stat = entry.stat()
+                created_at = datetime.fromtimestamp(stat.st_mtime, tz=UTC)
+                yield (
+                    local_join_key(key),
+                    StoredMedia(key, stat.st_size, created_at),
+                )
+
+
+def _entry_name(entry) -> str:
+    return entry.name
+
+
+def local_join_key(key: str) -> str:
+    """Join key of a local file, its key without extension."""
+    match = parse_content_key(key)
+    return f"{match['shard']}/{match['digest']}"
+
+
+def media_folders() -> list[str]:
+    """Return the Cloudinary folders media fields upload to."""
+    return sorted(
+        {
+            model._meta.get_field(field).options["folder"]
+            for model, field in REFERENCES
+            if isinstance(model._meta.get_field(field), MediaField)
+        }
+    )
+
+
+def iter_cloudinary_media(folders, page_size: int = 500):
+    """
+    Page through Cloudinary images in the folders by public ID.
+
+    Yields:
+        (join key, StoredMedia) pairs
+    """
+    client = get_media_client()
+    expression = " OR ".join(f"folder:{folder}" for folder in folders)
+    cursor = None
+    while True:
+        search = (
+            cloudinary.search.Search()
+            .expression(f"resource_type:image AND ({expression})")
+            .sort_by("public_id", "asc")
+            .max_results(page_size)
+        )
+        if cursor:
+            search.next_cursor(cursor)
+        result = client.call("search", search.execute, **client.sdk_options())
+        for resource in result.get("resources", []):
+            created_at = datetime.fromisoformat(
+                resource["created_at"].replace("Z", "+00:00")
+            )
+            public_id = resource["public_id"]
+            yield (
+                media_join_key(public_id),
+                StoredMedia(public_id, resource.get("bytes", 0), created_at),
+            )
+        cursor = result.get("next_cursor")
+        if not cursor:
+            return
+
+
+# =============================================================================
+# Collection
+# =============================================================================
+
+
+def find_orphans(listing, references):
+    """
+    Merge-join a storage listing against references.
+
+    Args:
+        listing: (join key, StoredMedia) pairs in ascending key order
+        references: Join keys in ascending order, duplicates allowed
+
+    Yields:
+        StoredMedia no reference matches
+
+    Raises:
+        MediaOrderError: If either stream is out of order
+    """
+    refs = _ordered(((key, None) for key in references), "references")
+    ref = next(refs, (None,))[0]
+    for key, stored in _ordered(listing, "listing"):
+        while ref is not None and ref < key:
+            ref = next(refs, (None,))[0]
+        if ref != key:
+            yield stored
+
+
+def delete_local(storage, batch) -> int:
+    """Delete a batch of local files, returning how many were deleted."""
+    for stored in batch:
+        storage.delete(stored.key)
+    return len(batch)
+
+
+def delete_cloudinary(batch) -> int:
+    """Delete a batch of Cloudinary images, returning how many went."""
+    client = get_media_client()
+    result = client.call(
+        "delete_resources",
+        cloudinary.api.delete_resources,
+        [stored.key for stored in batch],
+        **client.sdk_options(),
+    )
+    deleted = result.get("deleted", {})
+    return sum(1 for status in deleted.values() if status == "deleted")
+
+
+def collect_orphans(
+    listing,
+    delete,
+    batch_size: int = 100,
+    min_age: timedelta = timedelta(hours=24),
+    dry_run: bool = False,
+    join_key=media_join_key,
+) -> CollectionReport:
+    """
+    Find and delete stored files no media field refers to.
+
+    Args:
+        listing: Sorted storage listing, see iter_local_media()
+        delete: Function deleting a list of StoredMedia, returning
+            the number deleted
+        batch_size: Files deleted per call of delete
+        min_age: Files younger than this are kept
+        dry_run: Only count what would be deleted
+        join_key: Join key of a StoredMedia key, for the recheck
+
+    Returns:
+        CollectionReport
+    """
+    report = CollectionReport()
+    cutoff = timezone.now() - min_age
+
+    def counted(pairs):
+        for pair in pairs:
+            report.listed += 1
+            yield pair
+
+    orphans = find_orphans(counted(listing), iter_references())
+    while batch := list(islice(orphans, batch_size)):
+        candidates = []
+        for stored in batch:
+            if stored.created_at > cutoff:
+                report.skipped_recent += 1
+            else:
+                candidates.append(stored)
+
+        # Rows may have been created since the join passed their key
+        still_used = referenced_keys(
+            {join_key(stored.key) for stored in candidates}
+        )
+        orphaned = [
+            stored
+            for stored in candidates
+            if join_key(stored.key) not in still_used
+        ]
+        report.skipped_referenced += len(candidates) - len(orphaned)
+        report.orphans += len(orphaned)
+        report.orphan_bytes += sum(stored.size for stored in orphaned)
+        if orphaned and not dry_run:
+            report.deleted += delete(orphaned)
+            logger.info("Deleted %d orphaned media files", len(orphaned))
+    return report
@@ -0,0 +1,113 @@
+"""
+Media URLs for DJGramm.
+
+Building a Cloudinary URL means merging options, signing nothing and
+formatting strings in cloudinary.utils on every access to .url, which
+adds up for pages listing dozens of avatars. The URL is a pure function
+of the stored value and the transformation, so image_url() memoizes it
+in a process-wide LRU.
+
+The standard transformations in IMAGE_TRANSFORMS are also requested as
+eager transformations when a file is uploaded, so Cloudinary has them
+ready before the first page view instead of rendering them on it.
+"""
+
+from functools import lru_cache
+
+from cloudinary import utils
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .storage import media_key, parse_content_key
+
+# Distinct (file, transformation) pairs kept; a URL is about 120 bytes
+URL_MEMO_SIZE = 10_000
+
+
+def eager_transformations(transforms) -> list[dict]:
+    """
+    Return the eager transformations of an upload.
+
+    Args:
+        transforms: Names of IMAGE_TRANSFORMS used for the field; the
+            original in each IMAGE_RENDITION_FORMATS is always included
+
+    Returns:
+        List of Cloudinary transformation dicts
+    """
+    eager = [
+        {"format": image_format}
+        for image_format in settings.IMAGE_RENDITION_FORMATS
+    ]
+    for name in transforms:
+        eager.append(dict(settings.IMAGE_TRANSFORMS[name]))
+    return eager
+
+
+@lru_cache(maxsize=URL_MEMO_SIZE)
+def _cloudinary_url(
+    public_id: str,
+    image_format: str | None,
+    version,
+    upload_type: str,
+    resource_type: str,
+    transform: str | None,
+    fmt: str | None,
+) -> str:
+    """Build a Cloudinary URL; arguments are hashable for the memo."""
+    options = dict(settings.IMAGE_TRANSFORMS[transform]) if transform else {}
+    url, _ = utils.cloudinary_url(
+        public_id,
+        format=fmt or image_format,
+        version=version,
+        type=upload_type,
+        resource_type=resource_type,
+        **options,
+    )
+    return url
+
+
+@receiver(setting_changed)
+def _clear_url_memo(setting, **kwargs):
+    """Drop memoized URLs built with settings that changed."""
+    if setting in ("IMAGE_TRANSFORMS", "STORAGES", "MEDIA_URL"):
+        _cloudinary_url.cache_clear()
+
+
+def image_url(value, transform: str | None = None, fmt: str | None = None):
+    """
+    Return the URL of a media field value.
+
+    Example:
+        image_url(profile.avatar, "avatar") -> ".../c_fill,g_face,.../x.jpg"
+
+    Args:
+        value: CloudinaryResource of a media field
+        transform: Name of an IMAGE_TRANSFORMS entry
+        fmt: Format to convert to, e.g. "webp"
+
+    Returns:
+        URL string, empty if there is no value. Local content-addressed
+        files are served as stored, without transformation.
+    """
+    if not value:
+        return ""
+
+    key = media_key(value)
+    if parse_content_key(key):
+        return default_storage.url(key)
+
+    public_id = getattr(value, "public_id", None)
+    if public_id is None:
+        return ""
+    return _cloudinary_url(
+        public_id,
+        value.format,
+        value.version,
+        value.type or "upload",
+        value.resource_type or "image",
+        transform,
+        fmt,
+    )
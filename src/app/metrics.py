@@ -0,0 +1,79 @@
+"""In-process metrics for DJGramm."""
+
+import os
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters: dict[tuple[str, tuple], int] = defaultdict(int)
+_gauges: dict[tuple[str, tuple], float] = {}
+
+
+def _labels_key(labels: dict | None) -> tuple:
+    """Return hashable, ordered form of labels."""
+    return tuple(sorted((labels or {}).items()))
+
+
+def increment(name: str, value: int = 1, **labels) -> None:
+    """
+    Increment a counter.
+
+    Args:
+        name: Metric name, e.g. "cache_hits_total"
+        value: Amount to add
+        **labels: Label values, e.g. tier="local"
+    """
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] += value
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    """Set a gauge to value."""
+    with _lock:
+        _gauges[(name, _labels_key(labels))] = value
+
+
+def get_counter(name: str, **labels) -> int:
+    """Return current value of a counter."""
+    with _lock:
+        return _counters.get((name, _labels_key(labels)), 0)
+
+
+def snapshot() -> dict[str, list[tuple[dict, float]]]:
+    """
+    Return all metrics.
+
+    Returns:
+        Dict mapping metric name to list of (labels, value) pairs
+    """
+    result = defaultdict(list)
+    with _lock:
+        items = list(_counters.items()) + list(_gauges.items())
+    for (name, labels), value in sorted(items):
+        result[name].append((dict(labels), value))
+    return dict(result)
+
+
+def reset() -> None:
+    """Clear all metrics (used by tests)."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+
+
+def render_prometheus() -> str:
+    """
+    Render metrics in the Prometheus text exposition format.
+
+    Every sample carries the pid, since each gunicorn worker keeps its
+    own counters.
+    """
+    pid = str(os.getpid())
+    lines = []
+    for name, samples in snapshot().items():
+        for labels, value in samples:
+            labels = {**labels, "pid": pid}
+            rendered = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{rendered}}} {value}")
+    return "\n".join(lines) + "\n"
@@ -1,7 +1,11 @@
 """Custom middleware for DJGramm app."""
 
+from django.contrib.auth.middleware import AuthenticationMiddleware
 from django.core.exceptions import SuspiciousOperation
 from django.http import HttpResponse
+from django.utils.functional import SimpleLazyObject
+
+from .cache import get_cached_user
 
 
 class HealthCheckMiddleware:
@@ -41,3 +45,16 @@ class HealthCheckMiddleware:
             raise
 
         return response
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """
+    AuthenticationMiddleware that loads request.user from the cache.
+
+    Together with the cached_db session engine, authenticated requests
+    resolve their identity without touching the database.
+    """
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_cached_user(request))
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0006_alter_postimage_image_alter_profile_avatar"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="cover_image",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="app.postimage",
+            ),
+        ),
+    ]
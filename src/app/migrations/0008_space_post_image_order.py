@@ -0,0 +1,23 @@
+from django.db import migrations
+from django.db.models import F
+
+# Same as app.services.ORDER_GAP at the time of writing
+ORDER_GAP = 1024
+
+
+def space_orders(apps, schema_editor):
+    """Spread existing order keys ORDER_GAP apart, from ORDER_GAP."""
+    PostImage = apps.get_model("app", "PostImage")
+    PostImage.objects.update(order=(F("order") + 1) * ORDER_GAP)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0007_post_cover_image"),
+    ]
+
+    operations = [
+        # Relative order is all that matters, so keys are left spaced
+        # when migrating back
+        migrations.RunPython(space_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0008_space_post_image_order"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="postimage",
+            name="height",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="postimage",
+            name="placeholder",
+            field=models.CharField(blank=True, max_length=2048),
+        ),
+        migrations.AddField(
+            model_name="postimage",
+            name="width",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
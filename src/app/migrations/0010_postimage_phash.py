@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0009_postimage_placeholder"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="postimage",
+            name="phash",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="postimage",
+            name="phash_0",
+            field=models.PositiveIntegerField(
+                blank=True, db_index=True, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="postimage",
+            name="phash_1",
+            field=models.PositiveIntegerField(
+                blank=True, db_index=True, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="postimage",
+            name="phash_2",
+            field=models.PositiveIntegerField(
+                blank=True, db_index=True, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="postimage",
+            name="phash_3",
+            field=models.PositiveIntegerField(
+                blank=True, db_index=True, null=True
+            ),
+        ),
+    ]
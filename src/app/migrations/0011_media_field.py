@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:14
+
+from django.db import migrations
+
+import app.fields
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0010_postimage_phash"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="postimage",
+            name="image",
+            field=app.fields.MediaField(max_length=255, verbose_name="image"),
+        ),
+        migrations.AlterField(
+            model_name="profile",
+            name="avatar",
+            field=app.fields.MediaField(
+                blank=True, max_length=255, verbose_name="image"
+            ),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0011_media_field"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PendingMediaDeletion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("public_id", models.CharField(max_length=255)),
+                (
+                    "resource_type",
+                    models.CharField(default="image", max_length=20),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "ordering": ["pk"],
+            },
+        ),
+    ]
@@ -0,0 +1,94 @@
+"""
+Full-text search index of post captions (app.search).
+
+The index lives outside the model, so it is created with SQL per
+database: a generated tsvector column with a GIN index on PostgreSQL,
+an external-content FTS5 table kept in sync by triggers on SQLite.
+"""
+
+from django.db import migrations
+
+POSTGRESQL_FORWARD = [
+    """
+    ALTER TABLE app_post ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        to_tsvector('english'::regconfig, coalesce(caption, ''))
+    ) STORED
+    """,
+    "CREATE INDEX app_post_search_vector ON app_post "
+    "USING gin (search_vector)",
+]
+POSTGRESQL_REVERSE = [
+    "DROP INDEX IF EXISTS app_post_search_vector",
+    "ALTER TABLE app_post DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE app_post_fts USING fts5(
+        caption,
+        content='app_post',
+        content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER app_post_fts_insert AFTER INSERT ON app_post BEGIN
+        INSERT INTO app_post_fts(rowid, caption)
+        VALUES (new.id, new.caption);
+    END
+    """,
+    """
+    CREATE TRIGGER app_post_fts_delete AFTER DELETE ON app_post BEGIN
+        INSERT INTO app_post_fts(app_post_fts, rowid, caption)
+        VALUES ('delete', old.id, old.caption);
+    END
+    """,
+    """
+    CREATE TRIGGER app_post_fts_update AFTER UPDATE OF caption ON app_post
+    BEGIN
+        INSERT INTO app_post_fts(app_post_fts, rowid, caption)
+        VALUES ('delete', old.id, old.caption);
+        INSERT INTO app_post_fts(rowid, caption)
+        VALUES (new.id, new.caption);
+    END
+    """,
+    "INSERT INTO app_post_fts(app_post_fts) VALUES ('rebuild')",
+]
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS app_post_fts_insert",
+    "DROP TRIGGER IF EXISTS app_post_fts_delete",
+    "DROP TRIGGER IF EXISTS app_post_fts_update",
+    "DROP TABLE IF EXISTS app_post_fts",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+
+    return run
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0012_pendingmediadeletion"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run(
+                {
+                    "postgresql": POSTGRESQL_FORWARD,
+                    "sqlite": SQLITE_FORWARD,
+                }
+            ),
+            _run(
+                {
+                    "postgresql": POSTGRESQL_REVERSE,
+                    "sqlite": SQLITE_REVERSE,
+                }
+            ),
+        ),
+    ]
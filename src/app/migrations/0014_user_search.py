@@ -0,0 +1,50 @@
+"""
+Indexes for user search (app.user_search) on PostgreSQL.
+
+Usernames and profile full names get a btree on lower() for prefix
+matches and a pg_trgm GIN index on lower() for fuzzy ones. pg_trgm is
+a trusted extension, so the database owner may create it. SQLite ranks
+in Python and needs no indexes.
+"""
+
+from django.db import migrations
+
+POSTGRESQL_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX app_user_username_prefix ON app_user "
+    "(lower(username) text_pattern_ops)",
+    "CREATE INDEX app_user_username_trgm ON app_user "
+    "USING gin (lower(username) gin_trgm_ops)",
+    "CREATE INDEX app_profile_full_name_prefix ON app_profile "
+    "(lower(full_name) text_pattern_ops)",
+    "CREATE INDEX app_profile_full_name_trgm ON app_profile "
+    "USING gin (lower(full_name) gin_trgm_ops)",
+]
+# The extension is kept, other indexes may rely on it
+POSTGRESQL_REVERSE = [
+    "DROP INDEX IF EXISTS app_user_username_prefix",
+    "DROP INDEX IF EXISTS app_user_username_trgm",
+    "DROP INDEX IF EXISTS app_profile_full_name_prefix",
+    "DROP INDEX IF EXISTS app_profile_full_name_trgm",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+
+    return run
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0013_post_search"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({"postgresql": POSTGRESQL_FORWARD}),
+            _run({"postgresql": POSTGRESQL_REVERSE}),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0014_user_search"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                fields=["-created_at", "-id"], name="app_post_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                fields=["author", "-created_at", "-id"],
+                name="app_post_author_created_idx",
+            ),
+        ),
+    ]
@@ -1,10 +1,13 @@
 """Models for DJGramm."""
 
-from cloudinary.models import CloudinaryField
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 
+from .fields import MediaField
+
 
 class User(AbstractUser):
     """Custom user model with email authentication."""
@@ -92,7 +95,9 @@ class Profile(models.Model):
     full_name = models.CharField(max_length=100, blank=True)
     bio = models.TextField(max_length=500, blank=True)
     # avatar = models.ImageField(upload_to="avatars/", blank=True)
-    avatar = CloudinaryField("image", folder="avatars", blank=True)
+    avatar = MediaField(
+        "image", folder="avatars", blank=True, transforms=["avatar"]
+    )
     last_news_feed_visit = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
@@ -116,6 +121,60 @@ class Tag(models.Model):
         return reverse("tag_posts", kwargs={"slug": self.slug})
 
 
+class PostQuerySet(models.QuerySet):
+    """QuerySet for Post."""
+
+    def with_counts(self):
+        """
+        Annotate likes_count and comments_count.
+
+        Counts come from correlated subqueries, so they neither join
+        likes against comments nor load the related rows.
+        """
+        return self.annotate(
+            likes_count=_count_for_post(Like),
+            comments_count=_count_for_post(Comment),
+        )
+
+    def with_cover(self):
+        """
+        Load the cover image of each post along with it.
+
+        The cover is denormalized on Post.cover_image, so this is a join
+        on its primary key rather than a lookup among all post images.
+        """
+        return self.select_related("cover_image")
+
+    def refresh_covers(self) -> int:
+        """
+        Point cover_image of these posts at their first image by order.
+
+        Runs as a single UPDATE with a correlated subquery. Queryset
+        updates send no signals, so callers invalidate caches themselves.
+
+        Returns:
+            Number of posts updated
+        """
+        first_image = (
+            PostImage.objects.filter(post=OuterRef("pk"))
+            .order_by("order", "pk")
+            .values("pk")[:1]
+        )
+        return self.update(cover_image=Subquery(first_image))
+
+
+def _count_for_post(model):
+    """Return subquery counting rows of model per outer post."""
+    counts = (
+        model.objects.filter(post=OuterRef("pk"))
+        .order_by()
+        .values("post")
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    return Coalesce(Subquery(counts), 0)
+
+
 class Post(models.Model):
     """User post with images."""
 
@@ -124,11 +183,32 @@ class Post(models.Model):
     )
     caption = models.TextField(max_length=2200, blank=True)
     tags = models.ManyToManyField(Tag, related_name="posts", blank=True)
+    # First image by order, kept up to date by signals and image views
+    cover_image = models.ForeignKey(  # fmt: skip
+        "PostImage",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = PostQuerySet.as_manager()
+
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Feed pages and cursors of paginate_by_cursor()
+            models.Index(
+                fields=["-created_at", "-id"], name="app_post_created_idx"
+            ),
+            # Profile grid: one author's posts, newest first
+            models.Index(
+                fields=["author", "-created_at", "-id"],
+                name="app_post_author_created_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"Post #{self.pk} by {self.author.username}"
@@ -144,8 +224,24 @@ class PostImage(models.Model):
         Post, on_delete=models.CASCADE, related_name="images"
     )
     # image = models.ImageField(upload_to="posts/")
-    image = CloudinaryField("image", folder="posts")
+    image = MediaField("image", folder="posts")
     order = models.PositiveIntegerField(default=0)
+    # Intrinsic size and a tiny inline preview, set when the image is
+    # processed, so pages reserve space and paint before it loads
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    placeholder = models.CharField(max_length=2048, blank=True)
+    # 64-bit dHash of the image, stored signed, and its four 16-bit
+    # blocks. Hashes within PHASH_MAX_DISTANCE bits share at least one
+    # block, so near-duplicates are found with exact indexed lookups
+    phash = models.BigIntegerField(null=True, blank=True)
+    phash_0 = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    phash_1 = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    phash_2 = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    phash_3 = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+
+    PHASH_BLOCKS = 4
+    PHASH_MAX_DISTANCE = PHASH_BLOCKS - 1
 
     class Meta:
         ordering = ["order"]
@@ -153,6 +249,23 @@ class PostImage(models.Model):
     def __str__(self):
         return f"Image {self.order} for Post #{self.post_id}"
 
+    @classmethod
+    def phash_blocks(cls, phash: int) -> list[int]:
+        """Split an unsigned 64-bit hash into its 16-bit blocks."""
+        return [(phash >> (16 * i)) & 0xFFFF for i in range(cls.PHASH_BLOCKS)]
+
+    def get_phash(self) -> int | None:
+        """Return the stored hash as an unsigned 64-bit integer."""
+        if self.phash is None:
+            return None
+        return self.phash & (2**64 - 1)
+
+    def set_phash(self, phash: int) -> None:
+        """Store an unsigned 64-bit hash and its lookup blocks."""
+        self.phash = phash - 2**64 if phash >= 2**63 else phash
+        for i, block in enumerate(self.phash_blocks(phash)):
+            setattr(self, f"phash_{i}", block)
+
 
 class Like(models.Model):
     """Like on a post."""
@@ -208,3 +321,18 @@ class Follow(models.Model):
 
     def __str__(self):
         return f"{self.follower.username} follows {self.following.username}"
+
+
+class PendingMediaDeletion(models.Model):
+    """Cloudinary file whose deletion failed, to be retried later."""
+
+    public_id = models.CharField(max_length=255)
+    resource_type = models.CharField(max_length=20, default="image")
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["pk"]
+
+    def __str__(self):
+        return f"Pending deletion of {self.public_id}"
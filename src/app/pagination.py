@@ -0,0 +1,76 @@
+"""Cursor pagination for DJGramm."""
+
+import base64
+import binascii
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.db.models import Q
+
+
+@dataclass
+class CursorPage:
+    """One page of a cursor-paginated queryset."""
+
+    items: list
+    next_cursor: str | None
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+
+def encode_cursor(post) -> str:
+    """Encode the position of a post as an opaque cursor."""
+    raw = f"{post.created_at.isoformat()}|{post.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """
+    Decode a cursor made by encode_cursor().
+
+    Raises:
+        ValueError: If cursor is malformed
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        created_at, pk = raw.split("|")
+        return datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def paginate_by_cursor(queryset, cursor: str | None, per_page: int):
+    """
+    Return the page of posts following cursor, newest first.
+
+    Keyset pagination on (created_at, pk): every page costs the same
+    index range scan, however deep it is, unlike OFFSET pages.
+
+    Args:
+        queryset: Post queryset
+        cursor: Cursor of the last post of the previous page, or None
+        per_page: Number of posts per page
+
+    Returns:
+        CursorPage
+
+    Raises:
+        ValueError: If cursor is malformed
+    """
+    queryset = queryset.order_by("-created_at", "-pk")
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+        )
+
+    # One extra row tells whether there is a next page
+    items = list(queryset[: per_page + 1])
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor(items[-1])
+    return CursorPage(items=items, next_cursor=next_cursor)
@@ -0,0 +1,190 @@
+"""
+Full-text search of post captions for DJGramm.
+
+Captions are indexed by the database, outside the Post model
+(migration 0013_post_search):
+
+- PostgreSQL keeps a generated tsvector column, app_post.search_vector,
+  with a GIN index. The column is computed on every INSERT and UPDATE
+  of the caption, so it never goes stale.
+- SQLite, for local development and tests, keeps an external-content
+  FTS5 table, app_post_fts, in sync through triggers. Migrations that
+  remake app_post on SQLite drop the triggers and must recreate them.
+
+A query finds matches through the index, ranks them (ts_rank_cd() or
+bm25()) and highlights only the page of results returned. PostgreSQL
+ranks the newest SEARCH_CANDIDATES matches rather than all of them, so
+a query for a word in millions of captions still reads a bounded
+number of rows.
+"""
+
+import re
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import NotSupportedError, connection
+from django.utils.html import escape
+from django.utils.safestring import SafeString, mark_safe
+
+from .models import Post
+
+# Text search configuration of the generated column
+SEARCH_CONFIG = "english"
+# Control characters bracketing matches in headlines until they are
+# escaped, so captions cannot smuggle markup into the highlighting
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_STOP = "\x03"
+# Words shown around matches in headlines
+HEADLINE_WORDS = 24
+
+WORD_RE = re.compile(r"\w+")
+
+
+@dataclass
+class SearchResult:
+    """Post matching a search, with its rank and highlighted headline."""
+
+    post: Post
+    rank: float
+    headline: SafeString
+
+
+def highlight(text: str) -> SafeString:
+    """
+    Escape a headline and turn its match markers into <mark> elements.
+
+    Example:
+        "a " + HIGHLIGHT_START + "<b>" + HIGHLIGHT_STOP
+        -> "a <mark>&lt;b&gt;</mark>"
+    """
+    text = escape(text)
+    text = text.replace(HIGHLIGHT_START, "<mark>")
+    return mark_safe(text.replace(HIGHLIGHT_STOP, "</mark>"))
+
+
+# =============================================================================
+# Backends
+# =============================================================================
+
+
+def _search_postgresql(query: str, limit: int) -> list[tuple]:
+    sql = f"""
+        WITH query AS (
+            SELECT websearch_to_tsquery(
+                %(config)s::regconfig, %(query)s
+            ) AS q
+        ), candidates AS (
+            SELECT p.id, p.search_vector
+            FROM app_post p, query
+            WHERE p.search_vector @@ query.q
+            ORDER BY p.id DESC
+            LIMIT %(candidates)s
+        ), ranked AS (
+            SELECT c.id, ts_rank_cd(c.search_vector, query.q) AS rank
+            FROM candidates c, query
+            ORDER BY rank DESC, c.id DESC
+            LIMIT %(limit)s
+        )
+        SELECT r.id, r.rank, ts_headline(
+            %(config)s::regconfig, p.caption, query.q,
+            'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, '
+            'MaxWords={HEADLINE_WORDS}, MinWords=8, MaxFragments=2'
+        )
+        FROM ranked r JOIN app_post p ON p.id = r.id, query
+        ORDER BY r.rank DESC, r.id DESC
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            sql,
+            {
+                "config": SEARCH_CONFIG,
+                "query": query,
+                "candidates": settings.SEARCH_CANDIDATES,
+                "limit": limit,
+            },
+        )
+        return cursor.fetchall()
+
+
+def fts5_query(query: str) -> str:
+    """
+    Turn user input into an FTS5 query matching all of its words.
+
+    Words are quoted, so FTS5 operators and syntax in the input are
+    searched for as text rather than interpreted.
+
+    Example:
+        'sunset "beach" OR' -> '"sunset" "beach" "OR"'
+    """
+    return " ".join(f'"{word}"' for word in WORD_RE.findall(query))
+
+
+def _search_sqlite(query: str, limit: int) -> list[tuple]:
+    match = fts5_query(query)
+    if not match:
+        return []
+    # bm25() is lower for better matches
+    sql = """
+        SELECT rowid, -bm25(app_post_fts), snippet(
+            app_post_fts, 0, %s, %s, '…', %s
+        )
+        FROM app_post_fts
+        WHERE app_post_fts MATCH %s
+        ORDER BY bm25(app_post_fts), rowid DESC
+        LIMIT %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            sql,
+            [HIGHLIGHT_START, HIGHLIGHT_STOP, HEADLINE_WORDS, match, limit],
+        )
+        return cursor.fetchall()
+
+
+BACKENDS = {
+    "postgresql": _search_postgresql,
+    "sqlite": _search_sqlite,
+}
+
+
+# =============================================================================
+# Search
+# =============================================================================
+
+
+def search_posts(query: str, limit: int = 20) -> list[SearchResult]:
+    """
+    Find posts whose caption matches query, best match first.
+
+    Args:
+        query: Words to search for; PostgreSQL also understands
+            "quoted phrases", "or" and -exclusions
+        limit: Maximum number of results
+
+    Returns:
+        List of SearchResult, with authors and covers loaded
+
+    Raises:
+        NotSupportedError: If the database has no caption index
+    """
+    query = query.strip()
+    if not query or limit <= 0:
+        return []
+    backend = BACKENDS.get(connection.vendor)
+    if backend is None:
+        raise NotSupportedError(
+            f"Caption search is not supported on {connection.vendor}"
+        )
+
+    rows = backend(query, limit)
+    posts = (
+        Post.objects.select_related("author")
+        .with_cover()
+        .in_bulk([post_id for post_id, _, _ in rows])
+    )
+    # Posts deleted since the index was read are left out
+    return [
+        SearchResult(posts[post_id], rank, highlight(headline))
+        for post_id, rank, headline in rows
+        if post_id in posts
+    ]
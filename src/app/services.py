@@ -1,13 +1,29 @@
 """Business logic services for DJGramm."""
 
+import bisect
+import logging
+import os
 import re
-from io import BytesIO
 
+from django.conf import settings
 from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import Case, Q, Value, When
 from django.utils.text import slugify
 from PIL import Image
 
-from .models import Tag
+from . import metrics
+from .image_engine import get_engine
+from .imaging import (
+    dhash_bytes,
+    process_image_bytes,
+    resize_to_jpeg,
+    thumbnail_jpeg,
+)
+from .media_client import MediaClientError, MediaUnavailable, get_media_client
+from .models import PendingMediaDeletion, PostImage, Tag
+
+logger = logging.getLogger(__name__)
 
 # Allowed image types
 ALLOWED_IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp"}
@@ -42,10 +58,19 @@ def validate_image(file) -> tuple[bool, str]:
     try:
         with Image.open(file) as img:
             img.verify()
+            width, height = img.size
         file.seek(0)  # Reset file pointer after verify
     except Exception:
         return False, "Invalid or corrupted image file."
 
+    # Check pixel count (decompression bombs are small files)
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        megapixels = settings.IMAGE_MAX_PIXELS // 1_000_000
+        return (
+            False,
+            f"Image has too many pixels. Maximum is {megapixels} megapixels.",
+        )
+
     return True, ""
 
 
@@ -62,20 +87,7 @@ def generate_thumbnail(
     Returns:
         ContentFile with the thumbnail
     """
-    with Image.open(image_field) as img:
-        # Convert to RGB if necessary (for PNG with transparency)
-        if img.mode in ("RGBA", "P"):
-            img = img.convert("RGB")
-
-        # Create thumbnail maintaining aspect ratio
-        img.thumbnail(max_size, Image.Resampling.LANCZOS)
-
-        # Save to buffer
-        buffer = BytesIO()
-        img.save(buffer, format="JPEG", quality=85, optimize=True)
-        buffer.seek(0)
-
-        return ContentFile(buffer.getvalue())
+    return ContentFile(thumbnail_jpeg(image_field, max_size))
 
 
 def process_uploaded_image(file, max_dimension: int = 1080) -> ContentFile:
@@ -89,23 +101,331 @@ def process_uploaded_image(file, max_dimension: int = 1080) -> ContentFile:
     Returns:
         ContentFile with processed image
     """
-    with Image.open(file) as img:
-        # Convert to RGB if necessary
-        if img.mode in ("RGBA", "P"):
-            img = img.convert("RGB")
+    return ContentFile(resize_to_jpeg(file, max_dimension))
+
+
+def find_duplicate_images(author, hashes) -> dict[int, PostImage]:
+    """
+    Find existing images of author that are near-duplicates of hashes.
+
+    Hashes within PostImage.PHASH_MAX_DISTANCE bits of each other share
+    at least one 16-bit block, so candidates come from exact matches on
+    the indexed block columns and are then checked bit by bit. This is
+    one query regardless of how many images the author has.
+
+    Args:
+        author: User whose images may be reused
+        hashes: Unsigned 64-bit dHashes of new images
+
+    Returns:
+        Dict of hash to the closest existing image, for hashes that
+        have a duplicate
+    """
+    hashes = set(hashes)
+    if not hashes:
+        return {}
+
+    condition = Q()
+    for phash in hashes:
+        for i, block in enumerate(PostImage.phash_blocks(phash)):
+            condition |= Q(**{f"phash_{i}": block})
+    candidates = PostImage.objects.filter(condition, post__author=author)
+
+    found = {}
+    for candidate in candidates:
+        existing = candidate.get_phash()
+        for phash in hashes:
+            distance = (phash ^ existing).bit_count()
+            if distance > PostImage.PHASH_MAX_DISTANCE:
+                continue
+            best = found.get(phash)
+            if (
+                best is None
+                or distance < (phash ^ best.get_phash()).bit_count()
+            ):
+                found[phash] = candidate
+    return found
+
+
+def process_post_images(images, author) -> list[str]:
+    """
+    Resize the files of unsaved PostImage instances in parallel.
+
+    Images are hashed first; one that is a near-duplicate of an image
+    author already posted reuses its stored asset. Every other file is
+    resized to IMAGE_MAX_DIMENSION and re-encoded as JPEG by the image
+    engine, which also fills in width, height and placeholder. Images
+    that fail are removed from images.
+
+    Args:
+        images: Unsaved PostImage instances; modified in place
+        author: User posting the images
+
+    Returns:
+        Error messages of the images that failed
+    """
+    if not images:
+        return []
+
+    engine = get_engine()
+    payloads = []
+    for image in images:
+        image.image.seek(0)
+        payloads.append(image.image.read())
+    hashes = engine.map(dhash_bytes, payloads, return_exceptions=True)
+    duplicates = find_duplicate_images(
+        author, [h for h in hashes if not isinstance(h, Exception)]
+    )
+
+    # Only images without a duplicate are encoded
+    pending = [
+        index
+        for index, phash in enumerate(hashes)
+        if not isinstance(phash, Exception) and phash not in duplicates
+    ]
+    encoded = engine.map(
+        process_image_bytes,
+        [payloads[index] for index in pending],
+        settings.IMAGE_MAX_DIMENSION,
+        return_exceptions=True,
+    )
+    results = dict(zip(pending, encoded, strict=True))
+
+    errors = []
+    kept = []
+    for index, image in enumerate(images):
+        name = image.image.name
+        phash = hashes[index]
+        result = results.get(index, phash)
+        if isinstance(result, Exception):
+            logger.warning("Could not process image %s: %s", name, result)
+            metrics.increment("post_images_processed_total", result="failed")
+            errors.append(f"Could not process {name}.")
+            continue
+
+        if index in results:
+            image.image = SimpleUploadedFile(
+                f"{os.path.splitext(name)[0]}.jpg", result.data, "image/jpeg"
+            )
+            image.width = result.width
+            image.height = result.height
+            image.placeholder = result.placeholder
+            metrics.increment("post_images_processed_total", result="encoded")
+        else:
+            existing = duplicates[phash]
+            logger.info("Image %s duplicates image %s", name, existing.pk)
+            image.image = existing.image
+            image.width = existing.width
+            image.height = existing.height
+            image.placeholder = existing.placeholder
+            metrics.increment("post_images_processed_total", result="reused")
+        image.set_phash(phash)
+        kept.append(image)
+    images[:] = kept
+    return errors
+
+
+def store_image_files(images) -> None:
+    """
+    Upload files of unsaved PostImage instances to storage.
+
+    Afterwards each instance holds its storage key instead of the
+    uploaded file, so the rows can be inserted with bulk_create().
+
+    Args:
+        images: Unsaved PostImage instances
+    """
+    field = PostImage._meta.get_field("image")
+    for image in images:
+        setattr(image, field.attname, field.pre_save(image, add=True))
+
+
+# =============================================================================
+# Media Deletion Services
+# =============================================================================
+
+
+def delete_media(public_id: str, resource_type: str = "image") -> bool:
+    """
+    Delete a file from Cloudinary, queueing it if that fails.
+
+    Args:
+        public_id: Cloudinary public ID
+        resource_type: Cloudinary resource type
+
+    Returns:
+        True if deleted now, False if queued for retry_media_deletions()
+    """
+    try:
+        get_media_client().destroy(public_id, resource_type=resource_type)
+    except MediaClientError as e:
+        logger.warning("Queueing deletion of %s: %s", public_id, e)
+        PendingMediaDeletion.objects.create(
+            public_id=public_id, resource_type=resource_type
+        )
+        metrics.increment("media_deletions_deferred_total")
+        return False
+    return True
 
-        # Resize if larger than max dimension
-        if max(img.size) > max_dimension:
-            ratio = max_dimension / max(img.size)
-            new_size = tuple(int(dim * ratio) for dim in img.size)
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
 
-        # Save to buffer
-        buffer = BytesIO()
-        img.save(buffer, format="JPEG", quality=85, optimize=True)
-        buffer.seek(0)
+def retry_media_deletions(batch_size: int = 100) -> tuple[int, int]:
+    """
+    Retry queued deletions, stopping when Cloudinary is unavailable.
 
-        return ContentFile(buffer.getvalue())
+    Args:
+        batch_size: Queued deletions loaded per query
+
+    Returns:
+        Tuple of (deleted, still queued)
+    """
+    client = get_media_client()
+    deleted = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            PendingMediaDeletion.objects.filter(pk__gt=last_pk)[:batch_size]
+        )
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+        for pending in batch:
+            try:
+                client.destroy(
+                    pending.public_id, resource_type=pending.resource_type
+                )
+            except MediaUnavailable:
+                return deleted, PendingMediaDeletion.objects.count()
+            except MediaClientError as e:
+                logger.warning(
+                    "Deletion of %s failed: %s", pending.public_id, e
+                )
+                pending.attempts += 1
+                pending.save(update_fields=["attempts"])
+                continue
+            pending.delete()
+            deleted += 1
+    return deleted, PendingMediaDeletion.objects.count()
+
+
+# =============================================================================
+# Image Order Services
+# =============================================================================
+
+# Distance between order keys of neighbouring images. Moving an image
+# takes a key between its new neighbours, so only that row changes.
+# Keys start at ORDER_GAP to leave room before the first image too.
+ORDER_GAP = 1024
+
+
+def _longest_increasing_run(values: list[int]) -> set[int]:
+    """
+    Return indexes of a longest strictly increasing subsequence.
+
+    Patience sorting, O(n log n).
+    """
+    tails = []  # tails[k]: index ending the best subsequence of length k+1
+    tail_values = []
+    previous = [-1] * len(values)
+    for index, value in enumerate(values):
+        k = bisect.bisect_left(tail_values, value)
+        if k:
+            previous[index] = tails[k - 1]
+        if k == len(tails):
+            tails.append(index)
+            tail_values.append(value)
+        else:
+            tails[k] = index
+            tail_values[k] = value
+
+    kept = set()
+    index = tails[-1] if tails else -1
+    while index != -1:
+        kept.add(index)
+        index = previous[index]
+    return kept
+
+
+def plan_image_order(current: dict[int, int], image_ids: list[int]):
+    """
+    Compute new order keys putting images in the order of image_ids.
+
+    Images already in increasing order relative to each other keep their
+    keys; the others get keys spaced evenly between their new neighbours.
+    When neighbours leave no room, all images are respaced ORDER_GAP apart.
+
+    Args:
+        current: Current order key of each image id
+        image_ids: Image ids in the desired order
+
+    Returns:
+        Dict of image id to new order key, for changed images only
+    """
+    orders = [current[pk] for pk in image_ids]
+    kept = _longest_increasing_run(orders)
+
+    new_orders = {}
+    index = 0
+    while index < len(image_ids):
+        if index in kept:
+            index += 1
+            continue
+        # Run of moved images between two kept neighbours
+        end = index
+        while end < len(image_ids) and end not in kept:
+            end += 1
+        count = end - index
+        low = orders[index - 1] if index else -1
+        high = orders[end] if end < len(image_ids) else None
+        if high is None:
+            high = low + (count + 1) * ORDER_GAP
+        step = (high - low) // (count + 1)
+        if step < 1:
+            return {
+                pk: (position + 1) * ORDER_GAP
+                for position, pk in enumerate(image_ids)
+                if current[pk] != (position + 1) * ORDER_GAP
+            }
+        for offset in range(count):
+            new_orders[image_ids[index + offset]] = low + step * (offset + 1)
+        index = end
+    return new_orders
+
+
+def reorder_post_images(post, image_ids: list[int]) -> int:
+    """
+    Reorder images of a post in O(1) queries.
+
+    The submitted ids are checked against the post's images with one
+    query, then all changed keys are written with one UPDATE ... CASE.
+
+    Args:
+        post: Post instance
+        image_ids: Ids of all images of the post in the desired order
+
+    Returns:
+        Number of images whose order key changed
+
+    Raises:
+        ValueError: If image_ids are not exactly the post's images
+    """
+    current = dict(
+        PostImage.objects.filter(post=post).values_list("pk", "order")
+    )
+    if len(image_ids) != len(current) or set(image_ids) != set(current):
+        raise ValueError("Order must list each image of the post once")
+
+    new_orders = plan_image_order(current, image_ids)
+    if not new_orders:
+        return 0
+    PostImage.objects.filter(post=post, pk__in=new_orders).update(
+        order=Case(
+            *[
+                When(pk=pk, then=Value(order))
+                for pk, order in new_orders.items()
+            ]
+        )
+    )
+    return len(new_orders)
 
 
 # =============================================================================
@@ -145,14 +465,16 @@ def create_or_get_tags(tag_names: set[str]) -> list[Tag]:
     """
     Create Tag objects if they don't exist, return all tags.
 
+    Existing tags are read with one query and missing ones inserted with
+    one bulk INSERT, whatever the number of tags.
+
     Args:
         tag_names: Set of tag names (without #)
 
     Returns:
         List of Tag objects
     """
-    tags = []
-
+    names_by_slug = {}
     for name in tag_names:
         # Skip empty or too long names
         if not name or len(name) > 50:
@@ -160,16 +482,24 @@ def create_or_get_tags(tag_names: set[str]) -> list[Tag]:
 
         # Generate slug
         slug = slugify(name)
-        if not slug:
-            continue
-
-        # Get or create tag
-        tag, created = Tag.objects.get_or_create(
-            slug=slug, defaults={"name": name}
-        )
-        tags.append(tag)
-
-    return tags
+        if slug:
+            names_by_slug.setdefault(slug, name)
+
+    if not names_by_slug:
+        return []
+
+    tags = list(Tag.objects.filter(slug__in=names_by_slug))
+    missing = names_by_slug.keys() - {tag.slug for tag in tags}
+    if not missing:
+        return tags
+
+    # Concurrent requests may insert the same tags: ignore those rows
+    # and read everything back
+    Tag.objects.bulk_create(
+        [Tag(name=names_by_slug[slug], slug=slug) for slug in missing],
+        ignore_conflicts=True,
+    )
+    return list(Tag.objects.filter(slug__in=names_by_slug))
 
 
 def sync_post_tags(post, caption: str) -> None:
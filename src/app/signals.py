@@ -4,10 +4,26 @@ import json
 import logging
 import time
 
-from django.db.models.signals import post_save, pre_delete
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+)
 from django.dispatch import receiver
 
-from .models import Profile, User
+from .cache import (
+    bump_generation,
+    feed_scope,
+    graph_scope,
+    invalidate_post,
+    post_scope,
+    profile_scope,
+    tag_scope,
+    user_scope,
+)
+from .models import Comment, Follow, Like, Post, PostImage, Profile, Tag, User
+from .tag_index import remove_tag, request_rebuild, update_tag_counts
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +42,9 @@ def save_user_profile(sender, instance, **kwargs):
     if kwargs.get("raw") or not instance.pk:
         return
 
+    # Drop the cached User+Profile snapshot used for request.user
+    bump_generation(user_scope(instance.pk))
+
     # Only save if profile exists and user is not being deleted
     try:
         if hasattr(instance, "profile") and instance.profile:
@@ -160,7 +179,7 @@ def cleanup_user_data(sender, instance, **kwargs):
 
     try:
         # 3. Clean up Cloudinary images (avatar and post images)
-        import cloudinary.uploader
+        from .services import delete_media
 
         # #region agent log
         try:
@@ -195,7 +214,7 @@ def cleanup_user_data(sender, instance, **kwargs):
                 instance.profile.avatar, "public_id", None
             )
             if avatar_public_id:
-                cloudinary.uploader.destroy(avatar_public_id)
+                delete_media(avatar_public_id)
                 deleted_images += 1
                 logger.info(
                     f"Deleted avatar from Cloudinary: {avatar_public_id}"
@@ -211,7 +230,7 @@ def cleanup_user_data(sender, instance, **kwargs):
                             image.image, "public_id", None
                         )
                         if image_public_id:
-                            cloudinary.uploader.destroy(image_public_id)
+                            delete_media(image_public_id)
                             deleted_images += 1
 
             if deleted_images > 1:  # More than just avatar
@@ -302,3 +321,174 @@ def cleanup_user_data(sender, instance, **kwargs):
     # #endregion
 
     logger.info(f"Cleanup completed for user: {instance.email}")
+
+
+# =============================================================================
+# Cache Invalidation
+# =============================================================================
+
+
+@receiver(post_save, sender=Post)
+@receiver(pre_delete, sender=Post)
+def invalidate_post_pages(sender, instance, **kwargs):
+    """Invalidate pages showing a post when it is saved or deleted."""
+    if kwargs.get("raw"):
+        return
+    invalidate_post(instance.pk)
+
+
+@receiver(post_save, sender=PostImage)
+@receiver(post_delete, sender=PostImage)
+def invalidate_post_image_pages(sender, instance, **kwargs):
+    """Invalidate pages showing a post when its images change."""
+    if kwargs.get("raw"):
+        return
+    invalidate_post(instance.post_id)
+
+
+@receiver(post_save, sender=PostImage)
+@receiver(post_delete, sender=PostImage)
+def update_post_cover(sender, instance, update_fields=None, **kwargs):
+    """Keep Post.cover_image pointing at the first image by order."""
+    if kwargs.get("raw"):
+        return
+    if update_fields and "order" not in update_fields:
+        return
+    Post.objects.filter(pk=instance.post_id).refresh_covers()
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def invalidate_tag_pages(sender, instance, action, reverse, pk_set, **kwargs):
+    """Invalidate tag pages when posts gain or lose tags."""
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if reverse:
+        # instance is a Tag
+        bump_generation(tag_scope(instance.slug))
+        return
+    if action == "pre_clear":
+        slugs = instance.tags.values_list("slug", flat=True)
+    else:
+        slugs = Tag.objects.filter(pk__in=pk_set).values_list(
+            "slug", flat=True
+        )
+    bump_generation(*[tag_scope(slug) for slug in slugs])
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+def invalidate_like_pages(sender, instance, **kwargs):
+    """Invalidate pages and fragments showing like counts of a post."""
+    if kwargs.get("raw"):
+        return
+    invalidate_post(instance.post_id, tags=False)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_pages(sender, instance, **kwargs):
+    """Invalidate pages and fragments showing comment counts of a post."""
+    if kwargs.get("raw"):
+        return
+    bump_generation(feed_scope(), post_scope(instance.post_id))
+
+
+def _invalidate_follow_pages(user_ids):
+    """Invalidate follow graphs and profile pages of users."""
+    usernames = User.objects.filter(pk__in=user_ids).values_list(
+        "username", flat=True
+    )
+    bump_generation(
+        *[graph_scope(user_id) for user_id in user_ids],
+        *[profile_scope(username) for username in usernames],
+    )
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_pages(sender, instance, **kwargs):
+    """Invalidate both profiles of a saved or deleted Follow."""
+    if kwargs.get("raw"):
+        return
+    _invalidate_follow_pages([instance.follower_id, instance.following_id])
+
+
+@receiver(m2m_changed, sender=User.following.through)
+def invalidate_following_pages(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    """Invalidate profiles changed through user.following.add/remove."""
+    if action not in ("post_add", "post_remove") or not pk_set:
+        return
+    _invalidate_follow_pages([instance.pk, *pk_set])
+
+
+@receiver(post_save, sender=Profile)
+def invalidate_profile_pages(sender, instance, update_fields=None, **kwargs):
+    """Invalidate the user snapshot and pages showing the profile."""
+    if kwargs.get("raw"):
+        return
+    bump_generation(user_scope(instance.user_id))
+    # News feed visits only touch the timestamp, which no page shows
+    if update_fields and set(update_fields) <= {"last_news_feed_visit"}:
+        return
+    bump_generation(feed_scope(), profile_scope(instance.user.username))
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user(sender, instance, **kwargs):
+    """Drop the cached snapshot so other sessions stop resolving it."""
+    bump_generation(user_scope(instance.pk))
+
+
+# =============================================================================
+# Tag Index
+# =============================================================================
+
+
+@receiver(post_save, sender=Tag)
+def index_tag(sender, instance, created, **kwargs):
+    """Add new tags to the tag prefix index."""
+    if kwargs.get("raw"):
+        return
+    if created:
+        update_tag_counts({instance.name: 0})
+    else:
+        # The old name of a renamed tag is not known here
+        request_rebuild()
+
+
+@receiver(post_delete, sender=Tag)
+def unindex_tag(sender, instance, **kwargs):
+    """Remove deleted tags from the tag prefix index."""
+    remove_tag(instance.name)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def count_tag_posts(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep post counts of the tag prefix index up to date."""
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    sign = 1 if action == "post_add" else -1
+    if reverse:
+        # instance is a Tag
+        if action == "pre_clear":
+            count = instance.posts.count()
+        else:
+            count = len(pk_set)
+        update_tag_counts({instance.name: sign * count})
+        return
+    if action == "pre_clear":
+        names = instance.tags.values_list("name", flat=True)
+    else:
+        names = Tag.objects.filter(pk__in=pk_set).values_list(
+            "name", flat=True
+        )
+    update_tag_counts(dict.fromkeys(names, sign))
+
+
+@receiver(pre_delete, sender=Post)
+def uncount_deleted_post_tags(sender, instance, **kwargs):
+    """Lower post counts of the tags of a post being deleted."""
+    names = instance.tags.values_list("name", flat=True)
+    update_tag_counts(dict.fromkeys(names, -1))
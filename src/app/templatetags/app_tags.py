@@ -5,10 +5,19 @@ import re
 
 from django import template
 from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
 from django.utils.safestring import mark_safe
 
+from app import media_urls
+from app.image_proxy import image_proxy_url, is_valid_transform
+from app.storage import local_media_path, media_key, parse_content_key
+
 register = template.Library()
 
+# {% image_proxy_url image 300 300 "webp" %}
+register.simple_tag(image_proxy_url)
+
 
 @register.filter
 def linkify_hashtags(text):
@@ -57,6 +66,11 @@ def get_image_url(image_field):
     if not image_field:
         return ""
 
+    # Content-addressed local files map straight to their URL
+    key = media_key(image_field)
+    if parse_content_key(key):
+        return default_storage.url(key)
+
     # Check if Cloudinary storage is active
     has_cloudinary_storage = (
         hasattr(settings, "DEFAULT_FILE_STORAGE")
@@ -66,6 +80,8 @@ def get_image_url(image_field):
     # If Cloudinary storage is active, use Cloudinary URL
     if has_cloudinary_storage:
         try:
+            if hasattr(image_field, "public_id"):
+                return media_urls.image_url(image_field)
             return image_field.url
         except Exception:
             # If Cloudinary URL generation fails, return empty
@@ -102,3 +118,98 @@ def get_image_url(image_field):
     except Exception:
         # Fallback to empty string if URL generation fails
         return ""
+
+
+@register.filter
+def image_url(value, transform=None):
+    """
+    Get the URL of a media field value, optionally transformed.
+
+    URLs are memoized per file and transformation, see app.media_urls.
+
+    Example:
+        {{ user.profile.avatar|image_url:"avatar" }}
+
+    Args:
+        value: CloudinaryField value
+        transform: Name of an IMAGE_TRANSFORMS entry
+
+    Returns:
+        URL string
+    """
+    return media_urls.image_url(value, transform)
+
+
+@register.simple_tag
+def picture(image_field, **attrs):
+    """
+    Render an image as <picture> with modern format sources.
+
+    Images get one <source> per IMAGE_RENDITION_FORMATS entry and an
+    <img> with the original as fallback. Cloudinary converts its images
+    itself; local files of a post image are converted by the image
+    proxy, and other local files render as a plain <img>.
+
+    Example:
+        {% picture image.image post_image=image alt="Photo" width=image.width placeholder=image.placeholder %}
+
+    Args:
+        image_field: CloudinaryField value
+        **attrs: <img> attributes; underscores become hyphens and None
+            values are left out. placeholder is a data URI painted as
+            the background until the image loads. post_image is the
+            PostImage of image_field, for image proxy sources.
+
+    Returns:
+        HTML string
+    """
+    placeholder = attrs.pop("placeholder", "")
+    post_image = attrs.pop("post_image", None)
+    if placeholder:
+        # Painted behind the image until it has loaded
+        attrs["style"] = f"background: url({placeholder}) center / cover"
+
+    src = get_image_url(image_field)
+    img = format_html(
+        '<img src="{}"{}>',
+        src,
+        format_html_join(
+            "",
+            ' {}="{}"',
+            (
+                (name.replace("_", "-"), value)
+                for name, value in attrs.items()
+                if value is not None
+            ),
+        ),
+    )
+
+    if not src:
+        return img
+    if src.startswith(settings.MEDIA_URL):
+        if post_image is None or local_media_path(image_field) is None:
+            return img
+        # Fits any stored image, which is never scaled up
+        size = settings.IMAGE_MAX_DIMENSION
+        urls = [
+            (
+                image_format,
+                image_proxy_url(post_image, size, size, image_format),
+            )
+            for image_format in settings.IMAGE_RENDITION_FORMATS
+            if is_valid_transform(size, size, image_format)
+        ]
+    elif hasattr(image_field, "build_url"):
+        urls = [
+            (image_format, media_urls.image_url(image_field, fmt=image_format))
+            for image_format in settings.IMAGE_RENDITION_FORMATS
+        ]
+    else:
+        return img
+    if not urls:
+        return img
+
+    sources = format_html_join(
+        "", '<source type="image/{}" srcset="{}">', urls
+    )
+    return format_html("<picture>{}{}</picture>", sources, img)
@@ -0,0 +1,142 @@
+"""
+Upload handlers for DJGramm.
+
+Every file uploaded to DJGramm is an image, so ImageUploadHandler runs
+first for all uploads and checks each file while it streams in: the
+magic bytes and the dimensions in the header are read from the first
+chunk, and the byte count is checked on every chunk. A file that fails
+stops the upload before the rest of the request body is read, instead
+of after Django has buffered it for validate_image().
+"""
+
+import logging
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.shortcuts import redirect
+from PIL import Image
+
+from .imaging import read_dimensions, sniff_format
+from .services import MAX_IMAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Headers not complete within this many bytes are rejected; JPEG EXIF
+# segments before the frame header are at most 64KB each
+HEADER_MAX_BYTES = 256 * 1024
+
+
+def get_upload_errors(request) -> list[str]:
+    """
+    Return the messages of uploads rejected while parsing request.
+
+    Args:
+        request: HTTP request
+
+    Returns:
+        List of error messages, empty if nothing was rejected
+    """
+    # Make sure the body has been parsed
+    request.FILES  # noqa: B018
+    return getattr(request, "upload_errors", [])
+
+
+def _too_large_message() -> str:
+    return f"Image too large. Maximum size is {MAX_IMAGE_SIZE // (1024 * 1024)}MB."
+
+
+def _too_many_pixels_message() -> str:
+    megapixels = settings.IMAGE_MAX_PIXELS // 1_000_000
+    return f"Image has too many pixels. Maximum is {megapixels} megapixels."
+
+
+class ImageUploadHandler(FileUploadHandler):
+    """Reject non-image, oversized and decompression-bomb uploads early."""
+
+    def new_file(self, *args, **kwargs):
+        """Start checking a new file."""
+        super().new_file(*args, **kwargs)
+        self.header = bytearray()
+        self.received = 0
+        self.checked = False
+        if self.content_length and self.content_length > MAX_IMAGE_SIZE:
+            self.reject(_too_large_message())
+
+    def receive_data_chunk(self, raw_data, start):
+        """Check the header and running size, then pass the chunk on."""
+        self.received += len(raw_data)
+        if self.received > MAX_IMAGE_SIZE:
+            self.reject(_too_large_message())
+
+        if not self.checked:
+            self.header += raw_data[: HEADER_MAX_BYTES - len(self.header)]
+            self.checked = self.check_header(final=False)
+        return raw_data
+
+    def file_complete(self, file_size):
+        """Check files whose header did not fit in the chunks so far."""
+        if not self.checked:
+            self.checked = self.check_header(final=True)
+        # Leave building the file to the next handler
+        return None
+
+    def check_header(self, final: bool) -> bool:
+        """
+        Validate format and dimensions once the header has arrived.
+
+        Args:
+            final: No more data follows, so an incomplete header is invalid
+
+        Returns:
+            True when the header was checked, False to wait for more data
+        """
+        data = bytes(self.header)
+        final = final or len(data) >= HEADER_MAX_BYTES
+        if len(data) < 12 and not final:
+            return False
+
+        image_format = sniff_format(data)
+        if image_format is None:
+            self.reject("Not a JPEG, PNG or WebP image.")
+
+        try:
+            size = read_dimensions(data, image_format)
+        except Image.DecompressionBombError:
+            self.reject(_too_many_pixels_message())
+        except ValueError:
+            self.reject("Invalid or corrupted image file.")
+        if size is None:
+            if final:
+                self.reject("Invalid or corrupted image file.")
+            return False
+
+        width, height = size
+        if width * height > settings.IMAGE_MAX_PIXELS:
+            self.reject(_too_many_pixels_message())
+        return True
+
+    def reject(self, reason: str):
+        """Record why the file was rejected and stop reading the body."""
+        logger.warning("Rejected upload %s: %s", self.file_name, reason)
+        errors = getattr(self.request, "upload_errors", [])
+        errors.append(f"{self.file_name}: {reason}")
+        self.request.upload_errors = errors
+        raise StopUpload(connection_reset=True)
+
+
+class RejectedUploadMixin:
+    """
+    View mixin sending the form back when an upload was rejected.
+
+    The rest of the body was never read, so the submitted data is
+    incomplete and must not be saved.
+    """
+
+    def post(self, request, *args, **kwargs):
+        errors = get_upload_errors(request)
+        if errors:
+            for error in errors:
+                messages.error(request, f"Image error: {error}")
+            return redirect(request.path)
+        return super().post(request, *args, **kwargs)
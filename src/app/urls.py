@@ -8,6 +8,8 @@ from . import views
 urlpatterns = [
     # Health check (for Docker healthcheck)
     path("health/", views.health_check, name="health_check"),
+    # Metrics (staff only)
+    path("metrics/", views.metrics_view, name="metrics"),
     # Feed
     path("", views.FeedView.as_view(), name="feed"),
     path("news/", views.NewsFeedView.as_view(), name="news_feed"),
@@ -84,8 +86,36 @@ urlpatterns = [
         views.update_image_order,
         name="reorder_images",
     ),
+    # Direct uploads
+    path("uploads/tickets/", views.upload_tickets, name="upload_tickets"),
+    path("uploads/", views.direct_upload, name="direct_upload"),
+    path(
+        "uploads/resumable/",
+        views.chunked_uploads,
+        name="chunked_uploads",
+    ),
+    path(
+        "uploads/resumable/<str:upload_id>/",
+        views.chunked_upload,
+        name="chunked_upload",
+    ),
+    # Search
+    path("search/", views.search, name="search"),
+    path("search/users/", views.user_search, name="user_search"),
     # Tags
     path("tag/<slug:slug>/", views.TagPostsView.as_view(), name="tag_posts"),
+    path(
+        "tags/autocomplete/",
+        views.tag_autocomplete,
+        name="tag_autocomplete",
+    ),
+    # Local media storage
+    path("media/<path:key>", views.serve_media, name="media"),
+    path(
+        "img/<int:pk>/<int:width>x<int:height>.<str:fmt>",
+        views.image_proxy,
+        name="image_proxy",
+    ),
     # OAuth
     path(
         "oauth/disconnect/<str:provider>/",
@@ -0,0 +1,186 @@
+"""
+User search and autocomplete for DJGramm.
+
+A query matches users whose username or profile full name starts with
+it, or contains it approximately by trigram word similarity (pg_trgm's
+<% operator). Prefix matches come first: usernames, then full names,
+then the rest by similarity.
+
+On PostgreSQL each kind of match is a separate capped lookup on its
+own index (migration 0014_user_search): btrees on lower() for prefixes,
+GIN trigram indexes for similarity. Only the few candidates they return
+are joined and ranked, so a keystroke costs a handful of index probes.
+
+SQLite has no pg_trgm, so there users are scanned and ranked in Python
+with the same trigrams, approximating word_similarity() by the share of
+the query's trigrams found in the name.
+"""
+
+import heapq
+import re
+
+from django.conf import settings
+from django.db import connection
+
+from .models import User
+
+# Default pg_trgm.word_similarity_threshold, used by the <% operator
+WORD_SIMILARITY_THRESHOLD = 0.6
+# Similarity matches fetched per index before ranking
+SIMILAR_CANDIDATES = 50
+
+# pg_trgm splits text into words of letters and digits
+TRIGRAM_WORD_RE = re.compile(r"[^\W_]+")
+
+
+def trigrams(text: str) -> set[str]:
+    """
+    Return the trigrams of text the way pg_trgm extracts them.
+
+    Each lowercased word is padded with two spaces in front and one
+    behind.
+
+    Example:
+        "Jo" -> {"  j", " jo", "jo "}
+    """
+    found = set()
+    for word in TRIGRAM_WORD_RE.findall(text.lower()):
+        padded = f"  {word} "
+        found.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return found
+
+
+def word_similarity(query: str, text: str) -> float:
+    """Return the share of the trigrams of query found in text."""
+    wanted = trigrams(query)
+    if not wanted:
+        return 0.0
+    return len(wanted & trigrams(text)) / len(wanted)
+
+
+def _like_prefix(query: str) -> str:
+    escaped = (
+        query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    )
+    return f"{escaped}%"
+
+
+# =============================================================================
+# Backends
+# =============================================================================
+
+
+def _search_postgresql(query: str, limit: int) -> list[int]:
+    sql = """
+        WITH candidates AS (
+            (SELECT id AS user_id FROM app_user
+             WHERE lower(username) LIKE %(prefix)s AND is_active
+             ORDER BY lower(username) LIMIT %(limit)s)
+            UNION
+            (SELECT user_id FROM app_profile
+             WHERE lower(full_name) LIKE %(prefix)s
+             ORDER BY lower(full_name) LIMIT %(limit)s)
+            UNION
+            (SELECT id FROM app_user
+             WHERE %(query)s <%% lower(username) AND is_active
+             LIMIT %(candidates)s)
+            UNION
+            (SELECT user_id FROM app_profile
+             WHERE %(query)s <%% lower(full_name)
+             LIMIT %(candidates)s)
+        )
+        SELECT u.id
+        FROM candidates c
+        JOIN app_user u ON u.id = c.user_id
+        LEFT JOIN app_profile p ON p.user_id = u.id
+        WHERE u.is_active
+        ORDER BY
+            CASE
+                WHEN lower(u.username) LIKE %(prefix)s THEN 0
+                WHEN lower(p.full_name) LIKE %(prefix)s THEN 1
+                ELSE 2
+            END,
+            greatest(
+                word_similarity(%(query)s, lower(u.username)),
+                word_similarity(%(query)s, lower(coalesce(p.full_name, '')))
+            ) DESC,
+            length(u.username),
+            u.username
+        LIMIT %(limit)s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            sql,
+            {
+                "query": query,
+                "prefix": _like_prefix(query),
+                "limit": limit,
+                "candidates": SIMILAR_CANDIDATES,
+            },
+        )
+        return [user_id for (user_id,) in cursor.fetchall()]
+
+
+def rank_user(query: str, username: str, full_name: str) -> tuple | None:
+    """
+    Return the sort key of a user for query, or None if it is no match.
+
+    Args:
+        query: Lowercased search input
+        username: Username of the user
+        full_name: Full name from the profile, may be empty
+
+    Returns:
+        Tuple ordering better matches first
+    """
+    names = (username.lower(), full_name.lower())
+    score = max(word_similarity(query, name) for name in names)
+    # Username prefixes first, then full name prefixes, then the rest
+    prefixes = [i for i, name in enumerate(names) if name.startswith(query)]
+    if not prefixes and score < WORD_SIMILARITY_THRESHOLD:
+        return None
+    tier = prefixes[0] if prefixes else len(names)
+    return (tier, -score, len(username), username)
+
+
+def _search_python(query: str, limit: int) -> list[int]:
+    ranked = []
+    users = User.objects.filter(is_active=True).values_list(
+        "pk", "username", "profile__full_name"
+    )
+    for user_id, username, full_name in users.iterator():
+        key = rank_user(query, username, full_name or "")
+        if key is not None:
+            ranked.append((key, user_id))
+    return [user_id for _, user_id in heapq.nsmallest(limit, ranked)]
+
+
+# =============================================================================
+# Search
+# =============================================================================
+
+
+def search_users(query: str, limit: int | None = None) -> list[User]:
+    """
+    Find active users by username or full name, best match first.
+
+    Args:
+        query: Start of, or approximately, a username or full name
+        limit: Maximum number of users, by default USER_SEARCH_MAX_RESULTS
+
+    Returns:
+        List of User with profiles loaded
+    """
+    max_length = User._meta.get_field("username").max_length
+    query = query.strip().lower()[:max_length]
+    if limit is None:
+        limit = settings.USER_SEARCH_MAX_RESULTS
+    if not query or limit <= 0:
+        return []
+
+    if connection.vendor == "postgresql":
+        user_ids = _search_postgresql(query, limit)
+    else:
+        user_ids = _search_python(query, limit)
+    users = User.objects.select_related("profile").in_bulk(user_ids)
+    return [users[user_id] for user_id in user_ids if user_id in users]
@@ -2,15 +2,32 @@
 
 import json
 import logging
+import mimetypes
+import os
 import time
 
+from django.conf import settings
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
 from django.db import transaction
-from django.http import JsonResponse
+from django.db.models import Max
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseForbidden,
+    HttpResponseNotModified,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, redirect
+from django.urls import reverse
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import (
@@ -21,6 +38,31 @@ from django.views.generic import (
     UpdateView,
 )
 
+from . import metrics
+from .cache import (
+    AnonymousPageCacheMixin,
+    attach_post_card_versions,
+    feed_scope,
+    get_following_ids,
+    get_profile_counts,
+    invalidate_post,
+    profile_scope,
+    tag_scope,
+)
+from .chunked_uploads import (
+    ChunkedUpload,
+    UploadConflict,
+    UploadNotFound,
+    parse_metadata,
+    purge_expired_uploads,
+)
+from .direct_uploads import (
+    UploadRejected,
+    claim_uploads,
+    issue_ticket,
+    read_ticket,
+    store_direct_upload,
+)
 from .forms import (
     CommentForm,
     PostForm,
@@ -28,8 +70,34 @@ from .forms import (
     ProfileForm,
     RegistrationForm,
 )
+from .image_engine import (
+    ImageEngineBusy,
+    ImageEngineError,
+    ImageEngineTimeout,
+)
+from .image_proxy import (
+    PROXY_FORMATS,
+    get_transform,
+    is_valid_transform,
+    transform_name,
+    verify_transform,
+)
+from .media_urls import image_url
 from .models import Comment, Follow, Like, Post, PostImage, Profile, Tag, User
-from .services import sync_post_tags
+from .pagination import paginate_by_cursor
+from .search import search_posts
+from .services import (
+    MAX_IMAGE_SIZE,
+    ORDER_GAP,
+    process_post_images,
+    reorder_post_images,
+    store_image_files,
+    sync_post_tags,
+)
+from .storage import parse_content_key
+from .tag_index import get_tag_index
+from .upload_handlers import RejectedUploadMixin
+from .user_search import search_users
 
 logger = logging.getLogger(__name__)
 
@@ -38,7 +106,47 @@ logger = logging.getLogger(__name__)
 # =============================================================================
 
 
-class FeedView(ListView):
+def get_post_card_context(request, posts):
+    """
+    Build context for rendering post cards.
+
+    Post cards are cached as fragments shared by all users, so the
+    viewer's like and follow state is returned separately as
+    viewer_state and applied on top of the cards client-side.
+    """
+    posts = list(posts)
+    attach_post_card_versions(posts)
+
+    if not request.user.is_authenticated:
+        return {
+            "user_liked_posts": set(),
+            "user_following_ids": set(),
+            "following_count": 0,
+        }
+
+    # Only likes of posts on this page are needed
+    user_liked_posts = set(
+        Like.objects.filter(
+            user=request.user, post_id__in=[post.pk for post in posts]
+        ).values_list("post_id", flat=True)
+    )
+    # Get IDs of users that current user follows
+    # (for Follow/Unfollow buttons)
+    user_following_ids = get_following_ids(request.user)
+    return {
+        "user_liked_posts": user_liked_posts,
+        "user_following_ids": user_following_ids,
+        # Get following count for empty feed message
+        "following_count": len(user_following_ids),
+        "viewer_state": {
+            "user_id": request.user.pk,
+            "liked_post_ids": sorted(user_liked_posts),
+            "following_ids": sorted(user_following_ids),
+        },
+    }
+
+
+class FeedView(AnonymousPageCacheMixin, ListView):
     """Display feed of posts."""
 
     model = Post
@@ -46,45 +154,22 @@ class FeedView(ListView):
     context_object_name = "posts"
     paginate_by = 12
 
+    def get_page_cache_scopes(self):
+        """Feed pages change with any post, like, comment or profile."""
+        return [feed_scope()]
+
     def get_queryset(self):
         """Show all posts with optimized queries."""
-        from django.db.models import Prefetch
-
-        return Post.objects.select_related(
-            "author", "author__profile"
-        ).prefetch_related(
-            Prefetch(
-                "images",
-                queryset=PostImage.objects.order_by("order"),
-            ),
-            "tags",
-            "likes",
-            "comments",
+        return (
+            Post.objects.select_related("author", "author__profile")
+            .with_cover()
+            .with_counts()
         )
 
     def get_context_data(self, **kwargs):
         """Add user's liked posts and following status to context."""
         context = super().get_context_data(**kwargs)
-        if self.request.user.is_authenticated:
-            # Get IDs of posts liked by current user
-            context["user_liked_posts"] = set(
-                Like.objects.filter(user=self.request.user).values_list(
-                    "post_id", flat=True
-                )
-            )
-            # Get IDs of users that current user follows
-            # (for Follow/Unfollow buttons)
-            context["user_following_ids"] = set(
-                self.request.user.following.values_list("id", flat=True)
-            )
-            # Get following count for empty feed message
-            context["following_count"] = (
-                self.request.user.get_following_count()
-            )
-        else:
-            context["user_liked_posts"] = set()
-            context["user_following_ids"] = set()
-            context["following_count"] = 0
+        context.update(get_post_card_context(self.request, context["posts"]))
         return context
 
 
@@ -109,53 +194,24 @@ class NewsFeedView(ListView):
         if not self.request.user.is_authenticated:
             return Post.objects.none()
 
-        # Get users that current user follows (ManyToManyField)
-        following_users = self.request.user.following.all()
-
         # Include own posts
-        following_ids = list(following_users.values_list("id", flat=True))
-        following_ids.append(self.request.user.id)
-
-        from django.db.models import Prefetch
+        following_ids = [
+            *get_following_ids(self.request.user),
+            self.request.user.id,
+        ]
 
         return (
             Post.objects.filter(author_id__in=following_ids)
             .select_related("author", "author__profile")
-            .prefetch_related(
-                Prefetch(
-                    "images",
-                    queryset=PostImage.objects.order_by("order"),
-                ),
-                "tags",
-                "likes",
-                "comments",
-            )
+            .with_cover()
+            .with_counts()
         )
 
     def get_context_data(self, **kwargs):
         """Add context for news feed."""
         context = super().get_context_data(**kwargs)
         context["is_news_feed"] = True
-
-        if self.request.user.is_authenticated:
-            # Get IDs of posts liked by current user
-            context["user_liked_posts"] = set(
-                Like.objects.filter(user=self.request.user).values_list(
-                    "post_id", flat=True
-                )
-            )
-            # Get IDs of users that current user follows
-            context["user_following_ids"] = set(
-                self.request.user.following.values_list("id", flat=True)
-            )
-            # Get following count for empty feed message
-            context["following_count"] = (
-                self.request.user.get_following_count()
-            )
-        else:
-            context["user_liked_posts"] = set()
-            context["user_following_ids"] = set()
-            context["following_count"] = 0
+        context.update(get_post_card_context(self.request, context["posts"]))
         return context
 
 
@@ -190,7 +246,7 @@ class RegisterView(CreateView):
 # =============================================================================
 
 
-class ProfileView(DetailView):
+class ProfileView(AnonymousPageCacheMixin, DetailView):
     """Display user profile."""
 
     model = User
@@ -198,26 +254,41 @@ class ProfileView(DetailView):
     context_object_name = "profile_user"
     slug_field = "username"
     slug_url_kwarg = "username"
+    posts_paginate_by = 24
+
+    def get_page_cache_scopes(self):
+        """Profile pages change with the user's posts, likes and follows."""
+        return [profile_scope(self.kwargs["username"])]
 
     def get_context_data(self, **kwargs):
-        """Add user posts to context."""
+        """Add a page of the user's posts to context."""
         context = super().get_context_data(**kwargs)
-        from django.db.models import Prefetch
-
-        context["posts"] = (
-            self.object.posts.select_related("author")
-            .prefetch_related(
-                Prefetch(
-                    "images",
-                    queryset=PostImage.objects.order_by("order"),
-                )
+        # Grid cells only show the cover image and counts. The related
+        # manager attaches the author to each post, so author is loaded too
+        posts = (
+            self.object.posts.only(
+                "id",
+                "author",
+                "created_at",
+                "cover_image__image",
+                "cover_image__width",
+                "cover_image__height",
+                "cover_image__placeholder",
             )
-            .order_by("-created_at")
+            .with_cover()
+            .with_counts()
         )
-        context["posts_count"] = context["posts"].count()
-
-        context["followers_count"] = self.object.get_followers_count()
-        context["following_count"] = self.object.get_following_count()
+        try:
+            page = paginate_by_cursor(
+                posts,
+                self.request.GET.get("cursor"),
+                self.posts_paginate_by,
+            )
+        except ValueError as e:
+            raise Http404("Invalid cursor") from e
+        context["posts"] = page.items
+        context["posts_page"] = page
+        context.update(get_profile_counts(self.object))
 
         # Check if current user is following target user
         if self.request.user.is_authenticated:
@@ -323,7 +394,7 @@ class FollowingListView(ListView):
         return context
 
 
-class ProfileEditView(LoginRequiredMixin, UpdateView):
+class ProfileEditView(LoginRequiredMixin, RejectedUploadMixin, UpdateView):
     """Edit user profile."""
 
     model = Profile
@@ -647,7 +718,7 @@ class PostDetailView(DetailView):
         return context
 
 
-class PostCreateView(LoginRequiredMixin, CreateView):
+class PostCreateView(LoginRequiredMixin, RejectedUploadMixin, CreateView):
     """Create new post with images."""
 
     model = Post
@@ -666,70 +737,69 @@ class PostCreateView(LoginRequiredMixin, CreateView):
         return context
 
     def form_valid(self, form):
-        """Save post and images, sync tags."""
-        logger = logging.getLogger(__name__)
-
-        # Rebuild formset with POST and FILES data
-        image_formset = PostImageFormSet(self.request.POST, self.request.FILES)
-
+        """Save post, images and tags in one transaction."""
         form.instance.author = self.request.user
-        self.object = form.save()
-
-        # Sync tags from caption
-        sync_post_tags(self.object, form.cleaned_data["caption"])
-
-        # Log formset state for debugging
-        logger.info(
-            f"Post {self.object.pk}: Formset total forms: {image_formset.total_form_count()}"
-        )
-        logger.info(
-            f"Post {self.object.pk}: Files in request.FILES: {list(self.request.FILES.keys())}"
+        image_formset = PostImageFormSet(
+            self.request.POST, self.request.FILES, instance=form.instance
         )
-        for key in self.request.FILES.keys():
-            file = self.request.FILES[key]
-            logger.info(
-                f"Post {self.object.pk}: File '{key}': {file.name}, size: {file.size}"
-            )
-
-        # Set instance before validation
-        image_formset.instance = self.object
 
-        # Validate and save image formset
+        images = []
         if image_formset.is_valid():
-            saved_instances = image_formset.save(commit=False)
-            # Set order for each image based on form position
-            for index, img in enumerate(saved_instances):
-                img.order = index
-                img.save()
-            logger.info(
-                f"Post {self.object.pk}: Saved {len(saved_instances)} image instances"
+            images = image_formset.save(commit=False)
+            for error in process_post_images(images, self.request.user):
+                messages.error(self.request, f"Image error: {error}")
+            # Upload before the transaction so no row locks are held
+            # during network round trips
+            store_image_files(images)
+            logger.debug(
+                "Uploaded %d images for new post by user %s",
+                len(images),
+                self.request.user.pk,
             )
-            for img in saved_instances:
-                logger.info(
-                    f"Post {self.object.pk}: Saved image {img.pk} - order {img.order} - {img.image}"
-                )
-                if hasattr(img.image, "url"):
-                    logger.info(
-                        f"Post {self.object.pk}: Image URL: {img.image.url}"
-                    )
         else:
-            # If formset is invalid, show errors
-            logger.error(
-                f"Post {self.object.pk}: Formset errors: {image_formset.errors}"
-            )
-            logger.error(
-                f"Post {self.object.pk}: Formset non_form_errors: {image_formset.non_form_errors()}"
+            logger.warning(
+                "Invalid image formset for new post by user %s: %s %s",
+                self.request.user.pk,
+                image_formset.errors,
+                image_formset.non_form_errors(),
             )
             for error_dict in image_formset.errors:
                 for _field, errors in error_dict.items():
                     for error in errors:
                         messages.error(self.request, f"Image error: {error}")
 
+        # Images the browser uploaded directly, see app.direct_uploads
+        uploaded, errors = claim_uploads(
+            self.request.user, self.request.POST.getlist("uploads")
+        )
+        for error in errors:
+            messages.error(self.request, f"Image error: {error}")
+        images += uploaded[: PostImageFormSet.max_num - len(images)]
+
+        with transaction.atomic():
+            self.object = form.save()
+            sync_post_tags(self.object, form.cleaned_data["caption"])
+            for index, img in enumerate(images):
+                img.post = self.object
+                # Gapped order keys based on form position
+                img.order = (index + 1) * ORDER_GAP
+            # bulk_create sends no signals, so the cover is set here
+            PostImage.objects.bulk_create(images)
+            if images:
+                Post.objects.filter(pk=self.object.pk).refresh_covers()
+            post_id = self.object.pk
+            transaction.on_commit(lambda: invalidate_post(post_id))
+
+        logger.info(
+            "Post %s created with %d images", self.object.pk, len(images)
+        )
         messages.success(self.request, "Post created successfully!")
         return redirect(self.object.get_absolute_url())
 
 
-class PostUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class PostUpdateView(
+    LoginRequiredMixin, UserPassesTestMixin, RejectedUploadMixin, UpdateView
+):
     """Edit existing post."""
 
     model = Post
@@ -766,9 +836,32 @@ class PostUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         # Validate and save image formset
         if image_formset.is_valid():
             saved_instances = image_formset.save(commit=False)
-            # Set order for each image based on form position
-            for index, img in enumerate(saved_instances):
-                img.order = index
+            # Process new files like PostCreateView; failed ones are skipped
+            uploads = [
+                img
+                for img in saved_instances
+                if isinstance(img.image, UploadedFile)
+            ]
+            failed = {id(img) for img in uploads}
+            for error in process_post_images(uploads, self.object.author):
+                messages.error(self.request, f"Image error: {error}")
+            failed -= {id(img) for img in uploads}
+            saved_instances = [
+                img for img in saved_instances if id(img) not in failed
+            ]
+            # save(commit=False) leaves images marked for deletion alone
+            for img in image_formset.deleted_objects:
+                img.delete()
+            # New images go after the existing ones; existing images
+            # keep their keys, which update_image_order maintains
+            last_order = self.object.images.aggregate(last=Max("order"))
+            last_order = last_order["last"]
+            if last_order is None:
+                last_order = 0
+            for img in saved_instances:
+                if img.pk is None:
+                    last_order += ORDER_GAP
+                    img.order = last_order
                 img.save()
         else:
             # If formset is invalid, show errors
@@ -939,6 +1032,17 @@ def health_check(request):
     return HttpResponse("OK", content_type="text/plain")
 
 
+@staff_member_required
+def metrics_view(request):
+    """Expose in-process metrics (cache hits, misses) to staff."""
+    from django.http import HttpResponse
+
+    return HttpResponse(
+        metrics.render_prometheus(),
+        content_type="text/plain; version=0.0.4",
+    )
+
+
 @login_required
 def delete_comment(request, pk, comment_pk):
     """Delete a comment (AJAX endpoint)."""
@@ -1020,23 +1124,244 @@ def update_image_order(request, pk):
         data = json.loads(request.body)
         order_list = data.get("order", [])
 
-        # Update order for each image
-        for index, image_id in enumerate(order_list):
-            PostImage.objects.filter(pk=image_id, post=post).update(
-                order=index
-            )
+        if reorder_post_images(post, order_list):
+            # Queryset updates send no signals
+            Post.objects.filter(pk=post.pk).refresh_covers()
+            invalidate_post(post.pk)
 
         return JsonResponse({"success": True})
-    except (json.JSONDecodeError, KeyError):
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
         return JsonResponse({"error": "Invalid data"}, status=400)
 
 
+# =============================================================================
+# Direct Uploads
+# =============================================================================
+
+
+@login_required
+def upload_tickets(request):
+    """Issue tickets for uploading post images (AJAX endpoint)."""
+    if request.method != "POST":
+        return JsonResponse({"error": "POST method required"}, status=405)
+
+    try:
+        count = int(json.loads(request.body).get("count", 1))
+    except (json.JSONDecodeError, AttributeError, TypeError, ValueError):
+        return JsonResponse({"error": "Invalid data"}, status=400)
+    if not 1 <= count <= PostImageFormSet.max_num:
+        return JsonResponse({"error": "Invalid number of images"}, status=400)
+
+    tickets = [issue_ticket(request.user) for _ in range(count)]
+    return JsonResponse({"uploads": tickets})
+
+
+@login_required
+def direct_upload(request):
+    """
+    Store a post image sent as the raw request body (AJAX endpoint).
+
+    The ticket comes in the X-Upload-Ticket header. nginx buffers the
+    body before passing the request on, see docker/nginx.conf.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST method required"}, status=405)
+
+    try:
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    if length > MAX_IMAGE_SIZE:
+        return JsonResponse({"error": "Image too large"}, status=413)
+
+    # Read the stream directly; request.body is capped much lower
+    data = request.read(MAX_IMAGE_SIZE + 1)
+    try:
+        receipt = store_direct_upload(
+            request.user,
+            request.headers.get("X-Upload-Ticket", ""),
+            data,
+            request.content_type or "",
+        )
+    except UploadRejected as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({"receipt": receipt})
+
+
+# tus protocol version of the resumable upload endpoints
+TUS_VERSION = "1.0.0"
+CHUNK_CONTENT_TYPE = "application/offset+octet-stream"
+
+
+def _header_int(request, name: str) -> int | None:
+    try:
+        return int(request.headers.get(name, ""))
+    except ValueError:
+        return None
+
+
+@login_required
+def chunked_uploads(request):
+    """Start a resumable upload of a post image (tus creation)."""
+    if request.method != "POST":
+        return JsonResponse({"error": "POST method required"}, status=405)
+
+    length = _header_int(request, "Upload-Length")
+    if length is None or length <= 0:
+        return JsonResponse({"error": "Invalid Upload-Length"}, status=400)
+    if length > MAX_IMAGE_SIZE:
+        return JsonResponse({"error": "Image too large"}, status=413)
+    try:
+        read_ticket(
+            request.user,
+            request.headers.get("X-Upload-Ticket", ""),
+            settings.DIRECT_UPLOAD_TICKET_TTL,
+        )
+    except UploadRejected as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    purge_expired_uploads()
+    metadata = parse_metadata(request.headers.get("Upload-Metadata", ""))
+    upload = ChunkedUpload.create(
+        request.user, length, metadata.get("filetype", "")
+    )
+    url = reverse("chunked_upload", kwargs={"upload_id": upload.upload_id})
+    response = JsonResponse({"url": url}, status=201)
+    response["Location"] = url
+    response["Tus-Resumable"] = TUS_VERSION
+    return response
+
+
+@login_required
+def chunked_upload(request, upload_id):
+    """
+    Report (HEAD), continue (PATCH) or cancel (DELETE) an upload.
+
+    PATCH stores the body as the chunk at Upload-Offset. The response
+    carries the offset to continue from, and once the upload is
+    complete the receipt for the post form.
+    """
+    try:
+        upload = ChunkedUpload.open(upload_id, request.user)
+    except UploadNotFound as e:
+        raise Http404 from e
+
+    if request.method == "HEAD":
+        response = HttpResponse()
+    elif request.method == "DELETE":
+        upload.delete()
+        response = HttpResponse(status=204)
+    elif request.method == "PATCH":
+        has_body = _header_int(request, "Content-Length")
+        if has_body and request.content_type != CHUNK_CONTENT_TYPE:
+            return JsonResponse(
+                {"error": "Unsupported chunk type"}, status=415
+            )
+        offset = _header_int(request, "Upload-Offset")
+        if offset is None:
+            return JsonResponse({"error": "Invalid Upload-Offset"}, status=400)
+        try:
+            offset = upload.write(offset, request)
+            receipt = upload.complete(request.user)
+        except UploadConflict as e:
+            response = JsonResponse(
+                {"error": str(e), "offset": e.offset}, status=409
+            )
+            response["Upload-Offset"] = e.offset
+            response["Tus-Resumable"] = TUS_VERSION
+            return response
+        except UploadRejected as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        response = JsonResponse({"offset": offset, "receipt": receipt})
+    else:
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    if request.method != "DELETE":
+        response["Upload-Offset"] = upload.offset()
+        response["Upload-Length"] = upload.length
+    response["Tus-Resumable"] = TUS_VERSION
+    response["Cache-Control"] = "no-store"
+    return response
+
+
+# =============================================================================
+# Search
+# =============================================================================
+
+
+def search(request):
+    """Search post captions, best match first (AJAX endpoint)."""
+    if request.method != "GET":
+        return JsonResponse({"error": "GET method required"}, status=405)
+
+    query = request.GET.get("q", "")
+    try:
+        limit = int(request.GET.get("limit", 20))
+    except ValueError:
+        return JsonResponse({"error": "Invalid limit"}, status=400)
+    limit = max(1, min(limit, settings.SEARCH_MAX_RESULTS))
+
+    results = search_posts(query, limit)
+    return JsonResponse(
+        {
+            "results": [
+                {
+                    "id": result.post.pk,
+                    "url": result.post.get_absolute_url(),
+                    "author": result.post.author.username,
+                    "headline": result.headline,
+                    "rank": result.rank,
+                }
+                for result in results
+            ]
+        }
+    )
+
+
+def user_search(request):
+    """Suggest users by username or full name (AJAX endpoint)."""
+    if request.method != "GET":
+        return JsonResponse({"error": "GET method required"}, status=405)
+
+    users = search_users(request.GET.get("q", ""))
+    return JsonResponse(
+        {
+            "results": [
+                {
+                    "username": user.username,
+                    "full_name": user.profile.full_name,
+                    "url": reverse("profile", args=[user.username]),
+                    "avatar": image_url(user.profile.avatar, "avatar"),
+                }
+                for user in users
+            ]
+        }
+    )
+
+
 # =============================================================================
 # Tags
 # =============================================================================
 
 
-class TagPostsView(ListView):
+def tag_autocomplete(request):
+    """Suggest the most used tags starting with a prefix (AJAX endpoint)."""
+    if request.method != "GET":
+        return JsonResponse({"error": "GET method required"}, status=405)
+
+    prefix = request.GET.get("q", "").strip().lstrip("#")
+    if not prefix:
+        return JsonResponse({"results": []})
+    tags = get_tag_index().suggest(prefix)
+    response = JsonResponse(
+        {"results": [{"name": name, "count": count} for name, count in tags]}
+    )
+    # Counts may lag a little anyway, so browsers may reuse answers
+    response["Cache-Control"] = "private, max-age=60"
+    return response
+
+
+class TagPostsView(AnonymousPageCacheMixin, ListView):
     """Display posts by tag."""
 
     model = Post
@@ -1044,21 +1369,17 @@ class TagPostsView(ListView):
     context_object_name = "posts"
     paginate_by = 12
 
+    def get_page_cache_scopes(self):
+        """Tag pages change when posts gain, lose or change the tag."""
+        return [tag_scope(self.kwargs["slug"])]
+
     def get_queryset(self):
         """Filter posts by tag."""
-        from django.db.models import Prefetch
-
         self.tag = get_object_or_404(Tag, slug=self.kwargs["slug"])
         return (
             Post.objects.filter(tags=self.tag)
             .select_related("author")
-            .prefetch_related(
-                Prefetch(
-                    "images",
-                    queryset=PostImage.objects.order_by("order"),
-                ),
-                "likes",
-            )
+            .with_cover()
         )
 
     def get_context_data(self, **kwargs):
@@ -1068,6 +1389,109 @@ class TagPostsView(ListView):
         return context
 
 
+# =============================================================================
+# Media
+# =============================================================================
+
+# Content keys never change meaning, so clients may keep them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def serve_media(request, key):
+    """
+    Serve a file of the local media storage.
+
+    The file is handed to nginx with X-Accel-Redirect when
+    MEDIA_ACCEL_REDIRECT is set, and otherwise streamed with
+    FileResponse, which the WSGI server sends with sendfile().
+    Content-addressed files are cacheable forever, with their hash as
+    ETag.
+    """
+    try:
+        path = default_storage.path(key)
+    except SuspiciousFileOperation as e:
+        raise Http404 from e
+    if not os.path.isfile(path):
+        raise Http404
+
+    match = parse_content_key(key)
+    etag = f'"{match["digest"]}"' if match else None
+    if etag and request.headers.get("If-None-Match") == etag:
+        response = HttpResponseNotModified()
+    else:
+        content_type = mimetypes.guess_type(path)[0]
+        if settings.MEDIA_ACCEL_REDIRECT:
+            response = HttpResponse(content_type=content_type)
+            response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_REDIRECT + key
+        else:
+            response = FileResponse(
+                open(path, "rb"), content_type=content_type
+            )
+
+    if etag:
+        response["ETag"] = etag
+        response["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+# Proxy responses are sent in chunks of this size
+PROXY_CHUNK_SIZE = 64 * 1024
+
+
+def _iter_chunks(content):
+    """Yield content in chunks, closing it when done."""
+    try:
+        for start in range(0, len(content), PROXY_CHUNK_SIZE):
+            yield content[start : start + PROXY_CHUNK_SIZE]
+    finally:
+        if hasattr(content, "close"):
+            content.close()
+
+
+def image_proxy(request, pk, width, height, fmt):
+    """
+    Serve a post image scaled to fit width x height as fmt.
+
+    The URL must carry the signature made by image_proxy_url(), so only
+    transforms the site links to are ever rendered. A busy or slow image
+    engine answers 503 with Retry-After, and a failed transform 404.
+    """
+    if not is_valid_transform(width, height, fmt):
+        raise Http404
+    image = get_object_or_404(PostImage.objects.only("pk", "image"), pk=pk)
+    if not verify_transform(
+        image, width, height, fmt, request.GET.get("s", "")
+    ):
+        return HttpResponseForbidden()
+
+    etag = f'"{transform_name(image, width, height, fmt)}"'
+    if request.headers.get("If-None-Match") == etag:
+        response = HttpResponseNotModified()
+    else:
+        try:
+            content = get_transform(image, width, height, fmt)
+        except OSError as e:
+            logger.warning("Image proxy cannot read image %s: %s", pk, e)
+            raise Http404 from e
+        except (ImageEngineBusy, ImageEngineTimeout) as e:
+            logger.warning("Image proxy cannot render image %s: %r", pk, e)
+            response = HttpResponse(status=503)
+            response["Retry-After"] = settings.IMAGE_PROXY_RETRY_AFTER
+            return response
+        except ImageEngineError as e:
+            logger.warning("Image proxy cannot render image %s: %s", pk, e)
+            raise Http404 from e
+        response = StreamingHttpResponse(
+            _iter_chunks(content),
+            content_type=f"image/{PROXY_FORMATS[fmt].lower()}",
+        )
+        response["Content-Length"] = len(content)
+
+    response["ETag"] = etag
+    response["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
 # =============================================================================
 # OAuth
 # =============================================================================
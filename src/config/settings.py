@@ -2,6 +2,7 @@
 
 import os
 import sys
+import warnings
 from pathlib import Path
 
 # Cloudinary settings
@@ -62,7 +63,8 @@ MIDDLEWARE = [
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
-    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    # AuthenticationMiddleware that caches the User+Profile snapshot
+    "app.middleware.CachedAuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -315,6 +317,7 @@ api_key = CLOUDINARY_STORAGE["API_KEY"]
 api_secret = CLOUDINARY_STORAGE["API_SECRET"]
 
 if cloud_name and api_key and api_secret:
+    MEDIA_BACKEND = "cloudinary"
     DEFAULT_FILE_STORAGE = "cloudinary_storage.storage.MediaCloudinaryStorage"
     cloudinary.config(
         cloud_name=cloud_name,
@@ -323,17 +326,172 @@ if cloud_name and api_key and api_secret:
         secure=True,  # Force HTTPS URLs for all Cloudinary resources
     )
 else:
-    # When Cloudinary credentials are not provided:
-    # - Don't set DEFAULT_FILE_STORAGE (uses Django's default local storage)
-    # - CloudinaryField will use local storage for new uploads
-    # - However, if database contains public_id from previous Cloudinary uploads,
-    #   CloudinaryField may still try to generate Cloudinary URLs
-    # - Solution: Configure Cloudinary with empty values to prevent errors,
-    #   but CloudinaryField should use local storage when DEFAULT_FILE_STORAGE
-    #   is not set to MediaCloudinaryStorage
-    # - For existing public_id values, they will try to use Cloudinary URLs
-    #   which won't work. Consider migrating data or using real Cloudinary credentials.
-    pass
+    # Without Cloudinary credentials media fields store uploads in
+    # MEDIA_ROOT under the SHA-256 of their content (app.storage). Values
+    # uploaded to Cloudinary before keep pointing at Cloudinary URLs.
+    MEDIA_BACKEND = "local"
+    STORAGES = {
+        "default": {"BACKEND": "app.storage.ContentAddressedStorage"},
+        "staticfiles": {
+            "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+        },
+    }
+
+# Cloudinary API calls (app.media_client): seconds to connect and to wait
+# for data, and retries of transient failures with jittered backoff
+MEDIA_CLIENT_CONNECT_TIMEOUT = 3.05
+MEDIA_CLIENT_READ_TIMEOUT = 20
+MEDIA_CLIENT_RETRIES = 2
+# The circuit opens when this share of the calls in the last WINDOW
+# seconds failed (with at least MIN_CALLS calls), and lets a trial call
+# through after RESET_TIMEOUT seconds
+MEDIA_CLIENT_FAILURE_RATE = 0.5
+MEDIA_CLIENT_MIN_CALLS = 10
+MEDIA_CLIENT_WINDOW = 30
+MEDIA_CLIENT_RESET_TIMEOUT = 30
+
+# Post images are uploaded by the browser with a signed ticket, straight
+# to Cloudinary or to /uploads/ (app.direct_uploads). Tickets are valid
+# for TICKET_TTL seconds, upload results for CLAIM_TTL seconds
+DIRECT_UPLOAD_TICKET_TTL = 10 * 60
+DIRECT_UPLOAD_CLAIM_TTL = 24 * 60 * 60
+# Resumable uploads (app.chunked_uploads) keep their parts here until
+# complete, or until they received nothing for EXPIRY seconds
+CHUNKED_UPLOAD_DIR = os.environ.get(
+    "CHUNKED_UPLOAD_DIR", BASE_DIR / ".uploads"
+)
+CHUNKED_UPLOAD_EXPIRY = 24 * 60 * 60
+
+# When set, local media responses hand the file to nginx with
+# X-Accel-Redirect to this internal location instead of sending it
+MEDIA_ACCEL_REDIRECT = os.environ.get("MEDIA_ACCEL_REDIRECT", "")
+
+# =============================================================================
+# Cache
+# =============================================================================
+# "default" is a two-tier cache: a small in-process LRU in front of the
+# "shared" cache all workers see. The shared cache is Redis when REDIS_URL
+# is set (requires the redis package) and a file-based stand-in otherwise.
+# The stand-in is for development only: its add() and incr() are not
+# atomic across workers, so cache locks, generations and the tag index
+# change log assume Redis in production.
+REDIS_URL = os.environ.get("REDIS_URL")
+if REDIS_URL:
+    _shared_cache = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL,
+    }
+else:
+    _shared_cache = {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get("CACHE_DIR", BASE_DIR / ".cache"),
+    }
+
+CACHES = {
+    "default": {
+        "BACKEND": "app.cache_backends.TwoTierCache",
+        "OPTIONS": {
+            "SHARED_ALIAS": "shared",
+            "LOCAL_MAX_ENTRIES": 2000,
+            # Writes from other workers become visible after this delay
+            "LOCAL_TIMEOUT": 5,
+            # Counters, locks and sessions must be consistent across
+            # workers, so they are never kept in the local tier
+            "BYPASS_PREFIXES": (
+                "gen:",
+                "lock:",
+                "django.contrib.sessions",
+            ),
+        },
+    },
+    "shared": _shared_cache,
+}
+# Lifetime of cached follow graphs (users followed by a user)
+GRAPH_CACHE_TIMEOUT = 60 * 60
+# get_or_compute(): expired values are kept this many times longer and
+# served while one worker recomputes them under a short lock
+CACHE_STALE_FACTOR = 10
+CACHE_LOCK_TIMEOUT = 10
+# XFetch early expiration: higher values recompute earlier
+CACHE_XFETCH_BETA = 1.0
+
+# =============================================================================
+# Image Processing
+# =============================================================================
+# Uploaded images are resized to fit this many pixels per side
+IMAGE_MAX_DIMENSION = 1080
+# Formats offered in <picture> sources ahead of the JPEG fallback, best
+# first; Cloudinary derives them from the uploaded image on first request
+IMAGE_RENDITION_FORMATS = ["avif", "webp"]
+# Named Cloudinary transformations for the image_url template filter;
+# uploads request them and the rendition formats as eager transformations
+IMAGE_TRANSFORMS = {
+    "avatar": {"width": 160, "height": 160, "crop": "fill", "gravity": "face"},
+}
+# Uploads with more pixels are rejected as possible decompression bombs
+IMAGE_MAX_PIXELS = 50_000_000
+# Uploads are checked while they stream in, before Django stores them
+FILE_UPLOAD_HANDLERS = [
+    "app.upload_handlers.ImageUploadHandler",
+    "django.core.files.uploadhandler.MemoryFileUploadHandler",
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+# Worker processes resizing the images of a post in parallel (0 = inline)
+IMAGE_ENGINE_WORKERS = int(
+    os.environ.get("IMAGE_ENGINE_WORKERS", min(4, os.cpu_count() or 1))
+)
+# Tasks submitted but not finished before callers have to wait
+IMAGE_ENGINE_MAX_PENDING = 32
+# Seconds an image may take, and the longest wait for a free slot
+IMAGE_ENGINE_TASK_TIMEOUT = 30
+# Workers are started from a clean server process, not forked from a
+# request-handling worker with open connections and threads
+IMAGE_ENGINE_START_METHOD = "forkserver"
+# Images transformed on demand at /img/<id>/<w>x<h>.<fmt> are kept in
+# this directory, least recently used ones removed beyond the size limit
+IMAGE_PROXY_CACHE_DIR = os.environ.get(
+    "IMAGE_PROXY_CACHE_DIR", BASE_DIR / ".image-cache"
+)
+IMAGE_PROXY_CACHE_MAX_BYTES = int(
+    os.environ.get("IMAGE_PROXY_CACHE_MAX_BYTES", 512 * 1024 * 1024)
+)
+# Seconds to wait for a Cloudinary original to download
+IMAGE_PROXY_FETCH_TIMEOUT = 10
+# Retry-After of transforms refused while the image engine is busy
+IMAGE_PROXY_RETRY_AFTER = 5
+
+# =============================================================================
+# Page Cache
+# =============================================================================
+# Anonymous FeedView, TagPostsView and ProfileView pages are cached whole
+PAGE_CACHE_TIMEOUT = int(os.environ.get("PAGE_CACHE_TIMEOUT", "60"))
+# Profile post/follower counts, shared by all viewers
+PROFILE_COUNTS_TIMEOUT = 5 * 60
+
+# =============================================================================
+# Search
+# =============================================================================
+# Caption search (app.search) ranks at most this many of the newest
+# matches, and answers with at most MAX_RESULTS posts
+SEARCH_CANDIDATES = 10_000
+SEARCH_MAX_RESULTS = 50
+# User search (app.user_search) suggests at most this many users
+USER_SEARCH_MAX_RESULTS = 10
+# Hashtag autocomplete (app.tag_index) keeps all tag names in memory;
+# each process applies the tag changes of other processes at most this
+# often, in seconds, replaying up to MAX_CHANGES of them and rebuilding
+# otherwise, and at least every REBUILD_INTERVAL seconds
+TAG_INDEX_REFRESH_INTERVAL = 10
+TAG_INDEX_MAX_CHANGES = 1000
+TAG_INDEX_REBUILD_INTERVAL = 60 * 60
+
+# =============================================================================
+# Sessions and Identity Cache
+# =============================================================================
+# Sessions are read from the cache and written through to the database
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+# Lifetime of cached User+Profile snapshots used for request.user
+USER_CACHE_TIMEOUT = 60 * 60
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -355,6 +513,14 @@ TESTING = (
 )
 
 if not DEBUG and not TESTING:
+    if not REDIS_URL:
+        warnings.warn(
+            "REDIS_URL is not set: the file-based cache does not make "
+            "cache locks and counters atomic across workers",
+            RuntimeWarning,
+            stacklevel=1,
+        )
+
     # HTTPS settings
     SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
     SECURE_SSL_REDIRECT = (
@@ -388,6 +554,14 @@ if not DEBUG and not TESTING:
     SECURE_BROWSER_XSS_FILTER = True
     X_FRAME_OPTIONS = "DENY"
 
+if TESTING:
+    # Tests never share cache state with a running server
+    CACHES["shared"] = {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+    # Process images inline; engine tests start their own pools
+    IMAGE_ENGINE_WORKERS = 0
+
 
 # =============================================================================
 # Logging Configuration
@@ -1,7 +1,6 @@
 """URL configuration for DJGramm project."""
 
 from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
@@ -11,11 +10,7 @@ urlpatterns = [
     path("", include("app.urls")),
 ]
 
-# Serve media files in development
+# Media files are served by app.views.serve_media
 if settings.DEBUG:
-    urlpatterns += static(
-        settings.MEDIA_URL, document_root=settings.MEDIA_ROOT
-    )
-
     # Django Debug Toolbar URLs
     urlpatterns += [path("__debug__/", include("debug_toolbar.urls"))]
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
 application = get_wsgi_application()
+
+# Build the hashtag autocomplete index before the first keystroke needs it
+from app.tag_index import warm_tag_index  # noqa: E402
+
+warm_tag_index()
@@ -2,12 +2,41 @@
 
 from unittest.mock import patch
 
+import cloudinary
 import pytest
+from django.core.cache import cache
 from django.test import Client
 
 from app.models import Like, Post, PostImage, Tag, User
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Clear the cache so cached pages do not leak between tests."""
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def cloudinary_credentials(monkeypatch):
+    """Configure Cloudinary so URLs build without CLOUDINARY_* variables."""
+    config = cloudinary.config()
+    for name, value in [
+        ("cloud_name", "test_cloud"),
+        ("api_key", "test_key"),
+        ("api_secret", "test_secret"),
+    ]:
+        if not getattr(config, name, None):
+            monkeypatch.setattr(config, name, value, raising=False)
+
+
+@pytest.fixture(autouse=True)
+def media_root(settings, tmp_path):
+    """Keep files stored without Cloudinary out of the real MEDIA_ROOT."""
+    settings.MEDIA_ROOT = str(tmp_path / "media")
+
+
 @pytest.fixture
 def user(db):
     """Create a regular user."""
@@ -78,8 +107,9 @@ def post(db, user):
 
 
 @pytest.fixture
-def mock_cloudinary_upload():
+def mock_cloudinary_upload(settings):
     """Mock Cloudinary upload to prevent actual API calls in tests."""
+    settings.MEDIA_BACKEND = "cloudinary"
     import cloudinary.uploader
     from cloudinary.models import CloudinaryField
 
@@ -170,3 +200,20 @@ def profile(db, user):
     user.profile.bio = "Test bio"
     user.profile.save()
     return user.profile
+
+
+@pytest.fixture
+def local_media(settings, tmp_path):
+    """Switch media to local content-addressed storage."""
+    media_root = tmp_path / "media"
+    settings.MEDIA_BACKEND = "local"
+    settings.MEDIA_ROOT = str(media_root)
+    settings.MEDIA_ACCEL_REDIRECT = ""
+    settings.STORAGES = {
+        **settings.STORAGES,
+        "default": {
+            "BACKEND": "app.storage.ContentAddressedStorage",
+            "OPTIONS": {"location": str(media_root), "base_url": "/media/"},
+        },
+    }
+    return media_root
@@ -0,0 +1,486 @@
+"""Tests for DJGramm caching."""
+
+from unittest.mock import patch
+
+from django.contrib import messages
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+from django.urls import reverse
+
+from app import metrics
+from app.cache import (
+    attach_post_card_versions,
+    build_key,
+    bump_generation,
+    feed_scope,
+    get_cached_user,
+    get_following_ids,
+    get_generations,
+    get_or_compute,
+    get_profile_counts,
+    lock_key,
+    page_cache_key,
+    profile_scope,
+    tag_scope,
+)
+from app.models import Comment, Follow, Like, Post, PostImage
+from app.services import sync_post_tags
+from app.views import FeedView
+
+
+class TestGenerations:
+    """Tests for generation counters."""
+
+    def test_generation_is_stable(self):
+        """Test reading a generation twice returns the same value."""
+        assert get_generations(["a"]) == get_generations(["a"])
+
+    def test_bump_changes_generation(self):
+        """Test bumping a scope changes its generation only."""
+        before = get_generations(["a", "b"])
+        bump_generation("a")
+        after = get_generations(["a", "b"])
+        assert after[0] != before[0]
+        assert after[1] == before[1]
+
+    def test_bump_missing_generation(self):
+        """Test bumping a never-read scope does not fail."""
+        bump_generation("missing")
+        assert get_generations(["missing"])[0]
+
+
+class TestGetOrCompute:
+    """Tests for get_or_compute."""
+
+    def collapsed(self):
+        """Return number of recomputations served stale."""
+        return metrics.get_counter(
+            "cache_recomputations_total", namespace="t", result="collapsed"
+        )
+
+    def test_miss_then_hit(self):
+        """Test the value is computed once and then served from cache."""
+        calls = []
+        for _ in range(2):
+            value, status = get_or_compute(
+                "t:key", lambda: calls.append(1) or len(calls), 60
+            )
+        assert (value, status) == (1, "HIT")
+        assert len(calls) == 1
+
+    def test_version_change_recomputes(self):
+        """Test an entry with another version is recomputed."""
+        get_or_compute("t:key", lambda: "old", 60, version=1)
+        value, status = get_or_compute("t:key", lambda: "new", 60, version=2)
+        assert (value, status) == ("new", "MISS")
+
+    def expire(self, key):
+        """Make the entry at key due for recomputation."""
+        entry = cache.get(key)
+        entry["expires_at"] = 0
+        cache.set(key, entry)
+
+    def test_stale_served_while_locked(self):
+        """Test other workers get the previous value during recompute."""
+        get_or_compute("t:key", lambda: "old", 60, version=1)
+        self.expire("t:key")
+        before = self.collapsed()
+        cache.add(lock_key("t:key"), 1)
+        value, status = get_or_compute("t:key", lambda: "new", 60, version=1)
+        assert (value, status) == ("old", "STALE")
+        assert self.collapsed() == before + 1
+
+    def test_old_version_not_served_while_locked(self):
+        """Test an entry of an older version is never served stale."""
+        get_or_compute("t:key", lambda: "old", 60, version=1)
+        cache.add(lock_key("t:key"), 1)
+        value, status = get_or_compute("t:key", lambda: "new", 60, version=2)
+        assert (value, status) == ("new", "MISS")
+        assert cache.get("t:key")["value"] == "old"
+
+    def test_locked_without_entry_computes(self):
+        """Test a locked cold key is computed without being stored."""
+        cache.add(lock_key("t:key"), 1)
+        assert get_or_compute("t:key", lambda: "v", 60) == ("v", "MISS")
+        assert cache.get("t:key") is None
+
+    def test_lock_released(self):
+        """Test the lock is released after computing."""
+        get_or_compute("t:key", lambda: "v", 60)
+        assert cache.get(lock_key("t:key")) is None
+
+    def test_cache_if(self):
+        """Test values rejected by cache_if are not stored."""
+        get_or_compute("t:key", lambda: "v", 60, cache_if=lambda v: False)
+        assert cache.get("t:key") is None
+
+    def test_early_expiration(self):
+        """Test XFetch recomputes a slow value before its deadline."""
+        get_or_compute("t:key", lambda: "old", 60)
+        entry = cache.get("t:key")
+        entry["delta"] = 10.0
+        cache.set("t:key", entry)
+        # random() close to 1 draws a long exponential gap
+        with patch("app.cache.random.random", return_value=0.999999):
+            value, status = get_or_compute("t:key", lambda: "new", 60)
+        assert (value, status) == ("new", "MISS")
+
+
+class TestAnonymousPageCache:
+    """Tests for AnonymousPageCacheMixin."""
+
+    def test_feed_cached_for_anonymous(self, client, post):
+        """Test second anonymous feed request is served from cache."""
+        first = client.get(reverse("feed"))
+        second = client.get(reverse("feed"))
+        assert first["X-Page-Cache"] == "MISS"
+        assert second["X-Page-Cache"] == "HIT"
+        assert second.content == first.content
+
+    def test_cached_page_has_no_csrf_token(self, client, post):
+        """Test shared anonymous pages carry no visitor's CSRF token."""
+        response = client.get(reverse("feed"))
+        assert b'name="csrf-token"' not in response.content
+        assert "csrftoken" not in response.cookies
+
+    def test_page_with_csrf_token_not_stored(self, client, post):
+        """Test pages that rendered a CSRF token are never shared."""
+        original = FeedView.get_context_data
+
+        def with_token(view, **kwargs):
+            get_token(view.request)
+            return original(view, **kwargs)
+
+        with patch.object(FeedView, "get_context_data", with_token):
+            client.get(reverse("feed"))
+            response = client.get(reverse("feed"))
+        assert response["X-Page-Cache"] == "MISS"
+
+    def test_cache_hit_skips_database(
+        self, client, post, django_assert_num_queries
+    ):
+        """Test cached page is served without queries."""
+        client.get(reverse("feed"))
+        with django_assert_num_queries(0):
+            response = client.get(reverse("feed"))
+        assert response.status_code == 200
+
+    def test_pages_cached_separately(self, client, user):
+        """Test each page number gets its own entry."""
+        for i in range(15):
+            Post.objects.create(author=user, caption=f"Post {i}")
+        client.get(reverse("feed"))
+        response = client.get(reverse("feed") + "?page=2")
+        assert response["X-Page-Cache"] == "MISS"
+        assert "Post 0" in response.content.decode()
+
+    def test_other_query_params_ignored(self, client, post):
+        """Test unrelated query parameters do not bypass the cache."""
+        client.get(reverse("feed"))
+        response = client.get(reverse("feed") + "?utm=x")
+        assert response["X-Page-Cache"] == "HIT"
+
+    def test_authenticated_not_cached(self, authenticated_client, post):
+        """Test authenticated users always get fresh pages."""
+        authenticated_client.get(reverse("feed"))
+        response = authenticated_client.get(reverse("feed"))
+        assert "X-Page-Cache" not in response
+
+    def test_new_post_invalidates_feed(self, client, user, post):
+        """Test creating a post invalidates the cached feed."""
+        client.get(reverse("feed"))
+        Post.objects.create(author=user, caption="Fresh caption")
+        response = client.get(reverse("feed"))
+        assert response["X-Page-Cache"] == "MISS"
+        assert "Fresh caption" in response.content.decode()
+
+    def test_like_invalidates_feed_and_profile(self, client, post, user2):
+        """Test liking a post invalidates feed and author profile."""
+        profile_url = reverse(
+            "profile", kwargs={"username": post.author.username}
+        )
+        client.get(reverse("feed"))
+        client.get(profile_url)
+        Like.objects.create(user=user2, post=post)
+        assert client.get(reverse("feed"))["X-Page-Cache"] == "MISS"
+        assert client.get(profile_url)["X-Page-Cache"] == "MISS"
+
+    def test_comment_invalidates_feed(self, client, post, user2):
+        """Test commenting invalidates the feed."""
+        client.get(reverse("feed"))
+        Comment.objects.create(author=user2, post=post, text="Nice")
+        assert client.get(reverse("feed"))["X-Page-Cache"] == "MISS"
+
+    def test_follow_invalidates_profiles(self, client, user, user2):
+        """Test following invalidates both profiles."""
+        urls = [
+            reverse("profile", kwargs={"username": u.username})
+            for u in (user, user2)
+        ]
+        for url in urls:
+            client.get(url)
+        Follow.objects.create(follower=user, following=user2)
+        for url in urls:
+            assert client.get(url)["X-Page-Cache"] == "MISS"
+
+    def test_following_add_invalidates_profile(self, client, user, user2):
+        """Test user.following.add invalidates the followed profile."""
+        url = reverse("profile", kwargs={"username": user2.username})
+        client.get(url)
+        user.following.add(user2)
+        response = client.get(url)
+        assert response["X-Page-Cache"] == "MISS"
+        assert response.context["followers_count"] == 1
+
+    def test_tagging_invalidates_tag_page(self, client, post, tag):
+        """Test adding a tag to a post invalidates the tag page."""
+        url = reverse("tag_posts", kwargs={"slug": tag.slug})
+        client.get(url)
+        sync_post_tags(post, "#testtag")
+        response = client.get(url)
+        assert response["X-Page-Cache"] == "MISS"
+        assert len(response.context["posts"]) == 1
+
+    def test_unrelated_tag_stays_cached(self, client, post, tags):
+        """Test tagging a post leaves other tag pages cached."""
+        url = reverse("tag_posts", kwargs={"slug": tags[1].slug})
+        client.get(url)
+        sync_post_tags(post, "#tag0")
+        assert client.get(url)["X-Page-Cache"] == "HIT"
+
+    def test_stale_page_served_while_locked(self, client, rf, post):
+        """Test an expired page is served while another worker renders."""
+        url = reverse("feed")
+        client.get(url)
+        key = page_cache_key(rf.get(url))
+        entry = cache.get(key)
+        entry["expires_at"] = 0
+        cache.set(key, entry)
+        cache.add(lock_key(key), 1)
+        response = client.get(url)
+        assert response["X-Page-Cache"] == "STALE"
+
+    def test_changed_page_rendered_while_locked(self, client, rf, post):
+        """Test a page whose data changed is not served stale."""
+        url = reverse("feed")
+        client.get(url)
+        key = page_cache_key(rf.get(url))
+        cache.add(lock_key(key), 1)
+        post.caption = "Edited while another worker renders"
+        post.save()
+        response = client.get(url)
+        assert response["X-Page-Cache"] == "MISS"
+        assert b"Edited while another worker renders" in response.content
+
+    def test_messages_disable_cache(self, rf):
+        """Test pages with pending messages are not served from cache."""
+        request = rf.get(reverse("feed"))
+        request.user = AnonymousUser()
+        request._messages = CookieStorage(request)
+        view = FeedView()
+        assert view.page_cache_allowed(request) is True
+
+        messages.info(request, "Bye")
+        assert view.page_cache_allowed(request) is False
+
+
+class TestPostCardFragments:
+    """Tests for the post card fragment cache."""
+
+    def get_version(self, post):
+        """Return current card version of post."""
+        post = Post.objects.get(pk=post.pk)
+        attach_post_card_versions([post])
+        return post.cache_version
+
+    def test_version_is_stable(self, post):
+        """Test version does not change without writes."""
+        assert self.get_version(post) == self.get_version(post)
+
+    def test_like_bumps_version(self, post, user2):
+        """Test liking a post bumps its version."""
+        before = self.get_version(post)
+        Like.objects.create(user=user2, post=post)
+        assert self.get_version(post) != before
+
+    def test_comment_bumps_version(self, post, user2):
+        """Test commenting bumps the post version."""
+        before = self.get_version(post)
+        Comment.objects.create(author=user2, post=post, text="Nice")
+        assert self.get_version(post) != before
+
+    def test_profile_edit_bumps_version(self, post):
+        """Test editing the author's profile bumps the post version."""
+        before = self.get_version(post)
+        post.author.profile.full_name = "New Name"
+        post.author.profile.save()
+        assert self.get_version(post) != before
+
+    def test_reorder_bumps_version(self, authenticated_client, post):
+        """Test reordering images bumps the post version."""
+        first = PostImage.objects.create(post=post, image="p/1", order=0)
+        second = PostImage.objects.create(post=post, image="p/2", order=1)
+        before = self.get_version(post)
+        authenticated_client.post(
+            reverse("reorder_images", kwargs={"pk": post.pk}),
+            data={"order": [second.pk, first.pk]},
+            content_type="application/json",
+        )
+        assert self.get_version(post) != before
+
+    def test_card_shared_between_users(
+        self, authenticated_client, client, post, user2
+    ):
+        """Test a card rendered for one user is reused for another."""
+        authenticated_client.get(reverse("feed"))
+        # Queryset updates send no signals, so the cached card survives
+        Post.objects.filter(pk=post.pk).update(caption="Changed")
+        client.force_login(user2)
+        response = client.get(reverse("feed"))
+        content = response.content.decode()
+        assert "Test post caption" in content
+        assert "Changed" not in content
+
+    def test_viewer_state_in_context(self, authenticated_client, user, post):
+        """Test viewer like and follow state is rendered separately."""
+        Like.objects.create(user=user, post=post)
+        response = authenticated_client.get(reverse("feed"))
+        state = response.context["viewer_state"]
+        assert state["user_id"] == user.pk
+        assert state["liked_post_ids"] == [post.pk]
+        assert 'id="viewer-state"' in response.content.decode()
+
+
+class TestCachedUser:
+    """Tests for the cached request.user."""
+
+    def make_request(self, rf, client):
+        """Build a request carrying the client's session."""
+        request = rf.get("/")
+        request.session = client.session
+        return request
+
+    def test_anonymous(self, rf, client, db):
+        """Test requests without a session resolve to AnonymousUser."""
+        request = self.make_request(rf, client)
+        assert get_cached_user(request).is_authenticated is False
+
+    def test_snapshot_skips_database(
+        self, rf, authenticated_client, user, django_assert_num_queries
+    ):
+        """Test a warm snapshot resolves user and profile with no queries."""
+        get_cached_user(self.make_request(rf, authenticated_client))
+        with django_assert_num_queries(0):
+            request = self.make_request(rf, authenticated_client)
+            cached = get_cached_user(request)
+            assert cached.pk == user.pk
+            assert cached.profile.user_id == user.pk
+
+    def test_profile_edit_refreshes_snapshot(
+        self, rf, authenticated_client, user
+    ):
+        """Test editing the profile replaces the snapshot."""
+        get_cached_user(self.make_request(rf, authenticated_client))
+        user.profile.full_name = "Renamed"
+        user.profile.save()
+        cached = get_cached_user(self.make_request(rf, authenticated_client))
+        assert cached.profile.full_name == "Renamed"
+
+    def test_news_feed_visit_refreshes_snapshot(
+        self, rf, authenticated_client, user
+    ):
+        """Test the feed visit timestamp is not served stale."""
+        get_cached_user(self.make_request(rf, authenticated_client))
+        authenticated_client.get(reverse("news_feed"))
+        cached = get_cached_user(self.make_request(rf, authenticated_client))
+        assert cached.profile.last_news_feed_visit is not None
+
+    def test_password_change_logs_out(self, rf, authenticated_client, user):
+        """Test changing the password invalidates other sessions."""
+        get_cached_user(self.make_request(rf, authenticated_client))
+        user.set_password("newpass123")
+        user.save()
+        cached = get_cached_user(self.make_request(rf, authenticated_client))
+        assert cached.is_authenticated is False
+
+    def test_deleted_user_logged_out(self, rf, authenticated_client, user):
+        """Test a deleted user is no longer resolved from the cache."""
+        get_cached_user(self.make_request(rf, authenticated_client))
+        user.delete()
+        cached = get_cached_user(self.make_request(rf, authenticated_client))
+        assert cached.is_authenticated is False
+
+    def test_middleware_uses_snapshot(self, authenticated_client, user):
+        """Test views get request.user from the snapshot."""
+        authenticated_client.get(reverse("profile_edit"))
+        response = authenticated_client.get(reverse("profile_edit"))
+        assert response.status_code == 200
+        assert response.wsgi_request.user.pk == user.pk
+
+
+class TestScopes:
+    """Tests for scope names."""
+
+    def test_scope_names_are_distinct(self):
+        """Test scope builders namespace their values."""
+        assert len({feed_scope(), tag_scope("x"), profile_scope("x")}) == 3
+
+    def test_build_key_puts_namespace_first(self):
+        """Test keys start with their namespace."""
+        assert build_key("post", 42, "card") == "post:42:card"
+
+
+class TestProfileCounts:
+    """Tests for the shared profile counts."""
+
+    def test_counts(self, user, user2, post):
+        """Test counts of posts, followers and following."""
+        Follow.objects.create(follower=user2, following=user)
+        assert get_profile_counts(user) == {
+            "posts_count": 1,
+            "followers_count": 1,
+            "following_count": 0,
+        }
+
+    def test_cached(self, user, django_assert_max_num_queries):
+        """Test warm counts are read without counting queries."""
+        get_profile_counts(user)
+        with django_assert_max_num_queries(0):
+            get_profile_counts(user)
+
+    def test_follow_invalidates(self, user, user2):
+        """Test a new follower refreshes the counts."""
+        get_profile_counts(user)
+        Follow.objects.create(follower=user2, following=user)
+        assert get_profile_counts(user)["followers_count"] == 1
+
+
+class TestFollowGraph:
+    """Tests for the cached follow graph."""
+
+    def test_following_ids(self, user, user2):
+        """Test followed users are returned."""
+        Follow.objects.create(follower=user, following=user2)
+        assert get_following_ids(user) == {user2.pk}
+
+    def test_cached(self, user, user2, django_assert_num_queries):
+        """Test a warm follow graph is read without queries."""
+        get_following_ids(user)
+        with django_assert_num_queries(0):
+            get_following_ids(user)
+
+    def test_follow_invalidates(self, user, user2):
+        """Test following and unfollowing refresh the graph."""
+        assert get_following_ids(user) == set()
+        follow = Follow.objects.create(follower=user, following=user2)
+        assert get_following_ids(user) == {user2.pk}
+        follow.delete()
+        assert get_following_ids(user) == set()
+
+    def test_following_add_invalidates(self, user, user2):
+        """Test user.following.add refreshes the graph."""
+        get_following_ids(user)
+        user.following.add(user2)
+        assert get_following_ids(user) == {user2.pk}
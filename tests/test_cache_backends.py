@@ -0,0 +1,164 @@
+"""Tests for DJGramm cache backends and metrics."""
+
+from unittest.mock import patch
+
+import pytest
+from django.core.cache import caches
+from django.urls import reverse
+
+from app import metrics
+from app.cache_backends import LocalLRU, TwoTierCache
+
+
+@pytest.fixture
+def two_tier():
+    """Two-tier cache in front of the test shared cache."""
+    return TwoTierCache(
+        "",
+        {"OPTIONS": {"LOCAL_MAX_ENTRIES": 2, "BYPASS_PREFIXES": ("gen:",)}},
+    )
+
+
+class TestLocalLRU:
+    """Tests for the in-process LRU."""
+
+    def test_get_set(self):
+        """Test stored values are returned."""
+        lru = LocalLRU()
+        lru.set("a", [1], timeout=10)
+        assert lru.get("a") == [1]
+
+    def test_values_are_copies(self):
+        """Test callers cannot mutate cached values."""
+        lru = LocalLRU()
+        lru.set("a", [1], timeout=10)
+        lru.get("a").append(2)
+        assert lru.get("a") == [1]
+
+    def test_evicts_least_recently_used(self):
+        """Test the oldest unused entry is evicted first."""
+        lru = LocalLRU(max_entries=2)
+        lru.set("a", 1, timeout=10)
+        lru.set("b", 2, timeout=10)
+        lru.get("a")
+        lru.set("c", 3, timeout=10)
+        assert lru.get("a") == 1
+        assert lru.get("b") is None
+
+    def test_expiry(self):
+        """Test expired entries are not returned."""
+        lru = LocalLRU()
+        with patch("app.cache_backends.time.monotonic", return_value=0):
+            lru.set("a", 1, timeout=5)
+        with patch("app.cache_backends.time.monotonic", return_value=6):
+            assert lru.get("a") is None
+        assert len(lru) == 0
+
+
+class TestTwoTierCache:
+    """Tests for TwoTierCache."""
+
+    def test_set_writes_both_tiers(self, two_tier):
+        """Test values are stored locally and in the shared cache."""
+        two_tier.set("post:1", "card")
+        assert caches["shared"].get("post:1") == "card"
+        assert two_tier.local.get(two_tier.make_key("post:1")) == "card"
+
+    def test_local_hit_skips_shared(self, two_tier):
+        """Test a local hit does not read the shared cache."""
+        two_tier.set("post:1", "card")
+        caches["shared"].delete("post:1")
+        assert two_tier.get("post:1") == "card"
+
+    def test_shared_hit_fills_local(self, two_tier):
+        """Test values found in the shared cache are kept locally."""
+        caches["shared"].set("post:1", "card")
+        assert two_tier.get("post:1") == "card"
+        caches["shared"].delete("post:1")
+        assert two_tier.get("post:1") == "card"
+
+    def test_bypass_prefixes(self, two_tier):
+        """Test generation counters are always read from the shared cache."""
+        two_tier.set("gen:feed", 1)
+        caches["shared"].set("gen:feed", 2)
+        assert two_tier.get("gen:feed") == 2
+
+    def test_get_many(self, two_tier):
+        """Test get_many combines both tiers."""
+        two_tier.set("post:1", "a")
+        caches["shared"].set("post:2", "b")
+        assert two_tier.get_many(["post:1", "post:2", "post:3"]) == {
+            "post:1": "a",
+            "post:2": "b",
+        }
+
+    def test_incr(self, two_tier):
+        """Test incr is atomic in the shared cache."""
+        two_tier.set("gen:feed", 1)
+        assert two_tier.incr("gen:feed") == 2
+        with pytest.raises(ValueError):
+            two_tier.incr("gen:missing")
+
+    def test_add(self, two_tier):
+        """Test add only succeeds for missing keys."""
+        assert two_tier.add("lock:x", 1) is True
+        assert two_tier.add("lock:x", 1) is False
+
+    def test_delete(self, two_tier):
+        """Test delete removes the key from both tiers."""
+        two_tier.set("post:1", "card")
+        two_tier.delete("post:1")
+        assert two_tier.get("post:1") is None
+        assert caches["shared"].get("post:1") is None
+
+    def test_clear(self, two_tier):
+        """Test clear empties both tiers."""
+        two_tier.set("post:1", "card")
+        two_tier.clear()
+        assert len(two_tier.local) == 0
+        assert caches["shared"].get("post:1") is None
+
+    def test_metrics(self, two_tier):
+        """Test lookups are counted per namespace and tier."""
+
+        def count(result):
+            return metrics.get_counter(
+                "cache_requests_total", namespace="post", result=result
+            )
+
+        before = {r: count(r) for r in ("local_hit", "shared_hit", "miss")}
+        two_tier.get("post:1")
+        caches["shared"].set("post:1", "card")
+        two_tier.get("post:1")
+        two_tier.get("post:1")
+        assert count("miss") == before["miss"] + 1
+        assert count("shared_hit") == before["shared_hit"] + 1
+        assert count("local_hit") == before["local_hit"] + 1
+
+    def test_default_cache_is_two_tier(self):
+        """Test the project cache is configured as TwoTierCache."""
+        assert isinstance(caches["default"], TwoTierCache)
+
+
+class TestMetrics:
+    """Tests for the metrics module."""
+
+    def test_render_prometheus(self):
+        """Test counters are rendered with labels and pid."""
+        metrics.increment("test_total", namespace="post")
+        output = metrics.render_prometheus()
+        assert 'test_total{namespace="post",pid="' in output
+
+    def test_metrics_view_requires_staff(self, authenticated_client):
+        """Test regular users cannot read metrics."""
+        response = authenticated_client.get(reverse("metrics"))
+        assert response.status_code == 302
+
+    def test_metrics_view(self, client, user):
+        """Test staff can read metrics."""
+        user.is_staff = True
+        user.save()
+        client.force_login(user)
+        response = client.get(reverse("metrics"))
+        assert response.status_code == 200
+        assert response["Content-Type"].startswith("text/plain")
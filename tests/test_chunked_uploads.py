@@ -0,0 +1,297 @@
+"""Tests for resumable chunked uploads."""
+
+import base64
+import errno
+import json
+import os
+import random
+from io import BytesIO
+
+import pytest
+from django.urls import reverse
+from PIL import Image
+
+from app import chunked_uploads
+from app.chunked_uploads import copy_range, parse_metadata
+from app.direct_uploads import issue_ticket
+from app.models import Post
+
+CHUNK = "application/offset+octet-stream"
+
+
+def noisy_jpeg():
+    """Return a JPEG of a few kilobytes."""
+    rng = random.Random(4)
+    img = Image.frombytes(
+        "RGB", (48, 48), bytes(rng.randrange(256) for _ in range(48 * 48 * 3))
+    )
+    buffer = BytesIO()
+    img.save(buffer, "JPEG", quality=95)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def upload_dir(settings, tmp_path, local_media):
+    """Keep chunked uploads in a temporary directory."""
+    settings.CHUNKED_UPLOAD_DIR = tmp_path / "uploads"
+    settings.IMAGE_MAX_DIMENSION = 24
+    return settings.CHUNKED_UPLOAD_DIR
+
+
+class TestHelpers:
+    """Tests for metadata parsing and copying."""
+
+    def test_parse_metadata(self):
+        """Test that tus metadata values are base64-decoded."""
+        header = (
+            "filename "
+            + base64.b64encode(b"photo.jpg").decode()
+            + ",filetype "
+            + base64.b64encode(b"image/jpeg").decode()
+            + ",broken !!!,empty"
+        )
+        assert parse_metadata(header) == {
+            "filename": "photo.jpg",
+            "filetype": "image/jpeg",
+            "empty": "",
+        }
+
+    def copy(self, tmp_path, data, count):
+        src = tmp_path / "src"
+        src.write_bytes(data)
+        dst = tmp_path / "dst"
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            copy_range(s.fileno(), d.fileno(), count)
+        return dst.read_bytes()
+
+    def test_copy_range(self, tmp_path):
+        """Test that count bytes are copied."""
+        data = os.urandom(300_000)
+        assert self.copy(tmp_path, data, 200_000) == data[:200_000]
+
+    def test_copy_range_falls_back(self, tmp_path, monkeypatch):
+        """Test that unsupported copy_file_range() falls back."""
+
+        def unsupported(*args):
+            raise OSError(errno.EXDEV, "cross-device")
+
+        monkeypatch.setattr(os, "copy_file_range", unsupported, raising=False)
+        data = os.urandom(100_000)
+        assert self.copy(tmp_path, data, len(data)) == data
+
+    def test_copy_range_all_methods_fail(self, tmp_path, monkeypatch):
+        """Test that copying raises when no method can copy."""
+
+        def unsupported(*args):
+            raise OSError(errno.EINVAL, "invalid argument")
+
+        monkeypatch.setattr(
+            chunked_uploads, "_copy_methods", lambda: [unsupported] * 3
+        )
+        with pytest.raises(OSError, match="Copied 0 of 3 bytes"):
+            self.copy(tmp_path, b"abc", 3)
+
+    def test_copy_range_short_source(self, tmp_path):
+        """Test that a source shorter than count is an error."""
+        with pytest.raises(EOFError):
+            self.copy(tmp_path, b"abc", 10)
+
+
+@pytest.mark.django_db
+class TestChunkedUploadAPI:
+    """Tests for the tus-style endpoints."""
+
+    @pytest.fixture
+    def image(self):
+        return noisy_jpeg()
+
+    def create(self, client, user, length, filetype="image/jpeg"):
+        """Start an upload, returning its URL."""
+        response = client.post(
+            reverse("chunked_uploads"),
+            headers={
+                "Upload-Length": str(length),
+                "Upload-Metadata": "filetype "
+                + base64.b64encode(filetype.encode()).decode(),
+                "X-Upload-Ticket": issue_ticket(user)["ticket"],
+            },
+        )
+        assert response.status_code == 201
+        assert response["Location"] == response.json()["url"]
+        return response["Location"]
+
+    def patch(self, client, url, offset, data):
+        """Send a chunk."""
+        return client.patch(
+            url,
+            data,
+            content_type=CHUNK,
+            headers={"Upload-Offset": str(offset)},
+        )
+
+    def offset(self, client, url):
+        response = client.head(url)
+        assert response.status_code == 200
+        return int(response["Upload-Offset"])
+
+    def test_in_order(self, authenticated_client, user, upload_dir, image):
+        """Test that chunks in order complete into a claimable image."""
+        url = self.create(authenticated_client, user, len(image))
+        size = len(image) // 3 + 1
+        for start in range(0, len(image), size):
+            response = self.patch(
+                authenticated_client, url, start, image[start : start + size]
+            )
+            assert response.status_code == 200
+        body = response.json()
+        assert body["offset"] == len(image)
+        assert body["receipt"]
+
+        response = authenticated_client.post(
+            reverse("post_create"),
+            {
+                "caption": "Resumed",
+                "images-TOTAL_FORMS": "0",
+                "images-INITIAL_FORMS": "0",
+                "uploads": [json.dumps({"receipt": body["receipt"]})],
+            },
+        )
+        assert response.status_code == 302
+        stored = Post.objects.get(author=user).images.get()
+        assert (stored.width, stored.height) == (24, 24)
+
+    def test_reordered_chunks(
+        self, authenticated_client, user, upload_dir, image
+    ):
+        """Test that chunks may arrive in any order."""
+        url = self.create(authenticated_client, user, len(image))
+        size = len(image) // 4 + 1
+        starts = list(range(0, len(image), size))
+        for start in reversed(starts[1:]):
+            response = self.patch(
+                authenticated_client, url, start, image[start : start + size]
+            )
+            assert response.json() == {"offset": 0, "receipt": None}
+        response = self.patch(authenticated_client, url, 0, image[:size])
+        assert response.json()["receipt"]
+
+    def test_truncated_chunk_resumes(
+        self, authenticated_client, user, upload_dir, image
+    ):
+        """Test that a cut-off chunk keeps its bytes and resumes."""
+        url = self.create(authenticated_client, user, len(image))
+        half = len(image) // 2
+        # Only part of the first half arrives
+        response = self.patch(authenticated_client, url, 0, image[:1000])
+        assert response.json()["offset"] == 1000
+        assert self.offset(authenticated_client, url) == 1000
+
+        # Retrying the lost chunk from its start conflicts
+        response = self.patch(authenticated_client, url, 0, image[:half])
+        assert response.status_code == 409
+        assert response["Upload-Offset"] == "1000"
+
+        response = self.patch(authenticated_client, url, 1000, image[1000:])
+        assert response.json()["receipt"]
+
+    def test_truncated_upload_not_processed(
+        self, authenticated_client, user, upload_dir, image
+    ):
+        """Test that an upload missing its end is never processed."""
+        url = self.create(authenticated_client, user, len(image))
+        response = self.patch(authenticated_client, url, 0, image[:-10])
+        assert response.json() == {
+            "offset": len(image) - 10,
+            "receipt": None,
+        }
+
+    def test_chunk_past_length(
+        self, authenticated_client, user, upload_dir, image
+    ):
+        """Test that chunks may not overrun the length or other parts."""
+        url = self.create(authenticated_client, user, len(image))
+        response = self.patch(authenticated_client, url, 0, image + b"extra")
+        assert response.status_code == 409
+
+        self.patch(authenticated_client, url, 2000, image[2000:3000])
+        response = self.patch(authenticated_client, url, 0, image[:2500])
+        assert response.status_code == 409
+        assert self.offset(authenticated_client, url) == 0
+
+    def test_retried_last_chunk(
+        self, authenticated_client, user, upload_dir, image
+    ):
+        """Test that a lost final response can be fetched again."""
+        url = self.create(authenticated_client, user, len(image))
+        receipt = self.patch(authenticated_client, url, 0, image).json()[
+            "receipt"
+        ]
+        response = self.patch(authenticated_client, url, len(image), b"")
+        assert response.json()["receipt"] == receipt
+        assert not [
+            name
+            for name in os.listdir(upload_dir / url.split("/")[-2])
+            if name.isdigit()
+        ]
+
+    def test_invalid_image(self, authenticated_client, user, upload_dir):
+        """Test that invalid content is rejected and discarded."""
+        url = self.create(authenticated_client, user, 100)
+        response = self.patch(authenticated_client, url, 0, b"x" * 100)
+        assert response.status_code == 400
+        assert authenticated_client.head(url).status_code == 404
+
+    def test_other_users_upload(
+        self, authenticated_client, client, user2, user, upload_dir, image
+    ):
+        """Test that uploads are private to their user."""
+        url = self.create(authenticated_client, user, len(image))
+        client.force_login(user2)
+        assert client.head(url).status_code == 404
+        assert self.patch(client, url, 0, image).status_code == 404
+
+    def test_create_checks(self, authenticated_client, user2, upload_dir):
+        """Test that length and ticket are checked."""
+        url = reverse("chunked_uploads")
+        response = authenticated_client.post(
+            url, headers={"Upload-Length": str(11 * 1024 * 1024)}
+        )
+        assert response.status_code == 413
+        response = authenticated_client.post(
+            url,
+            headers={
+                "Upload-Length": "100",
+                "X-Upload-Ticket": issue_ticket(user2)["ticket"],
+            },
+        )
+        assert response.status_code == 400
+
+    def test_chunk_content_type(
+        self, authenticated_client, user, upload_dir, image
+    ):
+        """Test that chunks must be sent as offset octet streams."""
+        url = self.create(authenticated_client, user, len(image))
+        response = authenticated_client.patch(
+            url,
+            image,
+            content_type="image/jpeg",
+            headers={"Upload-Offset": "0"},
+        )
+        assert response.status_code == 415
+
+    def test_delete(self, authenticated_client, user, upload_dir, image):
+        """Test that an upload can be cancelled."""
+        url = self.create(authenticated_client, user, len(image))
+        assert authenticated_client.delete(url).status_code == 204
+        assert authenticated_client.head(url).status_code == 404
+
+    def test_purge_inactive(
+        self, authenticated_client, user, upload_dir, image
+    ):
+        """Test that inactive uploads are removed."""
+        url = self.create(authenticated_client, user, len(image))
+        directory = upload_dir / url.split("/")[-2]
+        assert chunked_uploads.purge_expired_uploads() == 0
+        os.utime(directory, (0, 0))
+        assert chunked_uploads.purge_expired_uploads() == 1
+        assert not directory.exists()
@@ -0,0 +1,251 @@
+"""Tests for direct uploads of post images."""
+
+import json
+from io import BytesIO
+
+import cloudinary.utils
+import pytest
+from django.urls import reverse
+from PIL import Image
+
+from app.direct_uploads import claim_uploads, issue_ticket
+from app.models import Post
+from app.storage import media_key, parse_content_key
+
+
+def jpeg_bytes(size=(40, 30)):
+    """Return an encoded JPEG."""
+    buffer = BytesIO()
+    Image.new("RGB", size, color="blue").save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def cloudinary_result(slot, **overrides):
+    """Return what Cloudinary answers to an upload with slot."""
+    public_id = slot["fields"]["public_id"]
+    result = {
+        "public_id": public_id,
+        "version": 1700000000,
+        "format": "jpg",
+        "width": 1080,
+        "height": 720,
+        "signature": cloudinary.utils.api_sign_request(
+            {"public_id": public_id, "version": 1700000000},
+            cloudinary.config().api_secret,
+            signature_version=1,
+        ),
+        "ticket": slot["ticket"],
+    }
+    result.update(overrides)
+    return json.dumps(result)
+
+
+def post_form(uploads, caption="Direct #upload"):
+    """Return post form data submitting direct upload results."""
+    return {
+        "caption": caption,
+        "images-TOTAL_FORMS": "0",
+        "images-INITIAL_FORMS": "0",
+        "images-MIN_NUM_FORMS": "0",
+        "images-MAX_NUM_FORMS": "10",
+        "uploads": uploads,
+    }
+
+
+@pytest.mark.django_db
+class TestTickets:
+    """Tests for the ticket endpoint."""
+
+    def url(self):
+        return reverse("upload_tickets")
+
+    def test_requires_login(self, client):
+        """Test that anonymous users get no tickets."""
+        response = client.post(
+            self.url(), {"count": 1}, content_type="application/json"
+        )
+        assert response.status_code == 302
+
+    def test_local_tickets(self, authenticated_client, local_media):
+        """Test that local tickets point at the upload endpoint."""
+        response = authenticated_client.post(
+            self.url(), {"count": 3}, content_type="application/json"
+        )
+        uploads = response.json()["uploads"]
+        assert len(uploads) == 3
+        assert {slot["url"] for slot in uploads} == {reverse("direct_upload")}
+        assert len({slot["ticket"] for slot in uploads}) == 3
+
+    def test_cloudinary_tickets(self, authenticated_client, settings):
+        """Test that Cloudinary tickets carry signed upload parameters."""
+        settings.MEDIA_BACKEND = "cloudinary"
+        response = authenticated_client.post(
+            self.url(), {"count": 1}, content_type="application/json"
+        )
+        slot = response.json()["uploads"][0]
+        fields = slot["fields"]
+        assert slot["url"].endswith("/image/upload")
+        assert fields["public_id"].startswith("posts/")
+        assert fields["transformation"] == "c_limit,h_1080,w_1080"
+        assert fields["allowed_formats"] == "jpg,png,webp"
+
+        unsigned = {
+            k: v
+            for k, v in fields.items()
+            if k not in ("signature", "api_key")
+        }
+        assert fields["signature"] == cloudinary.utils.api_sign_request(
+            unsigned, cloudinary.config().api_secret
+        )
+
+    @pytest.mark.parametrize("count", [0, 11, "x"])
+    def test_invalid_count(self, authenticated_client, count):
+        """Test that counts outside the formset limit are refused."""
+        response = authenticated_client.post(
+            self.url(), {"count": count}, content_type="application/json"
+        )
+        assert response.status_code == 400
+
+
+@pytest.mark.django_db
+class TestLocalUpload:
+    """Tests for the local upload endpoint."""
+
+    def upload(self, client, ticket, data, content_type="image/jpeg"):
+        return client.post(
+            reverse("direct_upload"),
+            data,
+            content_type=content_type,
+            headers={"X-Upload-Ticket": ticket},
+        )
+
+    def test_upload_and_claim(
+        self, authenticated_client, user, local_media, settings
+    ):
+        """Test that an uploaded image is processed and claimed."""
+        settings.IMAGE_MAX_DIMENSION = 20
+        ticket = issue_ticket(user)["ticket"]
+        response = self.upload(authenticated_client, ticket, jpeg_bytes())
+        assert response.status_code == 200
+        receipt = response.json()["receipt"]
+
+        response = authenticated_client.post(
+            reverse("post_create"),
+            post_form([json.dumps({"receipt": receipt})]),
+        )
+        assert response.status_code == 302
+        image = Post.objects.get(author=user).images.get()
+        key = media_key(image.image)
+        assert parse_content_key(key)
+        assert (local_media / key).exists()
+        assert (image.width, image.height) == (20, 15)
+        assert image.placeholder.startswith("data:image/")
+        assert image.phash is not None
+
+    def test_invalid_image(self, authenticated_client, user, local_media):
+        """Test that non-images are rejected."""
+        ticket = issue_ticket(user)["ticket"]
+        response = self.upload(authenticated_client, ticket, b"not an image")
+        assert response.status_code == 400
+        assert not list(local_media.glob("*/*/*"))
+
+    def test_disallowed_type(self, authenticated_client, user, local_media):
+        """Test that types other than JPEG, PNG and WebP are rejected."""
+        ticket = issue_ticket(user)["ticket"]
+        response = self.upload(
+            authenticated_client, ticket, jpeg_bytes(), "image/gif"
+        )
+        assert response.status_code == 400
+        assert "Invalid image type" in response.json()["error"]
+
+    def test_ticket_of_other_user(
+        self, authenticated_client, user2, local_media
+    ):
+        """Test that tickets cannot be shared between users."""
+        ticket = issue_ticket(user2)["ticket"]
+        response = self.upload(authenticated_client, ticket, jpeg_bytes())
+        assert response.status_code == 400
+        assert "another user" in response.json()["error"]
+
+    def test_expired_ticket(
+        self, authenticated_client, user, local_media, settings
+    ):
+        """Test that tickets expire."""
+        settings.DIRECT_UPLOAD_TICKET_TTL = -1
+        ticket = issue_ticket(user)["ticket"]
+        response = self.upload(authenticated_client, ticket, jpeg_bytes())
+        assert response.status_code == 400
+
+    def test_too_large(self, authenticated_client, user, local_media):
+        """Test that oversized bodies are refused before reading them."""
+        ticket = issue_ticket(user)["ticket"]
+        response = self.upload(
+            authenticated_client, ticket, b"x" * (10 * 1024 * 1024 + 1)
+        )
+        assert response.status_code == 413
+
+
+@pytest.mark.django_db
+class TestClaims:
+    """Tests for claiming upload results."""
+
+    @pytest.fixture
+    def slot(self, settings, user):
+        """Issue a Cloudinary ticket to user."""
+        settings.MEDIA_BACKEND = "cloudinary"
+        return issue_ticket(user)
+
+    def test_cloudinary_result(self, authenticated_client, user, slot):
+        """Test that signed Cloudinary results become post images."""
+        response = authenticated_client.post(
+            reverse("post_create"), post_form([cloudinary_result(slot)])
+        )
+        assert response.status_code == 302
+        image = Post.objects.get(author=user).images.get()
+        public_id = slot["fields"]["public_id"]
+        assert image.image.public_id == public_id
+        assert image.image.version == "1700000000"
+        assert (image.width, image.height) == (1080, 720)
+
+    @pytest.mark.parametrize(
+        "overrides",
+        [
+            {"signature": "forged"},
+            {"public_id": "posts/someone-else"},
+            {"ticket": "forged"},
+            {"format": "jpg/../x"},
+        ],
+    )
+    def test_tampered_result(self, user, slot, overrides):
+        """Test that results not matching their ticket are rejected."""
+        images, errors = claim_uploads(
+            user, [cloudinary_result(slot, **overrides)]
+        )
+        assert images == []
+        assert len(errors) == 1
+
+    def test_result_of_other_user(self, user2, slot):
+        """Test that results are only claimed by the ticket's user."""
+        images, errors = claim_uploads(user2, [cloudinary_result(slot)])
+        assert images == []
+        assert errors == ["Upload ticket belongs to another user."]
+
+    @pytest.mark.parametrize("value", ["", "[]", '{"receipt": "forged"}'])
+    def test_malformed(self, user, value):
+        """Test that malformed values are reported, not raised."""
+        images, errors = claim_uploads(user, [value])
+        assert images == []
+        assert errors
+
+    def test_order_and_limit(self, authenticated_client, user, slot):
+        """Test that results keep their order and the formset limit."""
+        slots = [slot] + [issue_ticket(user) for _ in range(11)]
+        response = authenticated_client.post(
+            reverse("post_create"),
+            post_form([cloudinary_result(s) for s in slots]),
+        )
+        assert response.status_code == 302
+        images = Post.objects.get(author=user).images.all()
+        assert [image.image.public_id for image in images] == [
+            s["fields"]["public_id"] for s in slots[:10]
+        ]
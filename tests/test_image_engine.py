@@ -0,0 +1,155 @@
+"""Tests for the DJGramm image engine."""
+
+import time
+from io import BytesIO
+
+import pytest
+from django.core.management import call_command
+from PIL import Image
+
+from app import metrics
+from app.image_engine import (
+    ImageEngine,
+    ImageEngineBusy,
+    ImageEngineTimeout,
+)
+from app.imaging import resize_bytes_to_jpeg
+
+
+def square(n):
+    """Worker task returning n squared."""
+    return n * n
+
+
+def fail_on_odd(n):
+    """Worker task raising for odd numbers."""
+    if n % 2:
+        raise ValueError(f"odd: {n}")
+    return n
+
+
+def sleep_for(seconds):
+    """Worker task sleeping for the given time."""
+    time.sleep(seconds)
+    return seconds
+
+
+def make_jpeg(size):
+    """Return JPEG bytes of a solid image."""
+    buffer = BytesIO()
+    Image.new("RGB", size, color="red").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    """Start every test with empty counters."""
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+@pytest.fixture
+def pool():
+    """Two-worker engine, shut down after the test."""
+    engine = ImageEngine(workers=2, max_pending=4, task_timeout=10)
+    yield engine
+    engine.shutdown()
+
+
+class TestInlineEngine:
+    """Tests for the engine with workers=0."""
+
+    def test_map_runs_in_order(self):
+        """Test results come back in payload order."""
+        engine = ImageEngine(workers=0)
+        assert engine.map(square, [1, 2, 3]) == [1, 4, 9]
+
+    def test_map_raises_first_error(self):
+        """Test errors propagate by default."""
+        engine = ImageEngine(workers=0)
+        with pytest.raises(ValueError, match="odd: 1"):
+            engine.map(fail_on_odd, [0, 1, 2])
+
+    def test_map_returns_exceptions(self):
+        """Test errors are returned in place with return_exceptions."""
+        engine = ImageEngine(workers=0)
+        results = engine.map(fail_on_odd, [0, 1, 2], return_exceptions=True)
+        assert results[0] == 0
+        assert isinstance(results[1], ValueError)
+        assert results[2] == 2
+
+    def test_map_passes_shared_args(self):
+        """Test extra arguments are passed to every call."""
+        engine = ImageEngine(workers=0)
+        data = engine.map(resize_bytes_to_jpeg, [make_jpeg((400, 200))], 100)
+        assert Image.open(BytesIO(data[0])).size == (100, 50)
+
+
+class TestPoolEngine:
+    """Tests for the engine with worker processes."""
+
+    def test_map_runs_in_order(self, pool):
+        """Test results come back in payload order."""
+        assert pool.map(square, range(10)) == [n * n for n in range(10)]
+        assert (
+            metrics.get_counter("image_engine_tasks_total", result="ok") == 10
+        )
+
+    def test_map_returns_exceptions(self, pool):
+        """Test worker errors are returned in place."""
+        results = pool.map(fail_on_odd, [0, 1], return_exceptions=True)
+        assert results[0] == 0
+        assert isinstance(results[1], ValueError)
+
+    def test_resizes_images(self, pool):
+        """Test images are resized in the workers."""
+        payloads = [make_jpeg((2000, 1000)), make_jpeg((500, 500))]
+        results = pool.map(resize_bytes_to_jpeg, payloads, 1000)
+        sizes = [Image.open(BytesIO(data)).size for data in results]
+        assert sizes == [(1000, 500), (500, 500)]
+
+    def test_task_timeout(self):
+        """Test a slow task raises ImageEngineTimeout."""
+        engine = ImageEngine(workers=1, task_timeout=0.5)
+        try:
+            with pytest.raises(ImageEngineTimeout):
+                engine.map(sleep_for, [2])
+        finally:
+            engine.shutdown()
+        assert (
+            metrics.get_counter("image_engine_tasks_total", result="timeout")
+            == 1
+        )
+
+    def test_busy_when_queue_full(self):
+        """Test callers give up when no slot frees in time."""
+        engine = ImageEngine(workers=1, max_pending=1, task_timeout=0.5)
+        try:
+            future = engine._submit(sleep_for, 2)
+            with pytest.raises(ImageEngineBusy):
+                engine.map(square, [1])
+            future.result()
+        finally:
+            engine.shutdown()
+        assert (
+            metrics.get_counter("image_engine_tasks_total", result="busy") == 1
+        )
+
+
+class TestBenchmarkCommand:
+    """Tests for the benchmark_image_engine command."""
+
+    def test_reports_speedup(self, capsys):
+        """Test the command prints both runs and the speedup."""
+        call_command(
+            "benchmark_image_engine",
+            images=2,
+            size="200x100",
+            workers=2,
+            rounds=1,
+        )
+        output = capsys.readouterr().out
+        assert "serial:" in output
+        assert "parallel (2 workers):" in output
+        assert "Speedup:" in output
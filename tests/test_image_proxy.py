@@ -0,0 +1,231 @@
+"""Tests for the on-demand image proxy."""
+
+import os
+from io import BytesIO
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+
+from app import image_proxy
+from app.image_engine import (
+    ImageEngineBusy,
+    ImageEngineError,
+    ImageEngineTimeout,
+)
+from app.image_proxy import (
+    DiskLRUCache,
+    image_proxy_url,
+    sign_transform,
+    transform_name,
+    verify_transform,
+)
+from app.models import Post, PostImage
+
+
+def make_image(size=(400, 200)):
+    """Return JPEG bytes."""
+    buffer = BytesIO()
+    Image.new("RGB", size, color="blue").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def proxy_cache(settings, tmp_path, monkeypatch):
+    """Point the proxy at an empty cache directory."""
+    settings.IMAGE_PROXY_CACHE_DIR = tmp_path / "proxy"
+    monkeypatch.setattr(image_proxy, "_cache", None)
+    return settings.IMAGE_PROXY_CACHE_DIR
+
+
+@pytest.fixture
+def stored_image(local_media, user):
+    """Create a post image stored in local media."""
+    post = Post.objects.create(author=user, caption="Proxy")
+    return PostImage.objects.create(
+        post=post,
+        image=SimpleUploadedFile("photo.jpg", make_image(), "image/jpeg"),
+    )
+
+
+class TestDiskLRUCache:
+    """Tests for DiskLRUCache."""
+
+    def test_get_returns_mmap(self, tmp_path):
+        """Test that hits are mapped files and misses are None."""
+        cache = DiskLRUCache(tmp_path, max_bytes=100)
+        assert cache.get("ab12") is None
+
+        cache.set("ab12", b"hello")
+        mapped = cache.get("ab12")
+        assert mapped[:] == b"hello"
+        mapped.close()
+        assert cache.size == 5
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        """Test that the least recently read file goes first."""
+        cache = DiskLRUCache(tmp_path, max_bytes=20)
+        cache.set("aa", b"x" * 8)
+        cache.set("bb", b"x" * 8)
+        cache.get("aa").close()
+        cache.set("cc", b"x" * 8)
+
+        assert cache.get("bb") is None
+        assert not os.path.exists(tmp_path / "bb" / "bb")
+        assert cache.get("aa") is not None
+        assert cache.get("cc") is not None
+        assert cache.size == 16
+
+    def test_replacing_file_updates_size(self, tmp_path):
+        """Test that setting a name again counts its new size only."""
+        cache = DiskLRUCache(tmp_path, max_bytes=100)
+        cache.set("aa", b"x" * 10)
+        cache.set("aa", b"x" * 4)
+        assert cache.size == 4
+
+    def test_index_rebuilt_from_disk(self, tmp_path):
+        """Test that a new instance finds files in use order."""
+        first = DiskLRUCache(tmp_path, max_bytes=100)
+        first.set("aa", b"x" * 8)
+        first.set("bb", b"x" * 8)
+        os.utime(tmp_path / "aa" / "aa", (1, 1))
+
+        second = DiskLRUCache(tmp_path, max_bytes=20)
+        assert second.size == 16
+        second.set("cc", b"x" * 8)
+        assert second.get("aa") is None
+        assert second.get("bb") is not None
+
+    def test_empty_file_is_miss(self, tmp_path):
+        """Test that an empty file is dropped instead of mapped."""
+        cache = DiskLRUCache(tmp_path, max_bytes=100)
+        cache.set("aa", b"")
+        assert cache.get("aa") is None
+        assert not os.path.exists(tmp_path / "aa" / "aa")
+        assert cache.size == 0
+
+    def test_sees_files_of_other_processes(self, tmp_path):
+        """Test that files written by another instance are hits."""
+        first = DiskLRUCache(tmp_path, max_bytes=100)
+        second = DiskLRUCache(tmp_path, max_bytes=100)
+        assert second.size == 0
+        first.set("aa", b"abc")
+        assert second.get("aa")[:] == b"abc"
+        assert second.size == 3
+
+
+@pytest.mark.django_db
+class TestSigning:
+    """Tests for signed proxy URLs."""
+
+    def test_url_is_signed(self, stored_image):
+        """Test that URLs carry the transform signature."""
+        url = image_proxy_url(stored_image, 300, 200, "jpg")
+        signature = sign_transform(stored_image, 300, 200, "jpg")
+        assert url == f"/img/{stored_image.pk}/300x200.jpg?s={signature}"
+
+    def test_signature_covers_transform(self, stored_image):
+        """Test that a signature is only valid for its transform."""
+        signature = sign_transform(stored_image, 300, 200, "jpg")
+        assert verify_transform(stored_image, 300, 200, "jpg", signature)
+        assert not verify_transform(stored_image, 600, 200, "jpg", signature)
+        assert not verify_transform(stored_image, 300, 200, "webp", signature)
+
+    def test_signature_covers_stored_file(self, stored_image):
+        """Test that replacing the image invalidates its URLs."""
+        signature = sign_transform(stored_image, 300, 200, "jpg")
+        name = transform_name(stored_image, 300, 200, "jpg")
+        stored_image.image = "image/upload/posts/other.jpg"
+        assert not verify_transform(stored_image, 300, 200, "jpg", signature)
+        assert transform_name(stored_image, 300, 200, "jpg") != name
+
+
+@pytest.mark.django_db
+class TestImageProxyView:
+    """Tests for the image_proxy view."""
+
+    def test_renders_transform(self, client, stored_image, proxy_cache):
+        """Test that the image is scaled to fit and cached forever."""
+        response = client.get(image_proxy_url(stored_image, 100, 100, "jpg"))
+        assert response.status_code == 200
+        assert response["Content-Type"] == "image/jpeg"
+        assert "immutable" in response["Cache-Control"]
+        name = transform_name(stored_image, 100, 100, "jpg")
+        assert response["ETag"] == f'"{name}"'
+
+        data = b"".join(response.streaming_content)
+        assert int(response["Content-Length"]) == len(data)
+        with Image.open(BytesIO(data)) as img:
+            assert img.size == (100, 50)
+        assert (proxy_cache / name[:2] / name).read_bytes() == data
+
+    def test_second_request_served_from_cache(
+        self, client, stored_image, proxy_cache, monkeypatch
+    ):
+        """Test that a cached transform is not rendered again."""
+        url = image_proxy_url(stored_image, 100, 100, "jpg")
+        first = b"".join(client.get(url).streaming_content)
+
+        def fail(image):
+            raise AssertionError("source read on a cache hit")
+
+        monkeypatch.setattr(image_proxy, "read_source", fail)
+        second = b"".join(client.get(url).streaming_content)
+        assert second == first
+
+    def test_not_modified(self, client, stored_image, proxy_cache):
+        """Test that a matching If-None-Match gets 304."""
+        name = transform_name(stored_image, 100, 100, "jpg")
+        response = client.get(
+            image_proxy_url(stored_image, 100, 100, "jpg"),
+            HTTP_IF_NONE_MATCH=f'"{name}"',
+        )
+        assert response.status_code == 304
+        assert not proxy_cache.exists()
+
+    def test_bad_signature(self, client, stored_image, proxy_cache):
+        """Test that unsigned transforms are refused."""
+        url = f"/img/{stored_image.pk}/100x100.jpg?s=forged"
+        assert client.get(url).status_code == 403
+        url = f"/img/{stored_image.pk}/100x100.jpg"
+        assert client.get(url).status_code == 403
+
+    @pytest.mark.parametrize(
+        "width,height,fmt",
+        [(0, 100, "jpg"), (5000, 100, "jpg"), (100, 100, "gif")],
+    )
+    def test_invalid_transform(
+        self, client, stored_image, proxy_cache, width, height, fmt
+    ):
+        """Test that sizes and formats outside the limits are 404."""
+        signature = sign_transform(stored_image, width, height, fmt)
+        url = f"/img/{stored_image.pk}/{width}x{height}.{fmt}?s={signature}"
+        assert client.get(url).status_code == 404
+
+    @pytest.mark.parametrize(
+        "error,status",
+        [
+            (ImageEngineBusy("queue full"), 503),
+            (ImageEngineTimeout("too slow"), 503),
+            (ImageEngineError("worker died"), 404),
+        ],
+    )
+    def test_engine_errors(
+        self, client, stored_image, proxy_cache, monkeypatch, error, status
+    ):
+        """Test that a busy engine is 503 and a failed transform 404."""
+
+        class FailingEngine:
+            def map(self, *args, **kwargs):
+                raise error
+
+        monkeypatch.setattr(image_proxy, "get_engine", FailingEngine)
+        response = client.get(image_proxy_url(stored_image, 100, 100, "jpg"))
+        assert response.status_code == status
+        assert "immutable" not in response.get("Cache-Control", "")
+        if status == 503:
+            assert response["Retry-After"] == "5"
+
+    def test_missing_image(self, client, db, proxy_cache):
+        """Test that unknown images are 404."""
+        assert client.get("/img/999/100x100.jpg?s=x").status_code == 404
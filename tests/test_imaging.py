@@ -0,0 +1,276 @@
+"""Tests for DJGramm image encoding."""
+
+import base64
+import json
+import os
+import subprocess
+import sys
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from django.core.management import call_command
+from PIL import Image, JpegImagePlugin
+
+from app.imaging import (
+    PLACEHOLDER_SIZE,
+    describe_image,
+    dhash,
+    dhash_bytes,
+    fit_size,
+    process_image_bytes,
+    read_dimensions,
+    resize_to_jpeg,
+    sniff_format,
+    supported_formats,
+    thumbnail_jpeg,
+)
+
+SRC_DIR = Path(__file__).resolve().parents[1] / "src"
+
+# Runs one resize in a fresh interpreter and reports wall time and the
+# growth of its peak RSS; "full" is the pipeline before draft mode.
+# VmHWM is used because ru_maxrss keeps the parent's peak across exec.
+BENCHMARK_SCRIPT = """
+import json, sys, time
+from io import BytesIO
+from PIL import Image, JpegImagePlugin
+from app.imaging import resize_to_jpeg
+
+def peak_rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+
+mode, path = sys.argv[1], sys.argv[2]
+with open(path, "rb") as f:
+    data = f.read()
+baseline = peak_rss_kb()
+start = time.perf_counter()
+if mode == "draft":
+    resize_to_jpeg(BytesIO(data), 1080)
+else:
+    with Image.open(BytesIO(data)) as img:
+        img = img.convert("RGB")
+        ratio = 1080 / max(img.size)
+        size = tuple(int(dim * ratio) for dim in img.size)
+        img = img.resize(size, Image.Resampling.LANCZOS)
+        img.save(BytesIO(), format="JPEG", quality=85, optimize=True)
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "rss_kb": peak_rss_kb() - baseline}))
+"""
+
+
+def make_jpeg(size, color="red"):
+    """Return JPEG bytes of a solid image."""
+    buffer = BytesIO()
+    Image.new("RGB", size, color=color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class TestFitSize:
+    """Tests for fit_size function."""
+
+    def test_small_unchanged(self):
+        """Test sizes within the limit are kept."""
+        assert fit_size((800, 600), 1080) == (800, 600)
+
+    def test_scales_longest_side(self):
+        """Test the longest side is scaled to the limit."""
+        assert fit_size((6000, 4000), 1080) == (1080, 720)
+        assert fit_size((3000, 4000), 1000) == (750, 1000)
+
+    def test_never_zero(self):
+        """Test extreme aspect ratios keep at least one pixel."""
+        assert fit_size((10000, 2), 100) == (100, 1)
+
+
+class TestRenditions:
+    """Tests for encoding several output formats."""
+
+    def test_supported_formats(self):
+        """Test JPEG is always supported and listed first."""
+        assert supported_formats()[0] == "JPEG"
+
+    def test_benchmark_command(self, capsys):
+        """Test the benchmark reports each supported format."""
+        call_command("benchmark_image_formats", size="400x300")
+        output = capsys.readouterr().out
+        for image_format in supported_formats():
+            assert f"{image_format:5}" in output
+        assert "100% of JPEG" in output
+
+
+class TestPlaceholders:
+    """Tests for image size and placeholder data."""
+
+    def decode(self, placeholder):
+        """Return the image inside a placeholder data URI."""
+        header, encoded = placeholder.split(",", 1)
+        assert header.startswith("data:image/")
+        return Image.open(BytesIO(base64.b64decode(encoded)))
+
+    def test_process_image_bytes(self):
+        """Test the resized size and a tiny preview are returned."""
+        result = process_image_bytes(make_jpeg((3000, 2000)), 1080)
+        assert Image.open(BytesIO(result.data)).size == (1080, 720)
+        assert (result.width, result.height) == (1080, 720)
+        preview = self.decode(result.placeholder)
+        assert max(preview.size) == PLACEHOLDER_SIZE
+        assert len(result.placeholder) < 1000
+
+    def test_describe_image(self):
+        """Test the original size is read without resizing."""
+        width, height, placeholder = describe_image(
+            BytesIO(make_jpeg((4000, 1000), "green"))
+        )
+        assert (width, height) == (4000, 1000)
+        r, g, b = self.decode(placeholder).convert("RGB").getpixel((0, 0))
+        assert g > r and g > b
+
+
+class TestDhash:
+    """Tests for perceptual hashing."""
+
+    def make_photo(self):
+        """Return an image with structure in both directions."""
+        gradient = Image.linear_gradient("L")
+        return Image.merge(
+            "RGB", (gradient, gradient.rotate(90), Image.radial_gradient("L"))
+        )
+
+    def distance(self, a, b):
+        return (a ^ b).bit_count()
+
+    def test_stable_under_resize_and_reencode(self):
+        """Test a smaller, lower quality copy hashes the same."""
+        photo = self.make_photo().resize((3000, 3000))
+        copy = photo.resize((800, 800))
+        buffer = BytesIO()
+        copy.save(buffer, format="JPEG", quality=50)
+        assert self.distance(dhash(photo), dhash_bytes(buffer.getvalue())) <= 3
+
+    def test_differs_for_other_images(self):
+        """Test a mirrored image hashes far apart."""
+        photo = self.make_photo()
+        mirrored = photo.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+        assert self.distance(dhash(photo), dhash(mirrored)) > 10
+
+    def test_64_bits(self):
+        """Test the hash fits in 64 bits."""
+        assert 0 <= dhash(self.make_photo()) < 2**64
+
+
+class TestHeaderSniffing:
+    """Tests for sniff_format and read_dimensions."""
+
+    @pytest.mark.parametrize("image_format", ["JPEG", "PNG", "WEBP"])
+    def test_reads_format_and_size(self, image_format):
+        """Test format and size are read from the first KB."""
+        buffer = BytesIO()
+        Image.new("RGB", (640, 480)).save(buffer, format=image_format)
+        data = buffer.getvalue()[:1024]
+        assert sniff_format(data) == image_format
+        assert read_dimensions(data, image_format) == (640, 480)
+
+    def test_lossless_webp(self):
+        """Test VP8L headers are read."""
+        buffer = BytesIO()
+        Image.new("RGB", (321, 123)).save(buffer, format="WEBP", lossless=True)
+        assert read_dimensions(buffer.getvalue()[:64], "WEBP") == (321, 123)
+
+    def test_unknown_format(self):
+        """Test other formats are not identified."""
+        assert sniff_format(b"GIF89a" + b"\0" * 10) is None
+        assert sniff_format(b"") is None
+
+    def test_incomplete_header(self):
+        """Test None is returned while the header is incomplete."""
+        buffer = BytesIO()
+        Image.new("RGB", (640, 480)).save(buffer, format="JPEG")
+        assert read_dimensions(buffer.getvalue()[:20], "JPEG") is None
+
+
+class TestDraftDecoding:
+    """Tests for reduced-scale JPEG decoding."""
+
+    def test_large_jpeg_exact_size(self):
+        """Test draft decoding still yields the exact target size."""
+        result = resize_to_jpeg(BytesIO(make_jpeg((4032, 3024))), 1080)
+        assert Image.open(BytesIO(result)).size == (1080, 810)
+
+    def test_draft_requested_at_target_size(self, monkeypatch):
+        """Test JPEGs are drafted to the target size before decoding."""
+        calls = []
+        original = JpegImagePlugin.JpegImageFile.draft
+
+        def spy(self, mode, size):
+            calls.append(size)
+            return original(self, mode, size)
+
+        monkeypatch.setattr(JpegImagePlugin.JpegImageFile, "draft", spy)
+        resize_to_jpeg(BytesIO(make_jpeg((4000, 2000))), 1000)
+        assert calls == [(1000, 500)]
+
+    def test_png_not_drafted(self):
+        """Test non-JPEG images are resized normally."""
+        buffer = BytesIO()
+        Image.new("RGBA", (2000, 1000), (0, 0, 255, 128)).save(buffer, "PNG")
+        result = resize_to_jpeg(buffer, 1000)
+        img = Image.open(BytesIO(result))
+        assert img.size == (1000, 500)
+        assert img.mode == "RGB"
+
+    def test_colors_preserved(self):
+        """Test drafting does not shift colors of a solid image."""
+        result = resize_to_jpeg(BytesIO(make_jpeg((4000, 4000), "blue")), 500)
+        r, g, b = Image.open(BytesIO(result)).getpixel((250, 250))
+        assert r < 10 and g < 10 and b > 240
+
+    def test_thumbnail_of_large_jpeg(self):
+        """Test thumbnails of large JPEGs keep the aspect ratio."""
+        result = thumbnail_jpeg(BytesIO(make_jpeg((6000, 4000))))
+        assert Image.open(BytesIO(result)).size == (300, 200)
+
+
+@pytest.mark.skipif(
+    not Path("/proc/self/status").exists(), reason="needs Linux procfs"
+)
+class TestDraftBenchmark:
+    """Benchmark of draft decoding against a full decode."""
+
+    def run(self, mode, path):
+        """Run the benchmark script for one mode in a new process."""
+        env = {**os.environ, "PYTHONPATH": str(SRC_DIR)}
+        output = subprocess.run(
+            [sys.executable, "-c", BENCHMARK_SCRIPT, mode, str(path)],
+            capture_output=True,
+            check=True,
+            env=env,
+            text=True,
+        ).stdout
+        return json.loads(output)
+
+    def test_draft_is_faster_and_smaller(self, tmp_path):
+        """Test a 24 MP photo resizes faster in less memory."""
+        # A gradient keeps the JPEG from being trivially compressible
+        gradient = Image.linear_gradient("L").resize((6000, 4000))
+        path = tmp_path / "photo.jpg"
+        Image.merge("RGB", (gradient, gradient.rotate(180), gradient)).save(
+            path, format="JPEG", quality=90
+        )
+
+        full = self.run("full", path)
+        draft = self.run("draft", path)
+        print(
+            f"\n24 MP JPEG -> 1080 px: "
+            f"full {full['seconds'] * 1000:.0f} ms / "
+            f"{full['rss_kb'] // 1024} MB peak, "
+            f"draft {draft['seconds'] * 1000:.0f} ms / "
+            f"{draft['rss_kb'] // 1024} MB peak"
+        )
+
+        assert draft["seconds"] < full["seconds"]
+        # A full decode holds the 72 MB RGB bitmap; a 1/2 draft a quarter
+        assert draft["rss_kb"] < full["rss_kb"] / 2
@@ -0,0 +1,348 @@
+"""Tests for the guarded Cloudinary client, against a local fake API."""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import cloudinary
+import pytest
+from cloudinary.exceptions import BadRequest
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from app import media_client, metrics
+from app.media_client import (
+    CircuitBreaker,
+    MediaClient,
+    MediaClientError,
+    MediaUnavailable,
+)
+from app.models import PendingMediaDeletion, Post, PostImage
+from app.services import delete_media, retry_media_deletions
+from app.storage import media_key, parse_content_key
+
+OK = {
+    "public_id": "posts/abc",
+    "version": 1,
+    "format": "jpg",
+    "type": "upload",
+    "resource_type": "image",
+    "result": "ok",
+}
+
+
+class FakeClock:
+    """Monotonic clock advanced by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeCloudinary:
+    """
+    Local HTTP server answering like the Cloudinary upload API.
+
+    Queued (status, body, delay) responses are used in order, then
+    200 with OK.
+    """
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                self.rfile.read(length)
+                fake.requests.append(self.path)
+                status, body, delay = (
+                    fake.responses.pop(0) if fake.responses else (200, OK, 0)
+                )
+                time.sleep(delay)
+                data = body if isinstance(body, bytes) else json.dumps(body)
+                data = data.encode() if isinstance(data, str) else data
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    # The client gave up waiting
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(
+            target=self.server.serve_forever,
+            kwargs={"poll_interval": 0.05},
+            daemon=True,
+        )
+
+    def fail(self, count, status=500, delay=0):
+        """Queue count failing responses."""
+        body = {"error": {"message": "boom"}}
+        if status == 502:
+            body = b"<html>Bad Gateway</html>"
+        self.responses.extend([(status, body, delay)] * count)
+
+
+@pytest.fixture
+def fake_api():
+    """Run a fake Cloudinary API for the test."""
+    fake = FakeCloudinary()
+    fake.thread.start()
+    yield fake
+    fake.server.shutdown()
+    fake.server.server_close()
+
+
+@pytest.fixture
+def clock():
+    """Return a hand-driven clock."""
+    return FakeClock()
+
+
+@pytest.fixture
+def client(fake_api, clock, monkeypatch):
+    """Return a client of the fake API, installed as the shared one."""
+    metrics.reset()
+    client = MediaClient(
+        breaker=CircuitBreaker(
+            "test", min_calls=4, window=60, reset_timeout=30, clock=clock
+        ),
+        connect_timeout=1,
+        read_timeout=0.3,
+        retries=2,
+        backoff_base=0.01,
+        options={"upload_prefix": fake_api.url},
+    )
+    monkeypatch.setattr(media_client, "_client", client)
+    return client
+
+
+class TestCircuitBreaker:
+    """Tests for CircuitBreaker."""
+
+    def make(self, clock):
+        return CircuitBreaker(
+            "unit", failure_rate=0.5, min_calls=4, window=10, clock=clock
+        )
+
+    def test_opens_on_failure_rate(self, clock):
+        """Test that half of min_calls failing opens the circuit."""
+        breaker = self.make(clock)
+        for success in (True, False, True):
+            breaker.record(success)
+        assert breaker.state == CircuitBreaker.CLOSED
+        breaker.record(False)
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.allow()
+
+    def test_stays_closed_below_rate(self, clock):
+        """Test that occasional failures are tolerated."""
+        breaker = self.make(clock)
+        for success in (True, False, True, True, True, False, True, True):
+            breaker.record(success)
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_old_outcomes_forgotten(self, clock):
+        """Test that failures outside the window do not count."""
+        breaker = self.make(clock)
+        breaker.record(False)
+        breaker.record(False)
+        clock.now += 11
+        breaker.record(False)
+        breaker.record(True)
+        breaker.record(True)
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_half_open_single_trial(self, clock):
+        """Test that one trial call is let through after the timeout."""
+        breaker = self.make(clock)
+        for _ in range(4):
+            breaker.record(False)
+        clock.now += 30
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.record(True)
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.allow()
+
+    def test_failed_trial_reopens(self, clock):
+        """Test that a failed trial opens the circuit again."""
+        breaker = self.make(clock)
+        for _ in range(4):
+            breaker.record(False)
+        clock.now += 30
+        assert breaker.allow()
+        breaker.record(False)
+        assert breaker.state == CircuitBreaker.OPEN
+        clock.now += 29
+        assert not breaker.allow()
+
+    def test_state_gauge(self, clock):
+        """Test that the state is exported as a gauge."""
+        metrics.reset()
+        breaker = self.make(clock)
+        samples = metrics.snapshot()["media_circuit_state"]
+        assert samples == [({"client": "unit"}, 0)]
+        for _ in range(4):
+            breaker.record(False)
+        samples = metrics.snapshot()["media_circuit_state"]
+        assert samples == [({"client": "unit"}, 2)]
+
+
+class TestMediaClient:
+    """Tests for MediaClient calls over HTTP."""
+
+    def test_upload(self, client, fake_api):
+        """Test that a healthy API answers on the first attempt."""
+        result = client.upload(BytesIO(b"data"), folder="posts")
+        assert result["public_id"] == "posts/abc"
+        assert fake_api.requests == ["/v1_1/test_cloud/image/upload"]
+        assert (
+            metrics.get_counter(
+                "media_client_calls_total", op="upload", result="ok"
+            )
+            == 1
+        )
+
+    def test_retries_server_errors(self, client, fake_api):
+        """Test that 5xx responses are retried."""
+        fake_api.fail(1, status=500)
+        fake_api.fail(1, status=502)
+        result = client.upload(BytesIO(b"data"))
+        assert result["public_id"] == "posts/abc"
+        assert len(fake_api.requests) == 3
+        assert (
+            metrics.get_counter(
+                "media_client_calls_total", op="upload", result="retry"
+            )
+            == 2
+        )
+
+    def test_client_errors_not_retried(self, client, fake_api):
+        """Test that 4xx responses are raised at once."""
+        fake_api.fail(1, status=400)
+        with pytest.raises(BadRequest):
+            client.destroy("posts/abc")
+        assert fake_api.requests == ["/v1_1/test_cloud/image/destroy"]
+        assert client.breaker.state == CircuitBreaker.CLOSED
+
+    def test_read_timeout(self, client, fake_api):
+        """Test that a stalled API costs at most the timeouts."""
+        fake_api.fail(3, status=200, delay=1)
+        started = time.monotonic()
+        with pytest.raises(MediaClientError):
+            client.upload(BytesIO(b"data"))
+        assert time.monotonic() - started < 2
+        assert len(fake_api.requests) == 3
+
+    def test_connection_refused(self, client, fake_api):
+        """Test that an unreachable API fails after the retries."""
+        fake_api.server.server_close()
+        with pytest.raises(MediaClientError):
+            client.destroy("posts/abc")
+
+    def test_circuit_opens_and_fails_fast(self, client, fake_api, clock):
+        """Test that calls stop reaching a failing API."""
+        fake_api.fail(6, status=502)
+        with pytest.raises(MediaClientError):
+            client.upload(BytesIO(b"data"))
+        with pytest.raises(MediaUnavailable):
+            client.upload(BytesIO(b"data"))
+        assert client.breaker.state == CircuitBreaker.OPEN
+        calls = len(fake_api.requests)
+
+        with pytest.raises(MediaUnavailable):
+            client.destroy("posts/abc")
+        assert len(fake_api.requests) == calls
+        assert (
+            metrics.get_counter(
+                "media_client_calls_total", op="destroy", result="rejected"
+            )
+            == 1
+        )
+
+        # The trial call after the reset timeout closes it again
+        fake_api.responses.clear()
+        clock.now += 30
+        assert client.destroy("posts/abc")["result"] == "ok"
+        assert client.breaker.state == CircuitBreaker.CLOSED
+
+    def test_backoff_has_jitter_and_cap(self, client):
+        """Test that backoff delays are random and bounded."""
+        client.backoff_base = 1
+        client.backoff_max = 3
+        delays = {client.backoff(attempt) for attempt in range(10)}
+        assert len(delays) == 10
+        assert all(0 <= delay <= 3 for delay in delays)
+
+
+@pytest.mark.django_db
+class TestDeferredWork:
+    """Tests for work deferred while Cloudinary is unavailable."""
+
+    @pytest.fixture
+    def open_circuit(self, client):
+        """Open the circuit of the shared client."""
+        for _ in range(4):
+            client.breaker.record(False)
+        return client
+
+    def test_upload_stored_locally(
+        self, local_media, settings, open_circuit, user
+    ):
+        """Test that uploads are kept locally while the circuit is open."""
+        settings.MEDIA_BACKEND = "cloudinary"
+        post = Post.objects.create(author=user, caption="Deferred")
+        image = PostImage.objects.create(
+            post=post,
+            image=SimpleUploadedFile("photo.jpg", b"jpeg", "image/jpeg"),
+        )
+        key = media_key(image.image)
+        assert parse_content_key(key)
+        assert (local_media / key).read_bytes() == b"jpeg"
+        assert metrics.get_counter("media_uploads_deferred_total") == 1
+
+    def test_upload_through_client(
+        self, settings, client, fake_api, user, monkeypatch
+    ):
+        """Test that field uploads go through the client."""
+        settings.MEDIA_BACKEND = "cloudinary"
+        # Field uploads use the global SDK configuration
+        monkeypatch.setattr(cloudinary.config(), "upload_prefix", fake_api.url)
+        post = Post.objects.create(author=user, caption="Uploaded")
+        image = PostImage.objects.create(
+            post=post,
+            image=SimpleUploadedFile("photo.jpg", b"jpeg", "image/jpeg"),
+        )
+        assert media_key(image.image) == "posts/abc.jpg"
+        assert fake_api.requests == ["/v1_1/test_cloud/image/upload"]
+
+    def test_deletion_queued_and_retried(self, client, fake_api, open_circuit):
+        """Test that failed deletions are queued and retried later."""
+        assert delete_media("posts/abc") is False
+        assert PendingMediaDeletion.objects.get().public_id == "posts/abc"
+
+        # Still open: nothing is attempted
+        assert retry_media_deletions() == (0, 1)
+        assert fake_api.requests == []
+
+        client.breaker.clock.now += 30
+        assert retry_media_deletions() == (1, 0)
+        assert fake_api.requests == ["/v1_1/test_cloud/image/destroy"]
+
+    def test_deletion_when_healthy(self, client, fake_api):
+        """Test that deletions go straight to the API."""
+        assert delete_media("posts/abc") is True
+        assert not PendingMediaDeletion.objects.exists()
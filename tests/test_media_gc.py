@@ -0,0 +1,269 @@
+"""Tests for orphaned media collection."""
+
+import os
+from datetime import UTC, datetime
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+from django.core.management import call_command
+
+from app import media_gc
+from app.fields import MediaKey, media_join_key
+from app.media_gc import (
+    MediaOrderError,
+    StoredMedia,
+    collect_orphans,
+    find_orphans,
+    iter_cloudinary_media,
+    iter_local_media,
+    iter_references,
+)
+from app.models import Post, PostImage
+from app.storage import get_local_storage
+
+OLD = datetime(2020, 1, 1, tzinfo=UTC)
+
+
+def digest(char):
+    """Return a fake SHA-256 hex digest."""
+    return char * 64
+
+
+def content_key(char, suffix=".jpg"):
+    """Return the content key of digest(char)."""
+    return f"{char * 2}/{char * 2}/{digest(char)}{suffix}"
+
+
+def listed(*keys):
+    """Build listing pairs of old files."""
+    return [(key, StoredMedia(key, 10, OLD)) for key in keys]
+
+
+@pytest.fixture
+def post(user):
+    """Create a post to attach images to."""
+    return Post.objects.create(author=user, caption="GC")
+
+
+def add_image(post, value):
+    """Create a post image with a stored value."""
+    return PostImage.objects.create(post=post, image=value)
+
+
+class TestJoinKeys:
+    """Tests for media_join_key and MediaKey."""
+
+    @pytest.mark.parametrize(
+        "value,expected",
+        [
+            ("image/upload/v12/posts/abc.jpg", "posts/abc"),
+            ("image/upload/posts/abc", "posts/abc"),
+            ("posts/abc", "posts/abc"),
+            ("posts/abc.png", "posts/abc"),
+            (f"image/upload/{content_key('a')}", f"aa/aa/{digest('a')}"),
+        ],
+    )
+    def test_media_join_key(self, value, expected):
+        """Test that type, version and format are stripped."""
+        assert media_join_key(value) == expected
+
+    @pytest.mark.django_db
+    def test_database_expression_matches(self, post):
+        """Test that MediaKey computes the same keys in the database."""
+        values = ["image/upload/v12/posts/abc.jpg", "posts/xyz"]
+        for value in values:
+            add_image(post, value)
+        keys = PostImage.objects.annotate(key=MediaKey("image")).values_list(
+            "key", flat=True
+        )
+        assert sorted(keys) == sorted(media_join_key(v) for v in values)
+
+
+class TestFindOrphans:
+    """Tests for the merge-join."""
+
+    def test_unreferenced_listed(self):
+        """Test that listed keys without references are orphans."""
+        listing = listed("a", "b", "c", "d")
+        orphans = find_orphans(listing, ["b", "b", "d", "e"])
+        assert [stored.key for stored in orphans] == ["a", "c"]
+
+    def test_renditions_share_key(self):
+        """Test that several files of one key follow its reference."""
+        listing = listed("a", "a", "b", "b")
+        orphans = find_orphans(listing, ["a"])
+        assert [stored.key for stored in orphans] == ["b", "b"]
+
+    def test_out_of_order_listing(self):
+        """Test that an unsorted listing aborts instead of deleting."""
+        with pytest.raises(MediaOrderError):
+            list(find_orphans(listed("b", "a"), []))
+
+    def test_out_of_order_references(self):
+        """Test that unsorted references abort instead of deleting."""
+        with pytest.raises(MediaOrderError):
+            list(find_orphans(listed("c"), ["b", "a"]))
+
+    def test_streams_consumed_lazily(self):
+        """Test that the join does not read ahead of the listing."""
+        consumed = []
+
+        def references():
+            for key in ["a", "c", "e"]:
+                consumed.append(key)
+                yield key
+
+        orphans = find_orphans(iter(listed("b", "d")), references())
+        assert next(orphans).key == "b"
+        assert consumed == ["a", "c"]
+
+
+@pytest.mark.django_db
+class TestReferences:
+    """Tests for reading references from the database."""
+
+    def test_sorted_across_models(self, post, user):
+        """Test that avatars and post images are merged in order."""
+        add_image(post, "image/upload/v1/posts/b.jpg")
+        add_image(post, "image/upload/v1/posts/a.jpg")
+        user.profile.avatar = "image/upload/v1/avatars/z.jpg"
+        user.profile.save()
+
+        keys = list(iter_references(chunk_size=1))
+        assert keys == ["avatars/z", "posts/a", "posts/b"]
+
+
+@pytest.mark.django_db
+class TestLocalCollection:
+    """Tests for collecting local content-addressed files."""
+
+    @pytest.fixture
+    def files(self, local_media, post):
+        """Store referenced, orphaned and recent files."""
+        storage = get_local_storage()
+        keys = {
+            "used": content_key("a"),
+            "orphan": content_key("b"),
+            "recent": content_key("c"),
+        }
+        for name, key in keys.items():
+            path = local_media / key
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b"x" * 100)
+            if name != "recent":
+                os.utime(path, (0, 0))
+        (local_media / ".incoming").mkdir()
+        (local_media / ".incoming" / "tmp").write_bytes(b"x")
+        add_image(post, f"image/upload/{keys['used']}")
+        return storage, keys
+
+    def test_listing_order(self, files):
+        """Test that the walk is sorted and keys lose their extension."""
+        storage, keys = files
+        pairs = list(iter_local_media(storage))
+        assert [stored.key for _, stored in pairs] == [
+            keys["used"],
+            keys["orphan"],
+            keys["recent"],
+        ]
+        assert pairs[0][0] == f"aa/aa/{digest('a')}"
+
+    def test_dry_run(self, files, local_media):
+        """Test that a dry run reports without deleting."""
+        out = StringIO()
+        call_command("gc_media", "--backend=local", "--dry-run", stdout=out)
+        assert "Listed 3 local files." in out.getvalue()
+        assert "DRY RUN - 1 orphaned files" in out.getvalue()
+        assert (local_media / files[1]["orphan"]).exists()
+
+    def test_deletes_orphans(self, files, local_media):
+        """Test that only old unreferenced files are deleted."""
+        _, keys = files
+        out = StringIO()
+        call_command("gc_media", "--backend=local", stdout=out)
+        assert "Deleted 1 of 1 orphaned files" in out.getvalue()
+        assert "Skipped 1 recent" in out.getvalue()
+
+        remaining = {
+            name for name, key in keys.items() if (local_media / key).exists()
+        }
+        assert remaining == {"used", "recent"}
+        assert (local_media / ".incoming" / "tmp").exists()
+
+    def test_rechecks_before_deleting(self, files, post):
+        """Test that files referenced after the join are kept."""
+        storage, keys = files
+        add_image(post, f"image/upload/{keys['orphan']}")
+        deleted = []
+
+        with patch.object(media_gc, "iter_references", return_value=iter([])):
+            report = collect_orphans(
+                iter_local_media(storage),
+                deleted.extend,
+                join_key=media_gc.local_join_key,
+            )
+
+        assert report.skipped_referenced == 2
+        assert deleted == []
+
+
+@pytest.mark.django_db
+class TestCloudinaryCollection:
+    """Tests for collecting Cloudinary images."""
+
+    def test_pages_and_deletes(self, post):
+        """Test that listing pages are joined and orphans deleted."""
+        add_image(post, "image/upload/v1/posts/b.jpg")
+        pages = {
+            None: {
+                "resources": [
+                    {
+                        "public_id": "posts/a",
+                        "bytes": 5,
+                        "created_at": "2020-01-01T00:00:00Z",
+                    },
+                    {
+                        "public_id": "posts/b",
+                        "bytes": 5,
+                        "created_at": "2020-01-01T00:00:00Z",
+                    },
+                ],
+                "next_cursor": "page2",
+            },
+            "page2": {
+                "resources": [
+                    {
+                        "public_id": "posts/c",
+                        "bytes": 7,
+                        "created_at": "2020-01-01T00:00:00Z",
+                    },
+                ],
+            },
+        }
+
+        def execute(search, **options):
+            return pages[search.as_dict().get("next_cursor")]
+
+        def delete_resources(public_ids, **options):
+            return {"deleted": dict.fromkeys(public_ids, "deleted")}
+
+        with (
+            patch("cloudinary.search.Search.execute", execute),
+            patch(
+                "cloudinary.api.delete_resources", side_effect=delete_resources
+            ) as delete,
+        ):
+            report = collect_orphans(
+                iter_cloudinary_media(["posts"], page_size=2),
+                media_gc.delete_cloudinary,
+            )
+
+        assert delete.call_args.args[0] == ["posts/a", "posts/c"]
+        assert report.listed == 3
+        assert report.deleted == 2
+        assert report.orphan_bytes == 12
+
+    def test_media_folders(self):
+        """Test that folders come from the media fields."""
+        assert media_gc.media_folders() == ["avatars", "posts"]
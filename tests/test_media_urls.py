@@ -0,0 +1,115 @@
+"""Tests for memoized media URLs and eager transformations."""
+
+from unittest.mock import patch
+
+import pytest
+from cloudinary import CloudinaryResource
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+
+from app.media_urls import _cloudinary_url, eager_transformations, image_url
+from app.models import Profile
+
+
+@pytest.fixture
+def resource():
+    """Cloudinary resource as loaded from the database."""
+    return CloudinaryResource("avatars/abc", format="jpg", version="1")
+
+
+@pytest.fixture(autouse=True)
+def clear_memo():
+    """Start every test with an empty URL memo."""
+    _cloudinary_url.cache_clear()
+
+
+class TestImageUrl:
+    """Tests for image_url."""
+
+    def test_matches_resource_url(self, resource):
+        """Test that memoized URLs equal the ones Cloudinary builds."""
+        assert image_url(resource) == resource.url
+        assert image_url(resource, fmt="webp") == resource.build_url(
+            format="webp"
+        )
+
+    def test_named_transform(self, resource, settings):
+        """Test that IMAGE_TRANSFORMS entries are applied."""
+        settings.IMAGE_TRANSFORMS = {
+            "avatar": {"width": 80, "height": 80, "crop": "fill"}
+        }
+        url = image_url(resource, "avatar")
+        assert url == resource.build_url(width=80, height=80, crop="fill")
+        assert "c_fill,h_80,w_80" in url
+
+    def test_memoized(self, resource):
+        """Test that a repeated URL is not built again."""
+        image_url(resource, "avatar")
+        with patch("app.media_urls.utils.cloudinary_url") as build:
+            again = image_url(
+                CloudinaryResource("avatars/abc", format="jpg", version="1"),
+                "avatar",
+            )
+        build.assert_not_called()
+        assert again == image_url(resource, "avatar")
+        assert _cloudinary_url.cache_info().hits == 2
+
+    def test_memo_cleared_on_setting_change(self, resource, settings):
+        """Test that changed transformations are not served stale."""
+        before = image_url(resource, "avatar")
+        settings.IMAGE_TRANSFORMS = {"avatar": {"width": 40}}
+        assert image_url(resource, "avatar") != before
+
+    def test_empty_value(self):
+        """Test that missing images have no URL."""
+        assert image_url(None) == ""
+        assert image_url(CloudinaryResource()) == ""
+
+    @pytest.mark.django_db
+    def test_local_content_key(self, local_media):
+        """Test that local files are served as stored."""
+        key = "ab/cd/abcd" + "0" * 60 + ".jpg"
+        value = CloudinaryResource(key[:-4], format="jpg")
+        assert image_url(value, "avatar") == f"/media/{key}"
+
+    def test_template_filter(self, resource):
+        """Test the image_url filter in a template."""
+        template = Template(
+            '{% load app_tags %}{{ avatar|image_url:"avatar" }}'
+        )
+        html = template.render(Context({"avatar": resource}))
+        assert html == image_url(resource, "avatar").replace("&", "&amp;")
+
+
+class TestEagerTransformations:
+    """Tests for eager transformations requested on upload."""
+
+    def test_formats_and_named_transforms(self, settings):
+        """Test that renditions come first, then named transforms."""
+        settings.IMAGE_RENDITION_FORMATS = ["avif", "webp"]
+        settings.IMAGE_TRANSFORMS = {"avatar": {"width": 80}}
+        assert eager_transformations(["avatar"]) == [
+            {"format": "avif"},
+            {"format": "webp"},
+            {"width": 80},
+        ]
+
+    @pytest.mark.django_db
+    def test_upload_requests_eager(self, user, settings):
+        """Test that avatar uploads ask Cloudinary for eager versions."""
+        settings.MEDIA_BACKEND = "cloudinary"
+        settings.IMAGE_RENDITION_FORMATS = ["webp"]
+        settings.IMAGE_TRANSFORMS = {"avatar": {"width": 80}}
+        profile = Profile.objects.get(user=user)
+        profile.avatar = SimpleUploadedFile("a.jpg", b"x", "image/jpeg")
+
+        with patch("cloudinary.uploader.upload_resource") as upload:
+            upload.return_value = CloudinaryResource(
+                "avatars/a", format="jpg", version="1"
+            )
+            profile.save()
+
+        options = upload.call_args.kwargs
+        assert options["eager"] == [{"format": "webp"}, {"width": 80}]
+        assert options["eager_async"] is True
+        assert options["folder"] == "avatars"
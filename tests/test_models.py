@@ -1,8 +1,14 @@
 """Tests for DJGramm models."""
 
+from io import BytesIO
+from unittest.mock import patch
+
 import pytest
+from django.core.management import call_command
 from django.db import IntegrityError
+from django.urls import reverse
 from django.utils import timezone
+from PIL import Image
 
 from app.models import Follow, Like, Post, PostImage, Profile, Tag, User
 
@@ -210,6 +216,88 @@ class TestPostImageModel:
         assert images[1] == img1
 
 
+class TestPostCover:
+    """Tests for the denormalized Post.cover_image."""
+
+    def get_cover_id(self, post):
+        """Return current cover image id of post."""
+        return Post.objects.values_list("cover_image", flat=True).get(
+            pk=post.pk
+        )
+
+    def test_first_image_becomes_cover(self, post):
+        """Test creating images keeps the lowest order as cover."""
+        second = PostImage.objects.create(post=post, image="p/2", order=1)
+        assert self.get_cover_id(post) == second.pk
+        first = PostImage.objects.create(post=post, image="p/1", order=0)
+        assert self.get_cover_id(post) == first.pk
+
+    def test_deleting_cover_promotes_next(self, post):
+        """Test deleting the cover makes the next image the cover."""
+        first = PostImage.objects.create(post=post, image="p/1", order=0)
+        second = PostImage.objects.create(post=post, image="p/2", order=1)
+        first.delete()
+        assert self.get_cover_id(post) == second.pk
+        second.delete()
+        assert self.get_cover_id(post) is None
+
+    def test_reorder_updates_cover(self, authenticated_client, user):
+        """Test reordering images changes the cover."""
+        post = Post.objects.create(author=user)
+        first = PostImage.objects.create(post=post, image="p/1", order=0)
+        second = PostImage.objects.create(post=post, image="p/2", order=1)
+        authenticated_client.post(
+            reverse("reorder_images", kwargs={"pk": post.pk}),
+            data=f'{{"order": [{second.pk}, {first.pk}]}}',
+            content_type="application/json",
+        )
+        assert self.get_cover_id(post) == second.pk
+
+    def test_backfill_command(self, post, capsys):
+        """Test the backfill command sets missing covers."""
+        image = PostImage.objects.create(post=post, image="p/1", order=0)
+        Post.objects.update(cover_image=None)
+
+        call_command("backfill_post_covers", "--dry-run")
+        assert "1 of 1 posts" in capsys.readouterr().out
+        assert self.get_cover_id(post) is None
+
+        call_command("backfill_post_covers", "--batch-size", "1")
+        assert self.get_cover_id(post) == image.pk
+
+
+class TestImagePlaceholderBackfill:
+    """Tests for the backfill_image_placeholders command."""
+
+    def test_backfill(self, post, capsys):
+        """Test size and placeholder are stored, failures are skipped."""
+        buffer = BytesIO()
+        Image.new("RGB", (600, 400), color="red").save(buffer, "JPEG")
+        done = PostImage.objects.create(post=post, image="p/1", order=1)
+        broken = PostImage.objects.create(post=post, image="p/2", order=2)
+
+        def fake_urlopen(url, timeout):
+            if "p/2" in url:
+                raise OSError("404")
+            return BytesIO(buffer.getvalue())
+
+        call_command("backfill_image_placeholders", "--dry-run")
+        assert "2 images" in capsys.readouterr().out
+
+        with patch(
+            "app.management.commands.backfill_image_placeholders.urlopen",
+            fake_urlopen,
+        ):
+            call_command("backfill_image_placeholders", "--batch-size", "1")
+
+        done.refresh_from_db()
+        broken.refresh_from_db()
+        assert (done.width, done.height) == (600, 400)
+        assert done.placeholder.startswith("data:image/")
+        assert broken.width is None
+        assert "updated 1 images (1 errors)" in capsys.readouterr().out
+
+
 class TestLikeModel:
     """Tests for Like model."""
 
@@ -0,0 +1,50 @@
+"""Tests for DJGramm cursor pagination."""
+
+import pytest
+
+from app.models import Post
+from app.pagination import decode_cursor, encode_cursor, paginate_by_cursor
+
+
+class TestCursor:
+    """Tests for cursor encoding."""
+
+    def test_round_trip(self, post):
+        """Test a cursor decodes to the post's position."""
+        assert decode_cursor(encode_cursor(post)) == (post.created_at, post.pk)
+
+    @pytest.mark.parametrize("cursor", ["!!!", "YWJj", ""])
+    def test_invalid_cursor(self, cursor):
+        """Test malformed cursors raise ValueError."""
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+
+class TestPaginateByCursor:
+    """Tests for paginate_by_cursor."""
+
+    def test_walks_all_posts_once(self, user):
+        """Test following cursors visits every post exactly once."""
+        posts = [Post.objects.create(author=user) for _ in range(7)]
+        # Same timestamp for several posts must not skip or repeat any
+        Post.objects.filter(pk__in=[p.pk for p in posts[:4]]).update(
+            created_at=posts[0].created_at
+        )
+
+        seen = []
+        cursor = None
+        while True:
+            page = paginate_by_cursor(Post.objects.all(), cursor, 3)
+            seen.extend(post.pk for post in page.items)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        assert sorted(seen) == sorted(p.pk for p in posts)
+        assert len(seen) == len(set(seen))
+
+    def test_last_page_has_no_cursor(self, user):
+        """Test an exactly full last page has no next cursor."""
+        for _ in range(3):
+            Post.objects.create(author=user)
+        page = paginate_by_cursor(Post.objects.all(), None, 3)
+        assert page.next_cursor is None
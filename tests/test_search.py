@@ -0,0 +1,119 @@
+"""Tests for caption search."""
+
+import pytest
+from django.urls import reverse
+
+from app.models import Post
+from app.search import fts5_query, highlight, search_posts
+
+
+@pytest.fixture
+def captions(user):
+    """Create posts with captions to search."""
+    return {
+        name: Post.objects.create(author=user, caption=caption)
+        for name, caption in {
+            "beach": "Sunset over the beach",
+            "sunsets": "Sunsets, sunsets and more sunsets at the beach",
+            "mountain": "Hiking in the mountains",
+            "html": "<script>alert(1)</script> sunset",
+        }.items()
+    }
+
+
+class TestHelpers:
+    """Tests for query building and highlighting."""
+
+    def test_fts5_query_quotes_words(self):
+        """Test that FTS5 syntax in input is searched as text."""
+        assert fts5_query('sun* "beach" OR NEAR(') == (
+            '"sun" "beach" "OR" "NEAR"'
+        )
+        assert fts5_query('"*"') == ""
+
+    def test_highlight_escapes(self):
+        """Test that only match markers become markup."""
+        assert highlight("<b>\x02sun\x03</b>") == (
+            "&lt;b&gt;<mark>sun</mark>&lt;/b&gt;"
+        )
+
+
+@pytest.mark.django_db
+class TestSearchPosts:
+    """Tests for search_posts() on SQLite FTS5."""
+
+    def test_ranking(self, captions):
+        """Test that matches are found by stem and ranked."""
+        results = search_posts("sunset")
+        assert [r.post for r in results][0] == captions["sunsets"]
+        assert {r.post for r in results} == {
+            captions["beach"],
+            captions["sunsets"],
+            captions["html"],
+        }
+        ranks = [r.rank for r in results]
+        assert ranks == sorted(ranks, reverse=True)
+
+    def test_all_words_required(self, captions):
+        """Test that every word must match."""
+        results = search_posts("sunset beach")
+        assert {r.post for r in results} == {
+            captions["beach"],
+            captions["sunsets"],
+        }
+
+    def test_headline(self, captions):
+        """Test that headlines mark matches and escape captions."""
+        (result,) = search_posts("alert")
+        assert result.headline == (
+            "&lt;script&gt;<mark>alert</mark>(1)&lt;/script&gt; sunset"
+        )
+
+    def test_follows_caption_changes(self, captions):
+        """Test that updated and deleted captions are reindexed."""
+        post = captions["mountain"]
+        post.caption = "Sunset from the mountains"
+        post.save()
+        captions["beach"].delete()
+
+        results = search_posts("sunset mountain")
+        assert [r.post for r in results] == [post]
+        assert captions["beach"] not in [
+            r.post for r in search_posts("sunset")
+        ]
+        assert search_posts("hiking") == []
+
+    def test_limit_and_empty(self, captions):
+        """Test the result limit and empty queries."""
+        assert len(search_posts("sunset", limit=1)) == 1
+        assert search_posts("   ") == []
+        assert search_posts("!!!") == []
+
+
+@pytest.mark.django_db
+class TestSearchView:
+    """Tests for the search endpoint."""
+
+    def test_results(self, client, captions, user):
+        """Test that results carry post links and headlines."""
+        response = client.get(reverse("search"), {"q": "hiking"})
+        assert response.status_code == 200
+        (result,) = response.json()["results"]
+        post = captions["mountain"]
+        assert result["id"] == post.pk
+        assert result["url"] == post.get_absolute_url()
+        assert result["author"] == user.username
+        assert result["headline"] == "<mark>Hiking</mark> in the mountains"
+
+    def test_limit(self, client, captions, settings):
+        """Test that the limit is capped and validated."""
+        settings.SEARCH_MAX_RESULTS = 2
+        response = client.get(reverse("search"), {"q": "sunset", "limit": 9})
+        assert len(response.json()["results"]) == 2
+        response = client.get(reverse("search"), {"q": "x", "limit": "a"})
+        assert response.status_code == 400
+
+    def test_method(self, client):
+        """Test that only GET is allowed."""
+        response = client.post(reverse("search"), {"q": "sunset"})
+        assert response.status_code == 405
@@ -1,18 +1,26 @@
 """Tests for DJGramm services."""
 
+import random
 from io import BytesIO
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
+import pytest
 from django.core.files.uploadedfile import SimpleUploadedFile
 from PIL import Image
 
+from app.models import PostImage
 from app.services import (
     ALLOWED_IMAGE_TYPES,
     MAX_IMAGE_SIZE,
+    ORDER_GAP,
     create_or_get_tags,
     extract_hashtags,
+    find_duplicate_images,
     generate_thumbnail,
+    plan_image_order,
+    process_post_images,
     process_uploaded_image,
+    reorder_post_images,
     sync_post_tags,
     validate_image,
 )
@@ -187,6 +195,142 @@ class TestProcessUploadedImage:
         assert result_img.size[1] == 500
 
 
+class TestProcessPostImages:
+    """Tests for process_post_images function."""
+
+    def create_upload(self, name, size=(2000, 1000), format="PNG"):
+        """Helper to create an uploaded image file."""
+        img = Image.new("RGB", size, color="blue")
+        buffer = BytesIO()
+        img.save(buffer, format=format)
+        return SimpleUploadedFile(name, buffer.getvalue(), "image/png")
+
+    def test_resizes_to_jpeg(self, user):
+        """Test that every image is resized and re-encoded as JPEG."""
+        images = [
+            PostImage(image=self.create_upload("a.png")),
+            PostImage(image=self.create_upload("b.png", size=(300, 300))),
+        ]
+
+        errors = process_post_images(images, user)
+
+        assert errors == []
+        assert [img.image.name for img in images] == ["a.jpg", "b.jpg"]
+        sizes = [Image.open(img.image).size for img in images]
+        assert sizes == [(1080, 540), (300, 300)]
+        assert [(img.width, img.height) for img in images] == sizes
+        assert all(img.placeholder.startswith("data:image/") for img in images)
+
+    def test_drops_broken_images(self, user):
+        """Test that unreadable images are removed and reported."""
+        broken = SimpleUploadedFile("broken.png", b"not an image", "image/png")
+        images = [
+            PostImage(image=broken),
+            PostImage(image=self.create_upload("ok.png")),
+        ]
+
+        errors = process_post_images(images, user)
+
+        assert errors == ["Could not process broken.png."]
+        assert [img.image.name for img in images] == ["ok.jpg"]
+
+    def test_empty_list(self):
+        """Test that no images means no work."""
+        assert process_post_images([], None) == []
+
+    def test_stores_phash(self, user):
+        """Test the perceptual hash and its blocks are set."""
+        images = [PostImage(image=self.create_upload("a.png"))]
+        process_post_images(images, user)
+
+        image = images[0]
+        assert image.get_phash() is not None
+        assert image.phash_blocks(image.get_phash()) == [
+            image.phash_0,
+            image.phash_1,
+            image.phash_2,
+            image.phash_3,
+        ]
+
+    def test_reuses_duplicate_of_own_image(self, user, post):
+        """Test a re-upload reuses the stored asset without encoding."""
+        first = [PostImage(image=self.create_upload("a.png"))]
+        process_post_images(first, user)
+        existing = first[0]
+        existing.post = post
+        existing.image = "posts/existing"
+        existing.save()
+
+        again = [PostImage(image=self.create_upload("copy.png"))]
+        with patch("app.services.process_image_bytes") as encode:
+            assert process_post_images(again, user) == []
+        encode.assert_not_called()
+
+        assert str(again[0].image) == "posts/existing"
+        assert (again[0].width, again[0].height) == (1080, 540)
+        assert again[0].placeholder == existing.placeholder
+        assert again[0].phash == existing.phash
+
+    def test_no_reuse_across_users(self, user, user2, post):
+        """Test images of other users are never reused."""
+        first = [PostImage(image=self.create_upload("a.png"))]
+        process_post_images(first, user)
+        first[0].post = post
+        first[0].image = "posts/existing"
+        first[0].save()
+
+        other = [PostImage(image=self.create_upload("copy.png"))]
+        process_post_images(other, user2)
+        assert other[0].image.name == "copy.jpg"
+
+
+class TestFindDuplicateImages:
+    """Tests for find_duplicate_images function."""
+
+    def create_image(self, post, phash):
+        """Helper to create an image with the given hash."""
+        image = PostImage(post=post, image=f"p/{phash:x}")
+        image.set_phash(phash)
+        image.save()
+        return image
+
+    def test_within_distance(self, post, user):
+        """Test hashes up to PHASH_MAX_DISTANCE bits apart match."""
+        phash = 0xF0F0_F0F0_F0F0_F0F0
+        image = self.create_image(post, phash)
+        # One flipped bit in three of the four blocks
+        near = phash ^ (1 | 1 << 20 | 1 << 40)
+        assert find_duplicate_images(user, [near]) == {near: image}
+
+    def test_beyond_distance(self, post, user):
+        """Test hashes further apart do not match."""
+        phash = 0xF0F0_F0F0_F0F0_F0F0
+        self.create_image(post, phash)
+        far = phash ^ (1 | 1 << 20 | 1 << 40 | 1 << 60)
+        assert find_duplicate_images(user, [far]) == {}
+
+    def test_closest_wins(self, post, user):
+        """Test the closest of several candidates is returned."""
+        phash = 0x1234_5678_9ABC_DEF0
+        self.create_image(post, phash ^ 0b11)
+        exact = self.create_image(post, phash)
+        assert find_duplicate_images(user, [phash]) == {phash: exact}
+
+    def test_high_bit_hashes(self, post, user):
+        """Test hashes above 2**63 survive the signed column."""
+        phash = 0xFFFF_0000_FFFF_0000
+        image = self.create_image(post, phash)
+        image.refresh_from_db()
+        assert image.get_phash() == phash
+        assert find_duplicate_images(user, [phash]) == {phash: image}
+
+    def test_one_query(self, post, user, django_assert_num_queries):
+        """Test lookups for many hashes take a single query."""
+        self.create_image(post, 1)
+        with django_assert_num_queries(1):
+            find_duplicate_images(user, range(10))
+
+
 class TestConstants:
     """Tests for service constants."""
 
@@ -260,6 +404,15 @@ class TestCreateOrGetTags:
         tags = create_or_get_tags(set())
         assert len(tags) == 0
 
+    def test_query_count_independent_of_tags(
+        self, db, tag, django_assert_num_queries
+    ):
+        """Test existing and new tags are resolved in three queries."""
+        names = {tag.name} | {f"new{i}" for i in range(20)}
+        with django_assert_num_queries(3):
+            tags = create_or_get_tags(names)
+        assert len(tags) == 21
+
 
 class TestSyncPostTags:
     """Tests for sync_post_tags function."""
@@ -302,3 +455,78 @@ class TestSyncPostTags:
         # Should create only one tag
         assert post.tags.count() == 1
         assert post.tags.filter(slug="travel").exists()
+
+
+class TestPlanImageOrder:
+    """Tests for plan_image_order function."""
+
+    def apply(self, current, image_ids):
+        """Return ids sorted by their order keys after the plan."""
+        orders = {**current, **plan_image_order(current, image_ids)}
+        return sorted(orders, key=orders.get)
+
+    def test_unchanged_order(self):
+        """Test the current order needs no writes."""
+        current = {1: 0, 2: ORDER_GAP, 3: 2 * ORDER_GAP}
+        assert plan_image_order(current, [1, 2, 3]) == {}
+
+    def test_move_one_rewrites_one(self):
+        """Test moving a single image changes only its key."""
+        current = {pk: (pk + 1) * ORDER_GAP for pk in range(10)}
+        ids = [9, 0, 1, 2, 3, 4, 5, 6, 7, 8]
+        assert len(plan_image_order(current, ids)) == 1
+        assert self.apply(current, ids) == ids
+
+    def test_move_to_end(self):
+        """Test moving the first image last."""
+        current = {1: 0, 2: ORDER_GAP, 3: 2 * ORDER_GAP}
+        assert plan_image_order(current, [2, 3, 1]) == {1: 3 * ORDER_GAP}
+
+    def test_respaces_without_room(self):
+        """Test dense keys are respaced when no gap is left."""
+        current = {1: 0, 2: 1, 3: 2}
+        assert self.apply(current, [1, 3, 2]) == [1, 3, 2]
+
+    def test_random_permutations(self):
+        """Test any permutation yields the requested order."""
+        rng = random.Random(0)
+        current = {pk: pk * ORDER_GAP for pk in range(10)}
+        for _ in range(50):
+            ids = list(current)
+            rng.shuffle(ids)
+            current = {**current, **plan_image_order(current, ids)}
+            assert sorted(current, key=current.get) == ids
+
+
+class TestReorderPostImages:
+    """Tests for reorder_post_images function."""
+
+    def create_images(self, post, count):
+        """Create count images on post with gapped keys."""
+        return [
+            PostImage.objects.create(
+                post=post, image=f"p/{i}", order=(i + 1) * ORDER_GAP
+            )
+            for i in range(count)
+        ]
+
+    def test_reorder(self, post, django_assert_num_queries):
+        """Test reordering takes one read and one write."""
+        images = self.create_images(post, 5)
+        ids = [image.pk for image in reversed(images)]
+        with django_assert_num_queries(2):
+            reorder_post_images(post, ids)
+        assert list(post.images.values_list("pk", flat=True)) == ids
+
+    @pytest.mark.parametrize("extra", [[], [999999]])
+    def test_rejects_other_images(self, post, extra):
+        """Test lists missing or adding images are rejected."""
+        images = self.create_images(post, 2)
+        with pytest.raises(ValueError):
+            reorder_post_images(post, [images[0].pk, *extra])
+
+    def test_rejects_duplicates(self, post):
+        """Test an image listed twice is rejected."""
+        images = self.create_images(post, 2)
+        with pytest.raises(ValueError):
+            reorder_post_images(post, [images[0].pk, images[0].pk])
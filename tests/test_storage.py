@@ -0,0 +1,167 @@
+"""Tests for content-addressed media storage."""
+
+import hashlib
+import os
+
+import pytest
+from cloudinary import CloudinaryResource
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+
+from app.models import Post, PostImage
+from app.storage import (
+    ContentAddressedStorage,
+    content_key,
+    local_media_path,
+    media_key,
+    parse_content_key,
+)
+from app.templatetags.app_tags import get_image_url
+
+DATA = b"some image bytes"
+DIGEST = hashlib.sha256(DATA).hexdigest()
+KEY = f"{DIGEST[:2]}/{DIGEST[2:4]}/{DIGEST}.jpg"
+
+
+@pytest.fixture
+def storage(tmp_path):
+    """Return a content-addressed storage in a temporary directory."""
+    return ContentAddressedStorage(location=tmp_path, base_url="/media/")
+
+
+class TestContentKeys:
+    """Tests for content key helpers."""
+
+    def test_content_key_is_sharded(self):
+        """Test that keys are sharded by the first hash bytes."""
+        assert content_key(DIGEST, ".JPG") == KEY
+
+    def test_parse_content_key(self):
+        """Test that content keys are parsed and other names are not."""
+        match = parse_content_key(KEY)
+        assert match["digest"] == DIGEST
+        assert match["ext"] == ".jpg"
+        assert parse_content_key(f"{KEY[:-4]}_300x300.webp") is None
+        assert parse_content_key("posts/tiger_OccEUCo.jpg") is None
+        assert parse_content_key("../etc/passwd") is None
+
+    def test_media_key_of_resource(self):
+        """Test that media_key joins public_id and format."""
+        resource = CloudinaryResource(KEY[:-4], format="jpg")
+        assert media_key(resource) == KEY
+        assert media_key("") is None
+
+    def test_local_media_path(self, local_media):
+        """Test that only content keys map to local paths."""
+        assert local_media_path(KEY) == str(local_media / KEY)
+        assert local_media_path("posts/tiger") is None
+
+
+class TestContentAddressedStorage:
+    """Tests for ContentAddressedStorage."""
+
+    def test_save_names_file_by_hash(self, storage, tmp_path):
+        """Test that saved files are named by the SHA-256 of the content."""
+        key = storage.save("photo.JPG", ContentFile(DATA))
+        assert key == KEY
+        assert (tmp_path / KEY).read_bytes() == DATA
+
+    def test_same_content_stored_once(self, storage, tmp_path):
+        """Test that identical uploads share one file."""
+        first = storage.save("a.jpg", ContentFile(DATA))
+        second = storage.save("b.jpg", ContentFile(DATA))
+        assert first == second
+        files = [
+            name
+            for _, _, names in os.walk(tmp_path / KEY[:2])
+            for name in names
+        ]
+        assert files == [f"{DIGEST}.jpg"]
+        assert os.listdir(tmp_path / ".incoming") == []
+
+    def test_same_content_refreshes_mtime(self, storage, tmp_path):
+        """Test that saving stored content restarts its grace period."""
+        storage.save("a.jpg", ContentFile(DATA))
+        os.utime(tmp_path / KEY, (0, 0))
+        storage.save("b.jpg", ContentFile(DATA))
+        assert (tmp_path / KEY).stat().st_mtime > 0
+
+    def test_different_content_different_keys(self, storage):
+        """Test that different content gets different keys."""
+        first = storage.save("a.jpg", ContentFile(DATA))
+        second = storage.save("a.jpg", ContentFile(DATA + b"!"))
+        assert first != second
+
+    def test_get_available_name_unchanged(self, storage):
+        """Test that names are never made unique."""
+        assert storage.get_available_name(KEY) == KEY
+
+
+@pytest.mark.django_db
+class TestMediaField:
+    """Tests for MediaField with the local backend."""
+
+    def test_upload_saved_under_content_key(self, local_media, user):
+        """Test that uploads are stored locally under their hash."""
+        post = Post.objects.create(author=user, caption="Local")
+        image = PostImage.objects.create(
+            post=post,
+            image=SimpleUploadedFile("photo.jpg", DATA, "image/jpeg"),
+        )
+        assert media_key(image.image) == KEY
+        assert (local_media / KEY).read_bytes() == DATA
+
+        image.refresh_from_db()
+        assert media_key(image.image) == KEY
+        assert get_image_url(image.image) == f"/media/{KEY}"
+
+
+@pytest.mark.django_db
+class TestServeMedia:
+    """Tests for the serve_media view."""
+
+    @pytest.fixture
+    def stored(self, local_media):
+        """Store DATA and return its key."""
+        path = local_media / KEY
+        path.parent.mkdir(parents=True)
+        path.write_bytes(DATA)
+        return KEY
+
+    def test_serves_file(self, client, stored):
+        """Test that files are served with an immutable ETag."""
+        response = client.get(reverse("media", args=[stored]))
+        assert response.status_code == 200
+        assert b"".join(response.streaming_content) == DATA
+        assert response["Content-Type"] == "image/jpeg"
+        assert response["ETag"] == f'"{DIGEST}"'
+        assert "immutable" in response["Cache-Control"]
+
+    def test_not_modified(self, client, stored):
+        """Test that a matching If-None-Match gets 304."""
+        response = client.get(
+            reverse("media", args=[stored]),
+            HTTP_IF_NONE_MATCH=f'"{DIGEST}"',
+        )
+        assert response.status_code == 304
+
+    def test_accel_redirect(self, client, settings, stored):
+        """Test that nginx serves the file when configured."""
+        settings.MEDIA_ACCEL_REDIRECT = "/internal-media/"
+        response = client.get(reverse("media", args=[stored]))
+        assert response.status_code == 200
+        assert response["X-Accel-Redirect"] == f"/internal-media/{stored}"
+        assert response.content == b""
+
+    def test_missing_file(self, client, local_media):
+        """Test that missing files return 404."""
+        response = client.get(reverse("media", args=[KEY]))
+        assert response.status_code == 404
+
+    def test_path_traversal(self, client, local_media):
+        """Test that paths outside the storage root return 404."""
+        response = client.get("/media/../../etc/passwd")
+        assert response.status_code == 404
+        response = client.get(reverse("media", args=["a/../../etc/passwd"]))
+        assert response.status_code == 404
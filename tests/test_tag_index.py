@@ -0,0 +1,205 @@
+"""Tests for the in-memory tag prefix index."""
+
+import pytest
+from django.core.cache import cache
+from django.urls import reverse
+
+from app import tag_index
+from app.models import Post, Tag
+from app.services import sync_post_tags
+from app.tag_index import TagPrefixIndex, get_tag_index, reset_tag_index
+
+
+@pytest.fixture(autouse=True)
+def fresh_index():
+    """Start and end every test without a process-wide index."""
+    reset_tag_index()
+    yield
+    reset_tag_index()
+
+
+@pytest.fixture
+def small_scans(monkeypatch):
+    """Precompute top names for prefixes of more than two tags."""
+    monkeypatch.setattr(tag_index, "SCAN_LIMIT", 2)
+    monkeypatch.setattr(tag_index, "TOP_K", 3)
+
+
+@pytest.fixture
+def rebuilds(monkeypatch):
+    """Record rebuilds instead of starting them."""
+    started = []
+    monkeypatch.setattr(
+        tag_index, "_start_rebuild", lambda: started.append(True)
+    )
+    return started
+
+
+def current_generation():
+    """Return the number of the last published change."""
+    return cache.get(tag_index.generation_key(tag_index.tag_index_scope()))
+
+
+def publish_elsewhere(change):
+    """Publish change the way another process would, return its number."""
+    number = cache.incr(tag_index.generation_key(tag_index.tag_index_scope()))
+    cache.set(tag_index.change_key(number), change)
+    return number
+
+
+ITEMS = [
+    ("travel", 50),
+    ("Travel", 5),
+    ("trees", 20),
+    ("train", 30),
+    ("tram", 1),
+    ("tr", 2),
+    ("sun", 40),
+]
+
+
+class TestTagPrefixIndex:
+    """Tests for TagPrefixIndex."""
+
+    def test_suggest(self):
+        """Test that tags are suggested by prefix, most used first."""
+        index = TagPrefixIndex(ITEMS)
+        assert index.suggest("TR") == [
+            ("travel", 55),
+            ("train", 30),
+            ("trees", 20),
+            ("tr", 2),
+            ("tram", 1),
+        ]
+        assert index.suggest("tra", limit=2) == [
+            ("travel", 55),
+            ("train", 30),
+        ]
+        assert index.suggest("x") == []
+
+    def test_precomputed_prefixes(self, small_scans):
+        """Test that large prefixes answer from precomputed names."""
+        index = TagPrefixIndex(ITEMS)
+        assert index.top["tr"] == ["travel", "train", "trees"]
+        assert index.top["tra"] == ["travel", "train", "tram"]
+        assert "s" not in index.top
+        assert index.suggest("") == [
+            ("travel", 55),
+            ("sun", 40),
+            ("train", 30),
+        ]
+
+    def test_update(self, small_scans):
+        """Test that count changes and new tags reach the top names."""
+        index = TagPrefixIndex(ITEMS)
+        index.update("tram", 100)
+        index.update("trail", 40)
+        assert index.suggest("tra") == [
+            ("tram", 101),
+            ("travel", 55),
+            ("trail", 40),
+        ]
+        index.update("tram", -1000)
+        assert index.suggest("tram") == [("tram", 0)]
+
+    def test_remove(self, small_scans):
+        """Test that removed tags are no longer suggested."""
+        index = TagPrefixIndex(ITEMS)
+        index.remove("Travel")
+        assert index.suggest("tra") == [("train", 30), ("tram", 1)]
+        assert len(index) == 5
+
+
+@pytest.mark.django_db
+class TestProcessIndex:
+    """Tests for the process-wide index and its signals."""
+
+    def test_built_from_database(self, post, user):
+        """Test that the index counts posts per tag."""
+        sync_post_tags(post, "#sunset #beach")
+        other = Post.objects.create(author=user, caption="")
+        sync_post_tags(other, "#sunset")
+        Tag.objects.create(name="sunrise", slug="sunrise")
+        assert get_tag_index().suggest("sun") == [
+            ("sunset", 2),
+            ("sunrise", 0),
+        ]
+
+    def test_follows_changes(self, post, user):
+        """Test that tag and post changes update a built index."""
+        index = get_tag_index()
+        sync_post_tags(post, "#sunset #beach")
+        assert index.suggest("s") == [("sunset", 1)]
+
+        other = Post.objects.create(author=user, caption="")
+        sync_post_tags(other, "#sunset")
+        sync_post_tags(post, "#beach")
+        assert index.suggest("s") == [("sunset", 1)]
+
+        other.delete()
+        assert index.suggest("s") == [("sunset", 0)]
+        Tag.objects.get(name="sunset").delete()
+        assert index.suggest("s") == []
+
+    def test_applies_changes_from_elsewhere(self, settings, rebuilds):
+        """Test that changes of other processes apply without a rebuild."""
+        settings.TAG_INDEX_REFRESH_INTERVAL = 0
+        index = get_tag_index()
+        publish_elsewhere({"deltas": {"sunset": 3, "sun": 0}})
+        publish_elsewhere({"removed": ["sun"]})
+        assert get_tag_index() is index
+        assert index.suggest("s") == [("sunset", 3)]
+        assert rebuilds == []
+
+    def test_own_changes_not_applied_twice(self, settings, rebuilds, post):
+        """Test that the writer neither rebuilds nor recounts its changes."""
+        settings.TAG_INDEX_REFRESH_INTERVAL = 0
+        index = get_tag_index()
+        sync_post_tags(post, "#sunset")
+        assert get_tag_index() is index
+        assert index.suggest("s") == [("sunset", 1)]
+        assert rebuilds == []
+        assert tag_index._generation == current_generation()
+
+    def test_rebuilds_when_changes_lost(self, settings, rebuilds):
+        """Test that a change missing at two checks starts a rebuild."""
+        settings.TAG_INDEX_REFRESH_INTERVAL = 0
+        get_tag_index()
+        number = publish_elsewhere({"deltas": {"sunset": 1}})
+        cache.delete(tag_index.change_key(number))
+        get_tag_index()
+        assert rebuilds == []
+        get_tag_index()
+        assert rebuilds == [True]
+
+    def test_rebuilds_when_asked(self, settings, rebuilds, tag):
+        """Test that renaming a tag makes every process rebuild."""
+        settings.TAG_INDEX_REFRESH_INTERVAL = 0
+        get_tag_index()
+        tag.name = "renamed"
+        tag.save()
+        get_tag_index()
+        assert rebuilds == [True]
+
+
+@pytest.mark.django_db
+class TestTagAutocompleteView:
+    """Tests for the autocomplete endpoint."""
+
+    def test_results(self, client, post):
+        """Test that suggestions carry names and counts."""
+        sync_post_tags(post, "#travel #trees")
+        response = client.get(reverse("tag_autocomplete"), {"q": "#Tr"})
+        assert response.status_code == 200
+        assert response.json() == {
+            "results": [
+                {"name": "travel", "count": 1},
+                {"name": "trees", "count": 1},
+            ]
+        }
+        assert "max-age" in response["Cache-Control"]
+
+    def test_empty_prefix(self, client):
+        """Test that an empty prefix suggests nothing."""
+        response = client.get(reverse("tag_autocomplete"), {"q": "#"})
+        assert response.json() == {"results": []}
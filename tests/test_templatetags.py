@@ -0,0 +1,98 @@
+"""Tests for DJGramm template tags."""
+
+import pytest
+from cloudinary import CloudinaryResource
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+from django.utils.html import escape
+
+from app.image_proxy import image_proxy_url
+from app.models import PostImage
+from app.storage import media_key
+from app.templatetags.app_tags import picture
+
+
+@pytest.fixture
+def cloudinary_image():
+    """Cloudinary resource as loaded from the database."""
+    return CloudinaryResource("posts/abc", format="jpg", version="1")
+
+
+class TestPictureTag:
+    """Tests for the picture template tag."""
+
+    def test_sources_in_configured_order(self, cloudinary_image, settings):
+        """Test one source per rendition format before the fallback."""
+        settings.IMAGE_RENDITION_FORMATS = ["avif", "webp"]
+        html = picture(cloudinary_image, alt="Photo")
+
+        assert html.startswith("<picture>")
+        avif = html.index('<source type="image/avif" srcset="')
+        webp = html.index('<source type="image/webp" srcset="')
+        fallback = html.index('<img src="')
+        assert avif < webp < fallback
+        assert "posts/abc.avif" in html
+        assert "posts/abc.webp" in html
+        assert "posts/abc.jpg" in html
+
+    def test_img_attributes(self, cloudinary_image):
+        """Test attributes are escaped and underscores become hyphens."""
+        html = picture(cloudinary_image, alt='a "b"', data_index=2)
+        assert 'alt="a &quot;b&quot;"' in html
+        assert 'data-index="2"' in html
+
+    def test_placeholder_and_size(self, cloudinary_image):
+        """Test the placeholder becomes the background and None is dropped."""
+        html = picture(
+            cloudinary_image,
+            width=640,
+            height=None,
+            placeholder="data:image/webp;base64,AAAA",
+        )
+        assert 'width="640"' in html
+        assert "height" not in html
+        assert 'style="background: url(data:image/webp;base64,AAAA)' in html
+
+    def test_local_file_plain_img(self, settings, tmp_path):
+        """Test images served from MEDIA_ROOT get no sources."""
+        settings.DEFAULT_FILE_STORAGE = (
+            "django.core.files.storage.FileSystemStorage"
+        )
+        settings.MEDIA_ROOT = tmp_path
+        (tmp_path / "posts").mkdir()
+        (tmp_path / "posts" / "abc.jpg").write_bytes(b"x")
+
+        html = picture(CloudinaryResource("posts/abc"), alt="Photo")
+
+        assert (
+            html
+            == f'<img src="{settings.MEDIA_URL}posts/abc.jpg" alt="Photo">'
+        )
+
+    @pytest.mark.django_db
+    def test_local_post_image_proxy_sources(self, local_media, settings, post):
+        """Test that local post images get sources from the image proxy."""
+        settings.IMAGE_RENDITION_FORMATS = ["webp"]
+        image = PostImage.objects.create(
+            post=post,
+            image=SimpleUploadedFile("photo.jpg", b"x", "image/jpeg"),
+        )
+        size = settings.IMAGE_MAX_DIMENSION
+        proxy_url = image_proxy_url(image, size, size, "webp")
+
+        html = picture(image.image, post_image=image, alt="Photo")
+
+        assert html == (
+            f'<picture><source type="image/webp" srcset="{escape(proxy_url)}">'
+            f'<img src="/media/{media_key(image.image)}" alt="Photo"></picture>'
+        )
+
+    def test_in_template(self, cloudinary_image):
+        """Test the tag with template filters as arguments."""
+        template = Template(
+            '{% load app_tags %}{% picture image alt="By "|add:name class="w" %}'
+        )
+        html = template.render(
+            Context({"image": cloudinary_image, "name": "x"})
+        )
+        assert 'alt="By x" class="w"' in html
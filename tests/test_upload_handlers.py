@@ -0,0 +1,167 @@
+"""Tests for DJGramm upload handlers."""
+
+import zlib
+from io import BytesIO
+
+import pytest
+from django.contrib.messages import get_messages
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopUpload
+from django.test import RequestFactory
+from django.urls import reverse
+from PIL import Image
+
+from app.models import Post
+from app.services import MAX_IMAGE_SIZE
+from app.upload_handlers import HEADER_MAX_BYTES, ImageUploadHandler
+
+
+def make_image(size=(100, 100), format="JPEG"):
+    """Return encoded image bytes."""
+    buffer = BytesIO()
+    Image.new("RGB", size, color="red").save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def make_png_header(width, height):
+    """Return the start of a PNG claiming the given size."""
+    ihdr = (
+        b"IHDR"
+        + width.to_bytes(4, "big")
+        + height.to_bytes(4, "big")
+        + b"\x08\x02\0\0\0"
+    )
+    crc = zlib.crc32(ihdr).to_bytes(4, "big")
+    # Pillow stops reading at the first IDAT chunk
+    return b"\x89PNG\r\n\x1a\n\0\0\0\r" + ihdr + crc + b"\0\x01\0\0IDAT"
+
+
+class TestImageUploadHandler:
+    """Tests for ImageUploadHandler."""
+
+    @pytest.fixture
+    def handler(self):
+        """Handler bound to a fresh request, with one file started."""
+        handler = ImageUploadHandler(RequestFactory().post("/"))
+        handler.new_file("image", "photo.jpg", "image/jpeg", None)
+        return handler
+
+    def feed(self, handler, data, chunk_size=64 * 1024):
+        """Send data through the handler in chunks."""
+        for start in range(0, len(data), chunk_size):
+            handler.receive_data_chunk(data[start : start + chunk_size], start)
+        return handler.file_complete(len(data))
+
+    @pytest.mark.parametrize("format", ["JPEG", "PNG", "WEBP"])
+    def test_accepts_images(self, handler, format):
+        """Test valid images pass and are left to the next handler."""
+        assert self.feed(handler, make_image(format=format)) is None
+        assert handler.checked is True
+        assert not hasattr(handler.request, "upload_errors")
+
+    def test_passes_chunks_through(self, handler):
+        """Test chunks are returned unchanged."""
+        data = make_image()
+        assert handler.receive_data_chunk(data, 0) == data
+
+    def test_rejects_non_image(self, handler):
+        """Test a non-image stops the upload on the first chunk."""
+        with pytest.raises(StopUpload) as exc_info:
+            handler.receive_data_chunk(b"GIF89a" + b"\0" * 100, 0)
+        assert exc_info.value.connection_reset is True
+        assert handler.request.upload_errors == [
+            "photo.jpg: Not a JPEG, PNG or WebP image."
+        ]
+
+    def test_rejects_bomb_from_header(self, handler):
+        """Test a huge pixel count is rejected from the header alone."""
+        with pytest.raises(StopUpload):
+            handler.receive_data_chunk(make_png_header(20000, 20000), 0)
+        assert "too many pixels" in handler.request.upload_errors[0]
+
+    def test_rejects_pixels_over_cap(self, handler):
+        """Test images over IMAGE_MAX_PIXELS but under Pillow's limit."""
+        with pytest.raises(StopUpload):
+            handler.receive_data_chunk(make_png_header(9000, 9000), 0)
+        assert "too many pixels" in handler.request.upload_errors[0]
+
+    def test_pixel_cap_setting(self, handler, settings):
+        """Test the cap comes from IMAGE_MAX_PIXELS."""
+        settings.IMAGE_MAX_PIXELS = 50 * 50
+        with pytest.raises(StopUpload):
+            handler.receive_data_chunk(make_image((100, 100)), 0)
+
+    def test_rejects_oversized_stream(self, handler):
+        """Test the upload stops once MAX_IMAGE_SIZE bytes have arrived."""
+        handler.receive_data_chunk(make_image(), 0)
+        chunk = b"\0" * (1024 * 1024)
+        with pytest.raises(StopUpload):
+            for i in range(MAX_IMAGE_SIZE // len(chunk) + 1):
+                handler.receive_data_chunk(chunk, i)
+        assert "too large" in handler.request.upload_errors[0]
+
+    def test_rejects_declared_length(self):
+        """Test a too-large Content-Length is rejected before any data."""
+        handler = ImageUploadHandler(RequestFactory().post("/"))
+        with pytest.raises(StopUpload):
+            handler.new_file(
+                "image", "big.jpg", "image/jpeg", MAX_IMAGE_SIZE + 1
+            )
+
+    def test_rejects_truncated_header(self, handler):
+        """Test a file ending inside its header is rejected."""
+        with pytest.raises(StopUpload):
+            self.feed(handler, make_image()[:100])
+        assert "corrupted" in handler.request.upload_errors[0]
+
+    def test_rejects_endless_header(self, handler):
+        """Test headers are not buffered beyond HEADER_MAX_BYTES."""
+        data = b"\xff\xd8\xff\xe1\xff\xff" + b"\0" * HEADER_MAX_BYTES
+        with pytest.raises(StopUpload):
+            self.feed(handler, data, chunk_size=16 * 1024)
+        assert len(handler.header) == HEADER_MAX_BYTES
+
+
+class TestRejectedUploads:
+    """Tests for rejected uploads in views."""
+
+    def test_create_post_with_bad_file(self, authenticated_client, user):
+        """Test the form is shown again and nothing is saved."""
+        url = reverse("post_create")
+        response = authenticated_client.post(
+            url,
+            {
+                "caption": "Hello",
+                "images-TOTAL_FORMS": "1",
+                "images-INITIAL_FORMS": "0",
+                "images-MIN_NUM_FORMS": "0",
+                "images-MAX_NUM_FORMS": "10",
+                "images-0-image": SimpleUploadedFile(
+                    "evil.jpg", b"<?php echo 1; ?>", "image/jpeg"
+                ),
+            },
+        )
+        assert response.status_code == 302
+        assert response.url == url
+        assert not Post.objects.filter(author=user).exists()
+        messages = [str(m) for m in get_messages(response.wsgi_request)]
+        assert messages == [
+            "Image error: evil.jpg: Not a JPEG, PNG or WebP image."
+        ]
+
+    def test_profile_avatar_bomb(self, authenticated_client, user):
+        """Test an avatar with too many pixels is rejected."""
+        response = authenticated_client.post(
+            reverse("profile_edit"),
+            {
+                "full_name": "Changed",
+                "avatar": SimpleUploadedFile(
+                    "a.png", make_png_header(30000, 30000), "image/png"
+                ),
+            },
+        )
+        assert response.status_code == 302
+        user.profile.refresh_from_db()
+        assert user.profile.full_name != "Changed"
+        messages = [str(m) for m in get_messages(response.wsgi_request)]
+        assert "too many pixels" in messages[0]
@@ -0,0 +1,104 @@
+"""Tests for user search."""
+
+import pytest
+from django.urls import reverse
+
+from app.models import User
+from app.user_search import rank_user, search_users, trigrams, word_similarity
+
+
+@pytest.fixture
+def people(db):
+    """Create users with full names to search."""
+    users = {}
+    for username, full_name in [
+        ("john", "John Smith"),
+        ("johnny_b", ""),
+        ("jsmith", "Jonathan Smithers"),
+        ("mary", "Mary Johnson"),
+        ("bob", "Robert Brown"),
+    ]:
+        user = User.objects.create_user(
+            email=f"{username}@example.com",
+            username=username,
+            password="pass12345",
+        )
+        user.profile.full_name = full_name
+        user.profile.save()
+        users[username] = user
+    return users
+
+
+class TestRanker:
+    """Tests for the Python trigram ranker."""
+
+    def test_trigrams(self):
+        """Test that trigrams match pg_trgm's padding and word split."""
+        assert trigrams("Jo") == {"  j", " jo", "jo "}
+        assert trigrams("a_b") == {"  a", " a ", "  b", " b "}
+
+    def test_word_similarity(self):
+        """Test the share of query trigrams found in text."""
+        assert word_similarity("smith", "john smith") == 1.0
+        assert word_similarity("smith", "jonathan smithers") == 5 / 6
+        assert word_similarity("", "john") == 0.0
+
+    def test_rank_user(self):
+        """Test that prefixes outrank similarity and misses are None."""
+        username = rank_user("jo", "john", "")
+        full_name = rank_user("jo", "al", "Jo Al")
+        similar = rank_user("smith", "x", "John Smith")
+        assert username < full_name < similar
+        assert rank_user("zzz", "john", "John Smith") is None
+
+
+@pytest.mark.django_db
+class TestSearchUsers:
+    """Tests for search_users() with the fallback ranker."""
+
+    def test_prefix_first(self, people):
+        """Test that username prefixes come before full name matches."""
+        usernames = [u.username for u in search_users("JOHN")]
+        assert usernames == ["john", "johnny_b", "mary"]
+
+    def test_similar_names(self, people):
+        """Test that words inside full names are found."""
+        usernames = [u.username for u in search_users("smith")]
+        assert usernames == ["john", "jsmith"]
+
+    def test_cap_and_inactive(self, people, settings):
+        """Test the result cap and that inactive users are left out."""
+        settings.USER_SEARCH_MAX_RESULTS = 1
+        assert [u.username for u in search_users("j")] == ["john"]
+        people["john"].is_active = False
+        people["john"].save()
+        assert [u.username for u in search_users("j", limit=5)] == [
+            "jsmith",
+            "johnny_b",
+        ]
+        assert search_users("  ") == []
+
+
+@pytest.mark.django_db
+class TestUserSearchView:
+    """Tests for the user search endpoint."""
+
+    def test_results(self, client, people):
+        """Test that suggestions link to profiles."""
+        response = client.get(reverse("user_search"), {"q": "bob"})
+        assert response.status_code == 200
+        assert response.json() == {
+            "results": [
+                {
+                    "username": "bob",
+                    "full_name": "Robert Brown",
+                    "url": reverse("profile", args=["bob"]),
+                    "avatar": "",
+                }
+            ]
+        }
+
+    def test_method(self, client):
+        """Test that only GET is allowed."""
+        response = client.post(reverse("user_search"), {"q": "bob"})
+        assert response.status_code == 405
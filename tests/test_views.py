@@ -1,8 +1,14 @@
 """Tests for DJGramm views."""
 
+from io import BytesIO
+from unittest.mock import patch
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
+from PIL import Image
 
-from app.models import Follow, Like, Post, User
+from app.models import Follow, Like, Post, PostImage, User
 
 
 class TestFeedView:
@@ -194,6 +200,52 @@ class TestProfileView:
         assert response.status_code == 200
         assert response.context["is_following"] is False
 
+    # =============================================================================
+    # Posts Grid
+    # =============================================================================
+
+    def test_profile_grid_paginated(self, client, user):
+        """Test the grid shows one page and links the next one."""
+        for i in range(30):
+            Post.objects.create(author=user, caption=f"Post {i}")
+        url = reverse("profile", kwargs={"username": user.username})
+        response = client.get(url)
+        page = response.context["posts_page"]
+        assert len(page.items) == 24
+        assert page.has_next
+        assert f"?cursor={page.next_cursor}" in response.content.decode()
+
+        response = client.get(url, {"cursor": page.next_cursor})
+        assert len(response.context["posts"]) == 6
+        assert response.context["posts_page"].has_next is False
+        assert response.context["posts_count"] == 30
+
+    def test_profile_grid_queries_independent_of_posts(
+        self, client, user, django_assert_max_num_queries
+    ):
+        """Test rendering the grid does not query per post."""
+        for i in range(30):
+            Post.objects.create(author=user, caption=f"Post {i}")
+        url = reverse("profile", kwargs={"username": user.username})
+        with django_assert_max_num_queries(12):
+            client.get(url)
+
+    def test_profile_grid_cover_image(self, client, post_with_image):
+        """Test grid cells show the first image of each post."""
+        url = reverse(
+            "profile", kwargs={"username": post_with_image.author.username}
+        )
+        response = client.get(url)
+        (post,) = response.context["posts"]
+        assert post.cover_image is not None
+        assert post.cover_image.image.url in response.content.decode()
+
+    def test_profile_invalid_cursor(self, client, user):
+        """Test a malformed cursor returns 404."""
+        url = reverse("profile", kwargs={"username": user.username})
+        response = client.get(url, {"cursor": "!!!"})
+        assert response.status_code == 404
+
 
 class TestProfileEditView:
     """Tests for ProfileEditView."""
@@ -267,6 +319,58 @@ class TestPostCreateView:
             author=user, caption="New post caption"
         ).exists()
 
+    def image_data(self, count):
+        """Return formset data uploading count images."""
+        data = {
+            "caption": "Trip #travel #sea",
+            "images-TOTAL_FORMS": str(count),
+            "images-INITIAL_FORMS": "0",
+            "images-MIN_NUM_FORMS": "0",
+            "images-MAX_NUM_FORMS": "10",
+        }
+        for i in range(count):
+            buffer = BytesIO()
+            Image.new("RGB", (10, 10), color="red").save(buffer, "JPEG")
+            data[f"images-{i}-image"] = SimpleUploadedFile(
+                f"{i}.jpg", buffer.getvalue(), content_type="image/jpeg"
+            )
+        return data
+
+    def test_create_post_with_images(
+        self, authenticated_client, user, mock_cloudinary_upload
+    ):
+        """Test images and tags are saved with the post."""
+        response = authenticated_client.post(
+            reverse("post_create"), self.image_data(3)
+        )
+        assert response.status_code == 302
+        post = Post.objects.get(author=user)
+        orders = list(post.images.values_list("order", flat=True))
+        assert orders == sorted(orders)
+        assert len(orders) == 3
+        assert post.cover_image == post.images.first()
+        assert set(post.tags.values_list("slug", flat=True)) == {
+            "travel",
+            "sea",
+        }
+        assert mock_cloudinary_upload.call_count == 3
+
+    def test_create_post_is_atomic(
+        self, authenticated_client, user, mock_cloudinary_upload
+    ):
+        """Test a failure while saving leaves no half-created post."""
+        with (
+            patch(
+                "app.views.sync_post_tags", side_effect=RuntimeError("boom")
+            ),
+            pytest.raises(RuntimeError),
+        ):
+            authenticated_client.post(
+                reverse("post_create"), self.image_data(2)
+            )
+        assert not Post.objects.filter(author=user).exists()
+        assert not PostImage.objects.exists()
+
 
 class TestPostUpdateView:
     """Tests for PostUpdateView."""
@@ -300,6 +404,30 @@ class TestPostUpdateView:
         post.refresh_from_db()
         assert post.caption == "Updated caption"
 
+    def test_update_adds_processed_image(
+        self, authenticated_client, post, mock_cloudinary_upload
+    ):
+        """Test images added while editing are processed like new posts."""
+        buffer = BytesIO()
+        Image.new("RGB", (2000, 1000), color="red").save(buffer, "PNG")
+        response = authenticated_client.post(
+            reverse("post_update", kwargs={"pk": post.pk}),
+            {
+                "caption": post.caption,
+                "images-TOTAL_FORMS": "1",
+                "images-INITIAL_FORMS": "0",
+                "images-MIN_NUM_FORMS": "0",
+                "images-MAX_NUM_FORMS": "10",
+                "images-0-image": SimpleUploadedFile(
+                    "new.png", buffer.getvalue(), content_type="image/png"
+                ),
+            },
+        )
+        assert response.status_code == 302
+        image = post.images.get()
+        assert (image.width, image.height) == (1080, 540)
+        assert image.placeholder.startswith("data:image/")
+
 
 class TestPostDeleteView:
     """Tests for PostDeleteView."""
@@ -384,6 +512,44 @@ class TestToggleLikeView:
         assert data["likes_count"] == 0
 
 
+class TestUpdateImageOrderView:
+    """Tests for update_image_order view."""
+
+    def reorder(self, client, post, order):
+        """Post a new image order."""
+        return client.post(
+            reverse("reorder_images", kwargs={"pk": post.pk}),
+            data={"order": order},
+            content_type="application/json",
+        )
+
+    def test_reorder(self, authenticated_client, post):
+        """Test images are stored in the submitted order."""
+        first = PostImage.objects.create(post=post, image="p/1", order=1)
+        second = PostImage.objects.create(post=post, image="p/2", order=2)
+        response = self.reorder(
+            authenticated_client, post, [second.pk, first.pk]
+        )
+        assert response.status_code == 200
+        assert list(post.images.values_list("pk", flat=True)) == [
+            second.pk,
+            first.pk,
+        ]
+
+    def test_reorder_foreign_image(self, authenticated_client, post, user2):
+        """Test images of other posts are rejected."""
+        other = Post.objects.create(author=user2)
+        image = PostImage.objects.create(post=other, image="p/1")
+        response = self.reorder(authenticated_client, post, [image.pk])
+        assert response.status_code == 400
+        assert PostImage.objects.get(pk=image.pk).order == 0
+
+    def test_reorder_invalid_ids(self, authenticated_client, post):
+        """Test malformed ids are rejected."""
+        response = self.reorder(authenticated_client, post, [{"id": 1}])
+        assert response.status_code == 400
+
+
 class TestTagPostsView:
     """Tests for TagPostsView."""
 